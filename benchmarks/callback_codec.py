@@ -0,0 +1,41 @@
+"""
+Разбор callback_data кнопок заказа и максимальный размер данных:
+прежний формат 'received_%@!#@$<username>_%@!#@$<order_id>' против двоичного кодека.
+
+Запуск: python benchmarks/callback_codec.py [повторов]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from callback_data import OrderAction, decode_order_callback, encode_order_callback  # noqa: E402
+
+# Самый длинный username в Telegram - 32 символа, номер заказа - время в секундах
+LONGEST_USERNAME = 'u' * 32
+LEGACY_ORDER_ID = 1_900_000_000
+
+
+def legacy_parse(data):
+    action, username, order_id = data.split('_%@!#@$')
+    return action, username, int(order_id)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    legacy_data = f"confirm_order_%@!#@${LONGEST_USERNAME}_%@!#@${LEGACY_ORDER_ID}"
+    codec_data = encode_order_callback(OrderAction.CONFIRM, 2 ** 64 - 1)
+
+    legacy_time = timeit.timeit(lambda: legacy_parse(legacy_data), number=repeats) / repeats
+    codec_time = timeit.timeit(lambda: decode_order_callback(codec_data), number=repeats) / repeats
+
+    print(f"{'формат':<12}{'макс. байт':>12}{'разбор, нс':>14}")
+    print(f"{'прежний':<12}{len(legacy_data.encode()):>12}{legacy_time * 1e9:>14.0f}")
+    print(f"{'кодек v1':<12}{len(codec_data.encode()):>12}{codec_time * 1e9:>14.0f}")
+    print("лимит Telegram: 64 байта; прежний формат с полным username не помещается в него")
+
+
+if __name__ == '__main__':
+    main()
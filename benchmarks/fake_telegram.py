@@ -0,0 +1,203 @@
+"""
+Локальный сервер, изображающий Telegram Bot API.
+
+Отвечает на методы, которыми пользуется бот, раздаёт обновления через getUpdates
+или доставляет их на webhook и засекает время от нажатия кнопки до правки сообщения.
+"""
+import itertools
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Eastwoods', 'username': 'eastwoods_bot'}
+
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Гость {user_id}', 'username': f'guest{user_id}'}
+
+
+def chat(chat_id):
+    return {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group', 'title': 'Бариста'}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь соединений по умолчанию (5) переполняется при нескольких потоках бота,
+    # и лишние соединения повторяются только через секунду
+    request_queue_size = 256
+
+
+class FakeTelegram:
+    """
+    Сервер Bot API на 127.0.0.1.
+
+    :param api_latency: Задержка ответа на каждый вызов API, изображающая сеть до Telegram.
+    :param webhook_connections: Сколько обновлений одновременно доставляется на webhook.
+    """
+
+    def __init__(self, api_latency=0.0, webhook_connections=40):
+        self.api_latency = api_latency
+        self.webhook_url = None
+        self.calls = {}
+        # Вызовы, которые бот передал в ответах на запросы webhook
+        self.webhook_calls = {}
+        self.started_at = {}
+        self.latencies = []
+
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self._callback_ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._replies = {}
+        self._closed = False
+        self._delivery = ThreadPoolExecutor(max_workers=webhook_connections)
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length else b''
+                params = json.loads(body) if body else {}
+                method = self.path.rsplit('/', 1)[-1]
+                result = fake.handle(method, params)
+                payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.base_url = f'http://127.0.0.1:{self.port}/bot'
+        threading.Thread(target=self.server.serve_forever, name='fake-telegram', daemon=True).start()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self.server.shutdown()
+        self._delivery.shutdown(wait=False)
+
+    # --- Bot API ---
+
+    def handle(self, method, params):
+        with self._condition:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if self.api_latency:
+            time.sleep(self.api_latency)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getMyCommands':
+            return []
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url') or None
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'sendMessage':
+            message = self._message(int(params['chat_id']), next(self._message_ids), params.get('text', ''))
+            self._reply(('chat', message['chat']['id']), message)
+            return message
+        if method == 'editMessageText':
+            message = self._message(int(params['chat_id']), int(params['message_id']), params.get('text', ''))
+            self._reply(('message', message['chat']['id'], message['message_id']), message)
+            return message
+        return True
+
+    def _get_updates(self, params):
+        # PTB передаёт числа строками
+        offset = int(params.get('offset') or 0)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self._condition:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates and not self._closed and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            updates, self._updates = self._updates[:100], self._updates[100:]
+            return updates
+
+    @staticmethod
+    def _message(chat_id, message_id, text):
+        return {'message_id': message_id, 'date': int(time.time()), 'chat': chat(chat_id), 'from': BOT_USER,
+                'text': text}
+
+    def _reply(self, key, message):
+        with self._condition:
+            started = self.started_at.pop(key, None)
+            if started is not None:
+                self.latencies.append(time.perf_counter() - started)
+                self._replies[key] = message
+                self._condition.notify_all()
+
+    # --- Обновления от «пользователей» ---
+
+    def push(self, update, key):
+        """
+        Отправить обновление боту и ждать ответа с ключом ``key``.
+
+        :param update: Обновление без update_id.
+        :param key: ('chat', chat_id) для нового сообщения или ('message', chat_id, message_id) для правки.
+        """
+        with self._condition:
+            update['update_id'] = next(self._update_ids)
+            self.started_at[key] = time.perf_counter()
+            if self.webhook_url is None:
+                self._updates.append(update)
+                self._condition.notify_all()
+                return
+        self._delivery.submit(self._deliver, update)
+
+    def _deliver(self, update):
+        request = urllib.request.Request(self.webhook_url, data=json.dumps(update).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        body = urllib.request.urlopen(request).read()
+        method = json.loads(body).get('method') if body else None
+        if method:
+            with self._condition:
+                self.webhook_calls[method] = self.webhook_calls.get(method, 0) + 1
+
+    def send_command(self, user_id, text):
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        update = {'message': {'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': chat(user_id),
+                              'from': user(user_id), 'text': text, 'entities': entities}}
+        self.push(update, ('chat', user_id))
+        return ('chat', user_id)
+
+    def press(self, user_id, message, data, chat_id=None):
+        chat_id = chat_id if chat_id is not None else user_id
+        update = {'callback_query': {'id': str(next(self._callback_ids)), 'from': user(user_id),
+                                     'chat_instance': str(chat_id), 'data': data,
+                                     'message': dict(message, chat=chat(chat_id))}}
+        key = ('message', chat_id, message['message_id'])
+        self.push(update, key)
+        return key
+
+    def wait(self, keys, timeout=60):
+        """Дождаться ответов бота на все ключи и вернуть присланные сообщения."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not all(key in self._replies for key in keys):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    missing = [key for key in keys if key not in self._replies]
+                    raise TimeoutError(f"Бот не ответил на {len(missing)} обновлений, например {missing[:3]}")
+                self._condition.wait(remaining)
+            return [self._replies.pop(key) for key in keys]
+
+    def wait_for_call(self, method, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not self.calls.get(method):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Бот так и не вызвал {method}")
+            time.sleep(0.01)
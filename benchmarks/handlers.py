@@ -0,0 +1,116 @@
+"""
+Процессорное время обработчиков на одно нажатие кнопки при большом меню:
+прежняя сборка клавиатур на каждый вызов против индекса меню и готовых клавиатур.
+Оба варианта отвечают через один и тот же CallbackReplies.edit, так что разница - только
+в поиске по меню и сборке клавиатуры.
+
+Запуск: python benchmarks/handlers.py [напитков] [повторов]
+"""
+import itertools
+import logging
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+from benchmarks.stubs import BOT_CONFIG, import_bot, synthetic_menu_values  # noqa: E402
+from menu import Menu, parse_drinks, parse_names  # noqa: E402
+
+
+# Каждое нажатие - в своём сообщении, чтобы CallbackReplies не пропускал правки как повторные
+_ids = itertools.count(1)
+
+
+class FakeQuery:
+    def __init__(self, data):
+        self.data = data
+        self.id = str(next(_ids))
+        self.inline_message_id = None
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=1), message_id=int(self.id), text=None,
+                                       reply_markup=None)
+
+    def answer(self, *args, **kwargs):
+        pass
+
+    def edit_message_text(self, text, reply_markup=None, **kwargs):
+        pass
+
+    def edit_message_reply_markup(self, reply_markup=None, **kwargs):
+        pass
+
+
+def callback(data):
+    user = SimpleNamespace(id=1, username='customer')
+    return SimpleNamespace(callback_query=FakeQuery(data), effective_user=user), SimpleNamespace(user_data={})
+
+
+# Прежние обработчики: линейный поиск по меню и сборка клавиатуры на каждый вызов
+def legacy_drink_type(replies, update, menu):
+    desired_type = update.callback_query.data.split('_')[1]
+    matched = [drink for drink, properties in menu.drinks.items() if properties.get('Тип напитка') == desired_type]
+    replies.edit(update.callback_query, "Выберете напиток:", InlineKeyboardMarkup(
+        [[InlineKeyboardButton(drink, callback_data=f'drink_{drink}')] for drink in matched]))
+
+
+def legacy_volume_prompt(replies, update, menu, drink):
+    volumes = [volume for volume, status in menu.drinks[drink].items()
+               if volume != 'Молоко' and volume != 'Тип напитка' and status == '+']
+    replies.edit(update.callback_query, "Выберите объем:", InlineKeyboardMarkup(
+        [[InlineKeyboardButton(volume, callback_data=f'volume_{volume}')] for volume in volumes]))
+
+
+def legacy_syrups_prompt(replies, update, menu):
+    replies.edit(update.callback_query, "Выберите сироп:", InlineKeyboardMarkup(
+        [[InlineKeyboardButton(syrup, callback_data=f'syrup_{syrup}')] for syrup in menu.syrups]))
+
+
+def per_call(func, repeats):
+    started = time.process_time()
+    for _ in range(repeats):
+        func()
+    return (time.process_time() - started) / repeats * 1e6
+
+
+def main():
+    drinks_count = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    # Правки тратят лимиты очереди: снимаем их, иначе замер упрётся в лимит, а не в процессор
+    bot = import_bot(dict(BOT_CONFIG, telegram_bot=dict(
+        BOT_CONFIG['telegram_bot'], outbound={'global_per_second': 10 ** 9, 'private_per_second': 10 ** 9})))
+    logging.disable(logging.INFO)
+    values = synthetic_menu_values(drinks=drinks_count)
+    started = time.perf_counter()
+    menu = Menu(parse_drinks(values['Напитки']), parse_names(values['Молоко']), parse_names(values['Сиропы']))
+    build = time.perf_counter() - started
+    bot.menu_store.publish(menu)
+    drink = 'Напиток 301'
+
+    def volume_prompt():
+        # syrup_2 берёт напиток из user_data
+        update, context = callback('syrup_Сироп 1')
+        context.user_data['drink'] = drink
+        bot.syrup_2(update, context)
+
+    replies = bot.replies
+    cases = [
+        ('drink_type', lambda: legacy_drink_type(replies, callback('drink_Тип 7')[0], menu),
+         lambda: bot.drink_type(*callback('drink_Тип 7'))),
+        ('syrup_2 -> объём', lambda: legacy_volume_prompt(replies, callback('syrup_Сироп 1')[0], menu, drink),
+         volume_prompt),
+        ('approve_syrup', lambda: legacy_syrups_prompt(replies, callback('syrup_Давайте два')[0], menu),
+         lambda: bot.approve_syrup(*callback('syrup_Давайте два'))),
+    ]
+
+    print(f"напитков: {drinks_count}, построение индекса и клавиатур: {build * 1000:.1f} мс на версию меню")
+    print(f"{'обработчик':<20}{'раньше, мкс':>14}{'с индексом, мкс':>18}")
+    for name, legacy, indexed in cases:
+        print(f"{name:<20}{per_call(legacy, repeats):>14.1f}{per_call(indexed, repeats):>18.1f}")
+
+
+if __name__ == '__main__':
+    main()
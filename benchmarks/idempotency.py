@@ -0,0 +1,50 @@
+"""
+Защита от повторных нажатий под длительной нагрузкой: время проверки ключа
+и память кэша, когда уникальных нажатий намного больше, чем он помнит.
+
+Запуск: python benchmarks/idempotency.py [нажатий]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from idempotency import IdempotencyCache  # noqa: E402
+
+
+def tap(number):
+    # Ключ того же вида, что tap_key в main.py
+    return 'tap', -100, number // 3, 1700000000.0 + number, '~AQMAAAAAAAAAKg'
+
+
+def run(cache, taps):
+    duplicates = 0
+    for number in range(taps):
+        # Каждое десятое нажатие - двойной тап
+        duplicates += cache.seen(tap(number - number % 10 // 9))
+    assert duplicates == taps // 10
+    return cache
+
+
+def main():
+    taps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    print(f"{'max_size':>10}{'нажатий':>10}{'мкс на проверку':>18}{'ключей':>9}{'память, КБ':>12}{'пик, КБ':>10}")
+    for max_size in (1000, 20000, 100000):
+        started = time.perf_counter()
+        run(IdempotencyCache(ttl=600, max_size=max_size), taps)
+        elapsed = time.perf_counter() - started
+
+        # Память считается отдельным прогоном: tracemalloc замедляет каждую проверку
+        tracemalloc.start()
+        cache = run(IdempotencyCache(ttl=600, max_size=max_size), taps)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{max_size:>10}{taps:>10}{elapsed / taps * 1e6:>18.2f}{len(cache):>9}"
+              f"{current / 1024:>12.0f}{peak / 1024:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
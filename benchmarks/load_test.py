@@ -0,0 +1,576 @@
+"""
+Нагрузочный тест: N покупателей одновременно проходят весь разговор от /start
+до подтверждения заказа, а баристы тем временем принимают и выдают заказы.
+
+Обновления проходят через настоящий диспетчер и ConversationHandler из main.build_updater,
+а вместо HTTP-запросов к Telegram бот обращается к заглушке с задержкой сети.
+Отчёт: пропускная способность, p50/p95/p99 времени каждого обработчика и отклика бота,
+прирост памяти по tracemalloc. С --json результаты дописываются в файл строкой JSON,
+чтобы сравнивать прогоны между собой.
+
+С --double-tap доля покупателей и барист нажимает кнопки, меняющие заказ, дважды,
+как на медленной связи; отчёт показывает, сколько заказов и вызовов API до бота дошло.
+С --stations N заказы распределяются по N стойкам, у каждой свой чат и свои баристы;
+вместе с --group-per-minute видно, как стойки обходят лимит Telegram на сообщения в один чат.
+
+Запуск: python benchmarks/load_test.py [--customers N] [--orders N] [--baristas N] [--stations N]
+                                       [--workers N] [--api-latency сек] [--json файл]
+"""
+import argparse
+import datetime
+import gc
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from functools import wraps
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram import Bot, Update  # noqa: E402
+from telegram.ext import ConversationHandler  # noqa: E402
+from telegram.utils.request import Request  # noqa: E402
+
+from benchmarks.fake_telegram import BOT_USER, chat, user  # noqa: E402
+from benchmarks.stubs import BOT_CONFIG, MENU_VALUES, import_bot  # noqa: E402
+from callback_data import OrderAction, decode_order_callback  # noqa: E402
+from menu import Menu, parse_drinks, parse_names  # noqa: E402
+from replies import BOT_CALLS_SAVED  # noqa: E402
+
+# Кнопки, которые нажимает покупатель после /start: путь проходит все девять шагов разговора
+FLOW = ['drink_Классика', 'drink_Латте', 'milk_Овсяное', 'syrup_Давайте два', 'syrup_Ваниль',
+        'syrup_Карамель', 'volume_350', 'temperature_Горячий', 'confirm']
+# Обработчики, которые отвечают на шаги покупателя: /start и кнопки из FLOW
+CUSTOMER_STEPS = ['start', 'drink_type', 'drink', 'milk', 'approve_syrup', 'syrup_1', 'syrup_2', 'volume',
+                  'temperature', 'process_user_choice']
+
+# Чат первой стойки, чаты следующих идут по убыванию
+BARISTA_CHAT_ID = -100
+# Идентификаторы покупателей начинаются с 1, баристы идут после них
+BARISTA_USER_ID = 10 ** 9
+# Пауза баристы перед новым /coffee_ready, когда очередь пуста
+IDLE_POLL = 0.05
+# Через сколько секунд повторить действие, если бот на него не ответил
+RESEND_AFTER = 2.0
+# Через сколько секунд после первого нажатия приходит второе при двойном тапе
+DOUBLE_TAP_DELAY = 0.3
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+class FakeRequest(Request):
+    """
+    HTTP-слой бота без сети: отвечает на вызовы Bot API из памяти через ``api_latency`` секунд
+    и передаёт каждое отправленное или изменённое сообщение в нагрузочный тест.
+    """
+
+    def __init__(self, load_test, api_latency):
+        self.load_test = load_test
+        self.api_latency = api_latency
+        self._message_ids = itertools.count(1000)
+
+    @property
+    def con_pool_size(self):
+        # Соединений не бывает, а Updater проверяет, что их хватит на все потоки
+        return sys.maxsize
+
+    def stop(self):
+        pass
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+        if self.api_latency:
+            time.sleep(self.api_latency)
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getMyCommands':
+            return []
+        self.load_test.count_call(method)
+        if method in ('sendMessage', 'editMessageText'):
+            # Бот передаёт идентификатор чата баристы строкой из конфига
+            chat_id = int(data['chat_id'])
+            message_id = int(data['message_id']) if method == 'editMessageText' else next(self._message_ids)
+            message = {'message_id': message_id, 'date': int(time.time()), 'chat': chat(chat_id), 'from': BOT_USER,
+                       'text': data.get('text', '')}
+            markup = data.get('reply_markup')
+            if markup:
+                message['reply_markup'] = json.loads(markup) if isinstance(markup, str) else markup
+            self.load_test.on_message(method, message)
+            return message
+        return True
+
+
+class Actor:
+    """Покупатель или бариста, ожидающий ответа бота на своё последнее действие."""
+
+    def __init__(self, user_id, chat_id, index=0):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.index = index
+        self.step = 0
+        self.orders_left = 0
+        self.message = None
+        self.confirmed_at = deque()
+        # Чего ждём: ключ сообщения, обязательная часть текста и имя отвечающего обработчика
+        self.key = None
+        self.expect = None
+        self.handler = None
+        self.sent_at = 0.0
+        self.resend_at = 0.0
+        self.action = None
+
+
+class LoadTest:
+    """
+    Прогон покупателей и барист через диспетчер бота.
+
+    :param bot_module: Импортированный main.
+    :param customers: Сколько покупателей заказывают одновременно.
+    :param orders: Сколько заказов подряд делает каждый покупатель.
+    :param baristas: Сколько барист одновременно выдают заказы из очереди.
+    :param think_time: Пауза покупателя между ответом бота и следующим нажатием.
+    :param ramp: За сколько секунд равномерно приходят все покупатели.
+    :param stations: Сколько стоек, баристы распределяются по ним по очереди.
+    :param double_tap: Доля нажатий «Подтвердить заказ», «Заказ получил» и «Заказ готов», которые повторяются.
+    """
+
+    def __init__(self, bot_module, customers, orders, baristas, think_time, ramp, stations=1, double_tap=0.0):
+        self.bot_module = bot_module
+        self.think_time = think_time
+        self.ramp = ramp
+        self.total_orders = customers * orders
+
+        self.customers = {user_id: Actor(user_id, user_id) for user_id in range(1, customers + 1)}
+        for customer in self.customers.values():
+            customer.orders_left = orders
+        self.station_chats = [BARISTA_CHAT_ID - index for index in range(stations)]
+        self.baristas = [Actor(BARISTA_USER_ID + index, self.station_chats[index % stations], index // stations)
+                         for index in range(baristas)]
+
+        self.handler_times = defaultdict(list)
+        self.response_times = defaultdict(list)
+        self.lead_times = []
+        self.updates = 0
+        self.resends = 0
+        self.busy = 0
+        self.ready = 0
+        self.double_tap = double_tap
+        self.double_taps = 0
+        self.api_calls = defaultdict(int)
+        # Сколько раз бот сообщил баристам о новом заказе и покупателям о начале готовки
+        self.barista_orders = 0
+        self.started_cooking = 0
+        self._random = random.Random(1)
+        self.finished = threading.Event()
+        self.started_at = self.finished_at = None
+
+        self._condition = threading.Condition()
+        self._actions = []
+        self._sequence = itertools.count()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+        self.bot = None
+        self.dispatcher = None
+
+    # --- Бот ---
+
+    def instrument(self, dispatcher):
+        """Засекать время каждого обработчика, зарегистрированного в диспетчере."""
+        handlers = []
+        for group in dispatcher.handlers.values():
+            for handler in group:
+                if isinstance(handler, ConversationHandler):
+                    handlers.extend(handler.entry_points + handler.fallbacks)
+                    for state_handlers in handler.states.values():
+                        handlers.extend(state_handlers)
+                else:
+                    handlers.append(handler)
+        wrapped = {}
+        for handler in handlers:
+            if handler.callback not in wrapped:
+                wrapped[handler.callback] = self._timed(handler.callback)
+            handler.callback = wrapped[handler.callback]
+        # Кнопки заказов разбирает order_callback, а выполняют отдельные функции
+        actions = self.bot_module.ORDER_ACTIONS
+        for action, callback in list(actions.items()):
+            actions[action] = self._timed(callback)
+
+    def _timed(self, callback):
+        name = callback.__name__
+
+        @wraps(callback)
+        def wrapper(update, context, *args):
+            started = time.perf_counter()
+            try:
+                return callback(update, context, *args)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._condition:
+                    self.handler_times[name].append(elapsed)
+                    if name == 'answer_while_busy':
+                        # Нажатие пришло, пока бот обрабатывал предыдущее: покупатель нажмёт ещё раз
+                        self.busy += 1
+                        self._retry(update.effective_user.id)
+
+        return wrapper
+
+    def run(self, bot, dispatcher, timeout):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        driver = threading.Thread(target=self._drive, name='load-test', daemon=True)
+
+        self.started_at = time.perf_counter()
+        with self._condition:
+            for customer in self.customers.values():
+                delay = self.ramp * (customer.user_id - 1) / len(self.customers)
+                self._schedule(delay, self._customer_action, customer)
+            for barista in self.baristas:
+                self._schedule(0, self._barista_queue, barista)
+        driver.start()
+        completed = self.finished.wait(timeout)
+        self.finished.set()
+        driver.join()
+        return completed
+
+    # --- Действия ---
+
+    def _schedule(self, delay, func, actor):
+        heapq.heappush(self._actions, (time.monotonic() + delay, next(self._sequence), func, actor))
+        self._condition.notify()
+
+    def _drive(self):
+        next_scan = time.monotonic() + RESEND_AFTER / 2
+        while not self.finished.is_set():
+            with self._condition:
+                now = time.monotonic()
+                if now >= next_scan:
+                    self._resend_stuck(now)
+                    next_scan = now + RESEND_AFTER / 2
+                if not self._actions or self._actions[0][0] > now:
+                    timeout = self._actions[0][0] - now if self._actions else RESEND_AFTER / 2
+                    self._condition.wait(min(timeout, next_scan - now))
+                    continue
+                _, _, func, actor = heapq.heappop(self._actions)
+            func(actor)
+
+    def _resend_stuck(self, now):
+        for actor in itertools.chain(self.customers.values(), self.baristas):
+            if actor.key is not None and actor.resend_at <= now:
+                self.resends += 1
+                actor.resend_at = now + RESEND_AFTER
+                self._schedule(0, actor.action, actor)
+
+    def _retry(self, user_id):
+        actor = self.customers.get(user_id)
+        if actor is not None and actor.key is not None:
+            self._schedule(max(self.think_time, 0.01), actor.action, actor)
+
+    def _wait(self, actor, func, key, handler, expect=None):
+        with self._condition:
+            if actor.action is not func or actor.key != key:
+                actor.sent_at = time.perf_counter()
+                if handler == CUSTOMER_STEPS[-1]:
+                    # Время выдачи считается от нажатия «Подтвердить заказ»
+                    actor.confirmed_at.append(actor.sent_at)
+            actor.action = func
+            actor.key = key
+            actor.expect = expect
+            actor.handler = handler
+            actor.resend_at = time.monotonic() + RESEND_AFTER
+
+    def _put(self, update):
+        update['update_id'] = next(self._update_ids)
+        with self._condition:
+            self.updates += 1
+        self.dispatcher.update_queue.put(Update.de_json(update, self.bot))
+
+    def _command(self, actor, text):
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+        self._put({'message': {'message_id': next(self._message_ids), 'date': int(time.time()),
+                               'chat': chat(actor.chat_id), 'from': user(actor.user_id), 'text': text,
+                               'entities': entities}})
+
+    def _press(self, actor, message, data):
+        self._put({'callback_query': {'id': str(next(self._callback_ids)), 'from': user(actor.user_id),
+                                      'chat_instance': str(actor.chat_id), 'data': data, 'message': message}})
+
+    def _maybe_double_tap(self, actor, message, data):
+        # Второе нажатие той же кнопки приходит, когда первое уже обработано
+        with self._condition:
+            if self._random.random() >= self.double_tap:
+                return
+            self.double_taps += 1
+            self._schedule(DOUBLE_TAP_DELAY, lambda actor: self._press(actor, message, data), actor)
+
+    def count_call(self, method):
+        with self._condition:
+            self.api_calls[method] += 1
+
+    def _customer_action(self, customer):
+        if customer.step == 0:
+            self._wait(customer, self._customer_action, ('chat', customer.chat_id), 'start', 'Добро пожаловать')
+            self._command(customer, '/start')
+            return
+        message = customer.message
+        key = ('message', customer.chat_id, message['message_id'])
+        if customer.step == len(FLOW):
+            # Подтверждение заменяет сообщение с кнопками текстом заказа
+            self._wait(customer, self._customer_action, key, CUSTOMER_STEPS[-1], 'подтвержден')
+        else:
+            self._wait(customer, self._customer_action, key, CUSTOMER_STEPS[customer.step])
+        self._press(customer, message, FLOW[customer.step - 1])
+        if customer.step == len(FLOW):
+            self._maybe_double_tap(customer, message, FLOW[-1])
+
+    def _barista_queue(self, barista):
+        self._wait(barista, self._barista_queue, ('chat', barista.chat_id), 'coffee_ready')
+        self._command(barista, '/coffee_ready')
+
+    def _barista_press(self, barista):
+        message = barista.message
+        key = ('message', barista.chat_id, message['message_id'])
+        handler, data = barista.step
+        self._wait(barista, self._barista_press, key, handler)
+        self._press(barista, message, data)
+        if handler == 'confirm_order':
+            self._maybe_double_tap(barista, message, data)
+
+    # --- Ответы бота ---
+
+    def on_message(self, method, message):
+        now = time.perf_counter()
+        chat_id = message['chat']['id']
+        if method == 'sendMessage':
+            key = ('chat', chat_id)
+        else:
+            key = ('message', chat_id, message['message_id'])
+        with self._condition:
+            if self.finished.is_set():
+                return
+            if chat_id in self.station_chats:
+                self._on_barista_message(key, message, now)
+            else:
+                self._on_customer_message(self.customers[chat_id], key, message, now)
+
+    def _replied(self, actor, message, now):
+        self.response_times[actor.handler].append(now - actor.sent_at)
+        actor.key = None
+        actor.message = message
+
+    def _on_customer_message(self, customer, key, message, now):
+        text = message['text']
+        if text.startswith('Начали готовить'):
+            self.started_cooking += 1
+            return
+        if text.startswith('Ваш заказ готов'):
+            # Заказы одного покупателя выдаются по порядку подтверждения
+            self.lead_times.append(now - customer.confirmed_at.popleft())
+            self.ready += 1
+            if self.ready == self.total_orders:
+                self.finished_at = now
+                self.finished.set()
+            return
+        if customer.key != key or (customer.expect and customer.expect not in text):
+            return
+
+        self._replied(customer, message, now)
+        if customer.step == len(FLOW):
+            customer.orders_left -= 1
+            if not customer.orders_left:
+                return
+            customer.step = 0
+        else:
+            customer.step += 1
+        self._schedule(self.think_time, self._customer_action, customer)
+
+    def _on_barista_message(self, key, message, now):
+        if message['text'].startswith('Новый заказ'):
+            if key[0] != 'chat':
+                # Бот убрал кнопку «Заказ получил»
+                return
+            # Первая бариста стойки принимает каждый новый заказ, не дожидаясь ответа
+            self.barista_orders += 1
+            data = message['reply_markup']['inline_keyboard'][0][0]['callback_data']
+            first = next(barista for barista in self.baristas if barista.chat_id == key[1])
+            self._schedule(0, lambda barista: self._press(barista, message, data), first)
+            self._maybe_double_tap(first, message, data)
+            return
+
+        barista = next((barista for barista in self.baristas if barista.key == key), None)
+        if barista is None:
+            return
+        self._replied(barista, message, now)
+
+        buttons = {}
+        for row in message.get('reply_markup', {}).get('inline_keyboard', []):
+            for button in row:
+                try:
+                    action, _ = decode_order_callback(button.get('callback_data', ''))
+                except ValueError:
+                    continue
+                buttons.setdefault(action, []).append(button['callback_data'])
+
+        if OrderAction.CONFIRM in buttons:
+            barista.step = ('confirm_order', buttons[OrderAction.CONFIRM][0])
+        elif OrderAction.READY in buttons:
+            # Баристы берут разные заказы со страницы, чтобы реже сталкиваться
+            ready = buttons[OrderAction.READY]
+            barista.step = ('order_ready', ready[barista.index % len(ready)])
+        else:
+            # Очередь пуста или заказ уже выдала другая бариста
+            self._schedule(IDLE_POLL, self._barista_queue, barista)
+            return
+        self._schedule(0, self._barista_press, barista)
+
+
+def memory_report(before, after, top):
+    stats = after.compare_to(before, 'lineno')
+    growth = sum(stat.size_diff for stat in stats)
+    lines = [f"  {stat.size_diff / 1024:>+10.1f} КБ  {stat.traceback[0].filename}:{stat.traceback[0].lineno}"
+             for stat in stats[:top]]
+    return growth, lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--customers', type=int, default=500, help='сколько покупателей заказывают одновременно')
+    parser.add_argument('--orders', type=int, default=1, help='сколько заказов подряд делает каждый покупатель')
+    parser.add_argument('--baristas', type=int, default=2, help='сколько барист выдают заказы')
+    parser.add_argument('--stations', type=int, default=1, help='сколько стоек со своими чатами и очередями')
+    parser.add_argument('--group-per-minute', type=int, default=1000000,
+                        help='лимит сообщений бота в один групповой чат в минуту (у Telegram - 20)')
+    parser.add_argument('--double-tap', type=float, default=0.0,
+                        help='доля нажатий, меняющих заказ, которые приходят дважды (0..1)')
+    parser.add_argument('--workers', type=int, default=8, help='потоков обработчиков бота')
+    parser.add_argument('--api-latency', type=float, default=0.01, help='задержка каждого вызова Bot API, сек')
+    parser.add_argument('--think-time', type=float, default=0.05, help='пауза покупателя между нажатиями, сек')
+    parser.add_argument('--ramp', type=float, default=1.0, help='за сколько секунд приходят все покупатели')
+    parser.add_argument('--timeout', type=float, default=600, help='сколько ждать выдачи всех заказов, сек')
+    parser.add_argument('--no-tracemalloc', action='store_true', help='не считать память (быстрее)')
+    parser.add_argument('--top', type=int, default=5, help='сколько мест с наибольшим приростом памяти показать')
+    parser.add_argument('--json', help='дописать результаты строкой JSON в этот файл')
+    args = parser.parse_args()
+    if args.baristas < args.stations:
+        parser.error('на каждой стойке нужна хотя бы одна бариста')
+
+    stations = [{'name': f'Стойка {index + 1}', 'chat_id': BARISTA_CHAT_ID - index} for index in range(args.stations)]
+    config = dict(BOT_CONFIG, telegram_bot=dict(
+        BOT_CONFIG['telegram_bot'], barista_chat_id=str(BARISTA_CHAT_ID), stations=stations, workers=args.workers,
+        # Измеряем бота, а не лимиты Telegram, если лимит на чат не задан явно
+        outbound={'global_per_second': 100000, 'private_per_second': 1000,
+                  'group_per_minute': args.group_per_minute, 'workers': args.workers}))
+    bot_module = import_bot(config, tempfile.mkdtemp(prefix='eastwoods-load-'))
+    logging.disable(logging.INFO)
+    bot_module.menu_store.publish(Menu(parse_drinks(MENU_VALUES['Напитки']), parse_names(MENU_VALUES['Молоко']),
+                                       parse_names(MENU_VALUES['Сиропы'])))
+
+    load_test = LoadTest(bot_module, args.customers, args.orders, args.baristas, args.think_time, args.ramp,
+                         args.stations, args.double_tap)
+    bot = Bot(config['telegram_bot']['token'], request=FakeRequest(load_test, args.api_latency))
+    updater = bot_module.build_updater(bot)
+    dispatcher = updater.dispatcher
+    load_test.instrument(dispatcher)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    ready = threading.Event()
+    threading.Thread(target=dispatcher.start, kwargs={'ready': ready}, name='dispatcher', daemon=True).start()
+    ready.wait()
+    gc.collect()
+    before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+
+    completed = load_test.run(bot, dispatcher, args.timeout)
+
+    dispatcher.stop()
+    bot_module.outbox.stop()
+    bot_module.order_store.flush()
+    gc.collect()
+    if before is not None:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    bot_module.order_store.close()
+    bot_module.persistence.close()
+
+    elapsed = (load_test.finished_at or time.perf_counter()) - load_test.started_at
+    print(f"покупателей: {args.customers} x {args.orders} заказ., барист: {args.baristas}, стоек: {args.stations}, "
+          f"потоков: {args.workers}, задержка API: {args.api_latency * 1000:.0f} мс")
+    if not completed:
+        print(f"ВНИМАНИЕ: за {args.timeout:.0f} с выдано только {load_test.ready} из {load_test.total_orders} заказов")
+    print(f"обновлений: {load_test.updates} за {elapsed:.2f} с, {load_test.updates / elapsed:.0f} обновл./с, "
+          f"{load_test.ready / elapsed:.1f} заказов/с")
+    print(f"повторных нажатий: {load_test.busy} (бот был занят), повторов по таймауту: {load_test.resends}")
+    api_calls = sum(load_test.api_calls.values())
+    print(f"двойных нажатий: {load_test.double_taps}, новых заказов у барист: {load_test.barista_orders}, "
+          f"сообщений «Начали готовить»: {load_test.started_cooking} на {load_test.total_orders} заказов")
+    print(f"вызовов API: {api_calls}, {api_calls / max(1, load_test.ready):.1f} на выданный заказ ("
+          + ', '.join(f'{method} {count}' for method, count in sorted(load_test.api_calls.items())) + ')')
+    saved_calls = {f'{handler} {method}': child.value for (handler, method), child in BOT_CALLS_SAVED._items()}
+    print(f"сэкономлено вызовов API: {sum(saved_calls.values()):.0f}"
+          + (' (' + ', '.join(f'{name} {count:.0f}' for name, count in sorted(saved_calls.items())) + ')'
+             if saved_calls else ''))
+    if load_test.lead_times:
+        print(f"от подтверждения до выдачи: p50 {percentile(load_test.lead_times, 0.5) * 1000:.0f} мс, "
+              f"p99 {percentile(load_test.lead_times, 0.99) * 1000:.0f} мс")
+
+    results = {'handlers': {}, 'response': {}}
+    print(f"\n{'обработчик':<22}{'вызовов':>9}{'время обработчика, мс':>30}{'отклик бота, мс':>30}")
+    print(f"{'':<31}{'p50':>10}{'p95':>10}{'p99':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name in sorted(load_test.handler_times, key=lambda name: -len(load_test.handler_times[name])):
+        times = load_test.handler_times[name]
+        row = [percentile(times, share) * 1000 for share in (0.5, 0.95, 0.99)]
+        results['handlers'][name] = dict(zip(('count', 'p50', 'p95', 'p99'), [len(times)] + row))
+        responses = load_test.response_times.get(name)
+        if responses:
+            response_row = [percentile(responses, share) * 1000 for share in (0.5, 0.95, 0.99)]
+            results['response'][name] = dict(zip(('p50', 'p95', 'p99'), response_row))
+            tail = ''.join(f'{value:>10.1f}' for value in response_row)
+        else:
+            tail = f"{'-':>10}" * 3
+        print(f"{name:<22}{len(times):>9}" + ''.join(f'{value:>10.1f}' for value in row) + tail)
+
+    memory = None
+    if before is not None:
+        growth, lines = memory_report(before, after, args.top)
+        memory = {'growth_kb': growth / 1024, 'peak_kb': peak / 1024,
+                  'per_order_bytes': growth / max(1, load_test.ready)}
+        print(f"\nпамять: прирост {growth / 1024:+.0f} КБ ({memory['per_order_bytes']:.0f} Б на заказ), "
+              f"пик {peak / 1024 / 1024:.1f} МБ; больше всего выросло:")
+        print('\n'.join(lines))
+
+    if args.json:
+        record = {'time': datetime.datetime.now().isoformat(timespec='seconds'), 'revision': git_revision(),
+                  'params': vars(args), 'completed': completed, 'updates': load_test.updates,
+                  'elapsed': elapsed, 'updates_per_second': load_test.updates / elapsed,
+                  'orders_per_second': load_test.ready / elapsed, 'busy': load_test.busy,
+                  'resends': load_test.resends, 'double_taps': load_test.double_taps,
+                  'barista_orders': load_test.barista_orders, 'api_calls': dict(load_test.api_calls),
+                  'saved_calls': saved_calls,
+                  'memory': memory, **results}
+        with open(args.json, 'a', encoding='utf-8') as results_file:
+            results_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
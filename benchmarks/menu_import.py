@@ -0,0 +1,102 @@
+"""
+Цена импорта и разбора меню: время импорта и пиковая память процесса (RSS)
+для menu и main сейчас и с pandas, который раньше тянул за собой menu,
+а также время разбора листов через DataFrame и без него.
+
+Каждый импорт измеряется в отдельном чистом процессе.
+
+Запуск: python benchmarks/menu_import.py [повторов]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+PROBE = '''
+import resource, sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - started
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'pandas' in sys.modules)
+'''
+
+BOT = '''
+import logging
+from benchmarks.stubs import import_bot
+bot = import_bot()
+'''
+
+CASES = [
+    ('пустой интерпретатор', ''),
+    ('import menu', 'import menu'),
+    ('import pandas + menu (прежде)', 'import pandas\nimport menu'),
+    ('import main', BOT),
+    ('import pandas + main (прежде)', 'import pandas\n' + BOT),
+]
+
+
+def probe(imports, repeats):
+    times, peaks = [], []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(root=ROOT, imports=imports)],
+                                capture_output=True, text=True, check=True).stdout.split()
+        times.append(float(output[0]))
+        peaks.append(int(output[1]))
+        has_pandas = output[2] == 'True'
+    return statistics.median(times), statistics.median(peaks), has_pandas
+
+
+def parse_times(repeats):
+    import pandas as pd
+
+    from benchmarks.stubs import synthetic_menu_values
+    from menu import parse_drinks, parse_names
+
+    values = synthetic_menu_values()
+
+    def legacy_frame(rows):
+        df = pd.DataFrame(rows)
+        df.columns = df.iloc[0]
+        df = df[1:]
+        df.reset_index(drop=True, inplace=True)
+        return df
+
+    def legacy():
+        legacy_frame(values['Напитки']).set_index('Название').to_dict(orient='index')
+        legacy_frame(values['Молоко'])['Название'].tolist()
+        legacy_frame(values['Сиропы'])['Название'].tolist()
+
+    def current():
+        parse_drinks(values['Напитки'])
+        parse_names(values['Молоко'])
+        parse_names(values['Сиропы'])
+
+    result = []
+    for func in (legacy, current):
+        started = time.perf_counter()
+        for _ in range(repeats):
+            func()
+        result.append((time.perf_counter() - started) / repeats)
+    return result
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print(f"{'':<32}{'импорт, мс':>12}{'RSS, МБ':>10}{'pandas':>8}")
+    for title, imports in CASES:
+        elapsed, peak, has_pandas = probe(imports, repeats)
+        # ru_maxrss в Linux - в килобайтах
+        print(f"{title:<32}{elapsed * 1000:>12.0f}{peak / 1024:>10.1f}{'да' if has_pandas else 'нет':>8}")
+
+    legacy, current = parse_times(repeats * 20)
+    print(f"\nразбор меню из 600 напитков: DataFrame {legacy * 1000:.2f} мс, без pandas {current * 1000:.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Сравнение загрузки меню: старая схема (авторизация и открытие таблицы на каждый лист)
+против MenuLoader с одним клиентом и batchGet.
+
+Запуск: python benchmarks/menu_load.py [задержка_сек] [повторы]
+"""
+import os
+import statistics
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.stubs import StubSheetsClient, stub_client_factory  # noqa: E402
+from menu import MENU_SHEETS, MenuLoader  # noqa: E402
+
+
+def legacy_frame(values):
+    # Прежний разбор листа через DataFrame
+    df = pd.DataFrame(values)
+    df.columns = df.iloc[0]
+    df = df[1:]
+    df.reset_index(drop=True, inplace=True)
+    return df
+
+
+def legacy_load(client):
+    # Повторяет прежний load_menu_data: три независимых load_data_from_sheet
+    factory = stub_client_factory(client)
+    frames = {}
+    for name in MENU_SHEETS:
+        gc = factory('keys.json')
+        worksheet = gc.open('menu').worksheet(name)
+        frames[name] = legacy_frame(worksheet.get_all_values())
+    return frames
+
+
+def measure(func, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def main():
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    client = StubSheetsClient(latency=latency)
+    legacy = measure(lambda: legacy_load(client), repeats)
+    legacy_trips = client.round_trips / repeats
+
+    client = StubSheetsClient(latency=latency)
+    loader = MenuLoader('keys.json', 'menu', client_factory=stub_client_factory(client))
+    started = time.perf_counter()
+    loader.load()
+    cold = time.perf_counter() - started
+    cold_trips = client.round_trips
+    client.round_trips = 0
+    reload = measure(loader.load, repeats)
+    reload_trips = client.round_trips / repeats
+
+    print(f"задержка запроса: {latency * 1000:.0f} мс")
+    print(f"старая загрузка:          {legacy * 1000:8.1f} мс, запросов: {legacy_trips:.0f}")
+    print(f"MenuLoader, первый старт: {cold * 1000:8.1f} мс, запросов: {cold_trips}")
+    print(f"MenuLoader, /update_menu: {reload * 1000:8.1f} мс, запросов: {reload_trips:.0f}")
+    print("фазы последней загрузки: " + ", ".join(f"{phase} {seconds * 1000:.1f} мс"
+                                                   for phase, seconds in loader.timings.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Фоновое обновление меню: сколько запросов к Google уходит, когда таблица не меняется,
+и как часто читатели видят меню, собранное из разных версий. Затем бот дописывает в ту же
+таблицу журнал заказов: время изменения таблицы сдвигается, но меню не меняется, и проверяется,
+что меню не скачивается заново, а его версия и клавиатуры остаются прежними.
+
+Запуск: python benchmarks/menu_refresh.py [проверок]
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.stubs import StubSheetsClient, stub_client_factory  # noqa: E402
+from menu import MenuLoader, MenuStore  # noqa: E402
+
+ORDER_LOG_SHEET = 'Журнал заказов'
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    checks = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    client = StubSheetsClient(latency=0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = MenuStore(MenuLoader('keys.json', 'menu', client_factory=stub_client_factory(client)),
+                          os.path.join(tmp_dir, 'menu_snapshot.json'))
+        store.refresh()
+
+        client.round_trips = 0
+        for _ in range(checks):
+            store.refresh_if_changed()
+        idle_trips = client.round_trips
+
+        # Меняем таблицу на каждой проверке и параллельно читаем меню
+        stop = threading.Event()
+        torn = 0
+        reads = 0
+
+        def reader():
+            nonlocal torn, reads
+            while not stop.is_set():
+                menu = store.current
+                reads += 1
+                if set(menu.drink_types) != {properties['Тип напитка'] for properties in menu.drinks.values()}:
+                    torn += 1
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        client.round_trips = 0
+        for i in range(checks):
+            client.modified_time = f'2024-01-02T00:00:{i:02d}.000Z'
+            client.values['Напитки'][-1][1] = f'Тип {i}'
+            store.refresh_if_changed()
+        stop.set()
+        thread.join()
+        changed_trips = client.round_trips
+        changed_version = store.current.version
+
+        # Журнал заказов дописывается в ту же таблицу и сдвигает время её изменения
+        menu = store.current
+        loads = 0
+        load = store.loader.load
+
+        def counted_load():
+            nonlocal loads
+            loads += 1
+            return load()
+
+        store.loader.load = counted_load
+        client.round_trips = 0
+        for i in range(checks):
+            store.append_rows(ORDER_LOG_SHEET, [[f'событие {i}']], header=['Событие'])
+            store.refresh_if_changed()
+        assert loads == 0, f'меню скачано заново {loads} раз после дописываний журнала'
+        assert store.current.version == menu.version, 'журнал заказов сдвинул версию меню'
+        assert store.current.drink_types_markup is menu.drink_types_markup, 'меню пересобрано без изменений'
+        assert store.current.modified_time == client.modified_time
+        log_trips = client.round_trips
+
+    print(f"проверок без изменений: {checks}, запросов к Google: {idle_trips}")
+    print(f"проверок с изменениями: {checks}, запросов к Google: {changed_trips}, "
+          f"версия меню: {changed_version}")
+    print(f"дописываний журнала заказов: {checks}, запросов к Google: {log_trips}, загрузок меню: {loads}, "
+          f"версия меню осталась {store.current.version}")
+    print(f"чтений меню: {reads}, несогласованных: {torn}")
+
+
+if __name__ == '__main__':
+    main()
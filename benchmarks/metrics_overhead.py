@@ -0,0 +1,51 @@
+"""
+Цена метрик в горячем пути: вызов обработчика с обёрткой-гистограммой против
+вызова без неё и время подготовки ответа /metrics.
+
+Запуск: python benchmarks/metrics_overhead.py [вызовов]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from metrics import Counter, Histogram, Registry, timed_callback  # noqa: E402
+
+
+def handler(update, context):
+    return 1
+
+
+def per_call(func, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        func(None, None)
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+
+    plain = per_call(handler, calls)
+    wrapped = per_call(timed_callback(handler, 'select_drink'), calls)
+    print(f"обработчик без метрик: {plain:.0f} нс, с гистограммой: {wrapped:.0f} нс "
+          f"(+{wrapped - plain:.0f} нс на вызов)")
+
+    # Ответ /metrics для набора метрик размером с бота
+    registry = Registry()
+    seconds = Histogram('handler_seconds', 'Время обработчика', ['handler', 'state'], registry=registry)
+    orders = Counter('orders_total', 'Заказы', ['outcome'], registry=registry)
+    for number in range(20):
+        seconds.labels(f'handler_{number}', f'state_{number}').observe(0.01)
+    for outcome in ('confirmed', 'cancelled', 'completed'):
+        orders.labels(outcome).inc()
+    renders = 1000
+    started = time.perf_counter()
+    for _ in range(renders):
+        registry.render()
+    print(f"/metrics: {(time.perf_counter() - started) / renders * 1e6:.0f} мкс на ответ")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Выгрузка журнала заказов в Google Таблицу через локальную очередь.
+
+Час пик: сколько запросов к Sheets API и сколько времени в обработчике уходит на событие
+при записи каждой строки отдельным запросом и при пакетной выгрузке раз в ``flush_interval``.
+Затем таблица недоступна несколько выгрузок подряд, а бот падает с недописанной строкой
+в очереди и запускается заново. Проверяется, что каждое событие попало в журнал ровно один раз.
+Листа журнала в таблице сначала нет: первая выгрузка создаёт его вместе с заголовком.
+
+Запуск: python benchmarks/order_export.py [заказов] [задержка Sheets API, мс]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.stubs import StubSheetsClient, stub_client_factory  # noqa: E402
+from menu import MenuLoader  # noqa: E402
+from order_log import ORDER_LOG_HEADER, OrderLogExporter  # noqa: E402
+from orders import Order  # noqa: E402
+
+SHEET = 'Журнал заказов'
+
+
+def new_loader(client):
+    loader = MenuLoader('keys.json', 'menu', client_factory=stub_client_factory(client))
+    # Авторизация и открытие таблицы не относятся к выгрузке
+    loader.spreadsheet
+    client.round_trips = 0
+    return loader
+
+
+def events(orders, first_id=1):
+    for order_id in range(first_id, first_id + orders):
+        order = Order(order_id, f'guest{order_id}', order_id, 'Латте, овсяное молоко, 350 мл')
+        yield 'Подтверждён', order
+        order.completed_at = order.created_at + 120
+        yield 'Выдан', order
+
+
+def append_rows(loader):
+    return lambda rows: loader.append_rows(SHEET, rows, header=ORDER_LOG_HEADER)
+
+
+def exported_keys(client):
+    rows = client.appended.get(SHEET, [])
+    assert rows[:1] == [ORDER_LOG_HEADER] and ORDER_LOG_HEADER not in rows[1:], 'нет заголовка журнала'
+    return Counter((row[2], row[1]) for row in rows[1:])
+
+
+def rush(orders, latency):
+    # Прежде: строка дописывается прямо в обработчике, одним запросом на событие
+    client = StubSheetsClient(latency=latency)
+    loader = new_loader(client)
+    started = time.perf_counter()
+    for event, order in events(orders):
+        loader.append_rows(SHEET, [[event, str(order.order_id), order.username, order.description]],
+                           header=ORDER_LOG_HEADER)
+    direct = (time.perf_counter() - started) / (orders * 2), client.round_trips
+
+    client = StubSheetsClient(latency=latency)
+    loader = new_loader(client)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        exporter = OrderLogExporter(os.path.join(tmp_dir, 'order_log.jsonl'), append_rows(loader))
+        record_seconds = 0.0
+        # Час пик длиной в десять интервалов выгрузки
+        for batch in _chunks(list(events(orders)), 10):
+            started = time.perf_counter()
+            for event, order in batch:
+                exporter.record(event, order)
+            record_seconds += time.perf_counter() - started
+            exporter.flush()
+        exporter.close()
+    assert sum(exported_keys(client).values()) == orders * 2
+    return direct, (record_seconds / (orders * 2), client.round_trips)
+
+
+def _chunks(items, parts):
+    size = -(-len(items) // parts)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def outage_and_restart(orders):
+    client = StubSheetsClient(latency=0)
+    loader = new_loader(client)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        spool_path = os.path.join(tmp_dir, 'order_log.jsonl')
+        exporter = OrderLogExporter(spool_path, append_rows(loader), batch_size=100)
+
+        # Таблица недоступна три выгрузки подряд, события копятся на диске
+        client.append_failures = 3
+        failed = 0
+        for event, order in events(orders):
+            exporter.record(event, order)
+        for _ in range(3):
+            try:
+                exporter.flush()
+            except ConnectionError:
+                failed += 1
+        pending_during_outage = len(exporter)
+        exporter.flush()
+        assert len(exporter) == 0
+
+        # Падение: часть событий уже в очереди, последняя строка дописана наполовину
+        for event, order in events(orders, first_id=orders + 1):
+            exporter.record(event, order)
+        exporter._spool.write(b'{"at": 1, "event": "\xd0\x92')
+        exporter._spool.close()
+
+        restarted = OrderLogExporter(spool_path, append_rows(loader), batch_size=100)
+        pending_after_restart = len(restarted)
+        restarted.flush()
+        restarted.close()
+        spool_size = os.path.getsize(spool_path)
+
+    keys = exported_keys(client)
+    assert len(keys) == orders * 4, 'потеряны события'
+    assert set(keys.values()) == {1}, 'события выгружены повторно'
+    return failed, pending_during_outage, pending_after_restart, spool_size
+
+
+def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 150) / 1000
+    logging.disable(logging.WARNING)
+
+    (direct_cost, direct_calls), (spool_cost, spool_calls) = rush(orders, latency)
+    print(f"Час пик: {orders} заказов, {orders * 2} событий, задержка Sheets API {latency * 1000:.0f} мс")
+    print(f"{'':>26}{'запросов':>10}{'в обработчике, мкс':>20}")
+    print(f"{'строка на событие':>26}{direct_calls:>10}{direct_cost * 1e6:>20.0f}")
+    print(f"{'очередь + пакеты':>26}{spool_calls:>10}{spool_cost * 1e6:>20.0f}")
+
+    failed, during_outage, after_restart, spool_size = outage_and_restart(orders)
+    print(f"Сбой таблицы: {failed} неудачных выгрузки, в очереди ждали {during_outage} событий")
+    print(f"Перезапуск: восстановлено {after_restart} событий, недописанная строка отброшена")
+    print(f"Все {orders * 4} событий в журнале ровно по одному разу, размер очереди после выгрузки {spool_size} байт")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Пропускная способность хранилища заказов: подтверждение, поиск и выдача заказа
+при десятках тысяч открытых заказов, в сравнении с прежним словарём списков.
+Затем перезапуск: проверяется, что поднимаются все открытые заказы, в том числе те,
+чья первая запись в базу не удалась, и что номера заказов после перезапуска не повторяются.
+
+Запуск: python benchmarks/orders.py [заказов] [пользователей]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from orders import Order, OrderStore  # noqa: E402
+
+
+def rate(count, seconds):
+    return f"{count / seconds:>12,.0f} оп/с"
+
+
+def legacy(order_ids, users):
+    user_orders = defaultdict(list)
+    started = time.perf_counter()
+    for order_id in order_ids:
+        user_orders[f'user{order_id % users}'].append({'order_id': order_id, 'chat_id': order_id, 'order': 'Латте'})
+    confirm = time.perf_counter() - started
+
+    lookups = random.sample(order_ids, min(len(order_ids), 2000))
+    started = time.perf_counter()
+    for order_id in lookups:
+        next(order for order in user_orders[f'user{order_id % users}'] if order['order_id'] == order_id)
+    lookup = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for order_id in lookups:
+        orders = user_orders[f'user{order_id % users}']
+        orders.remove(next(order for order in orders if order['order_id'] == order_id))
+    complete = time.perf_counter() - started
+    return confirm, len(lookups) / lookup, len(lookups) / complete
+
+
+def failed_commit_restart(tmp_dir):
+    path = os.path.join(tmp_dir, 'failing.db')
+    store = OrderStore(path, retry_interval=0.01)
+    commit = store._commit
+    failures = [OperationalError('INSERT', {}, 'database is locked')]
+
+    def flaky_commit(operations):
+        if failures:
+            raise failures.pop()
+        commit(operations)
+
+    store._commit = flaky_commit
+    for order_id in (store.next_order_id(), store.next_order_id()):
+        store.add(Order(order_id, 'guest', order_id, 'Латте'))
+    store.flush()
+    store.close()
+
+    reopened = OrderStore(path)
+    restored, next_id = len(reopened), reopened.next_order_id()
+    reopened.close()
+    assert restored == 2, f'после неудачной записи восстановлено {restored} заказов из 2'
+    assert next_id == 3, f'номер заказа {next_id} выдан повторно'
+    return restored
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 30000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    order_ids = list(range(1, count + 1))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'orders.db')
+        store = OrderStore(path)
+
+        started = time.perf_counter()
+        for order_id in order_ids:
+            store.add(Order(order_id, f'user{order_id % users}', order_id, 'Латте'))
+        confirm = time.perf_counter() - started
+        started = time.perf_counter()
+        store.flush()
+        confirm_flush = time.perf_counter() - started
+
+        lookups = random.sample(order_ids, count)
+        started = time.perf_counter()
+        for order_id in lookups:
+            store.get(order_id)
+        lookup = time.perf_counter() - started
+
+        half = lookups[:count // 2]
+        started = time.perf_counter()
+        for order_id in half:
+            store.complete(order_id)
+        complete = time.perf_counter() - started
+        store.flush()
+        store.close()
+
+        started = time.perf_counter()
+        reopened = OrderStore(path)
+        restore = time.perf_counter() - started
+        restored = len(reopened)
+        reopened.close()
+        assert restored == count - len(half), f'восстановлено {restored} открытых заказов из {count - len(half)}'
+
+        retried = failed_commit_restart(tmp_dir)
+
+    legacy_confirm, legacy_lookup, legacy_complete = legacy(order_ids, users)
+
+    print(f"открытых заказов: {count}, пользователей: {users}")
+    print(f"OrderStore подтверждение: {rate(count, confirm)} (дозапись в SQLite после: {confirm_flush * 1000:.0f} мс)")
+    print(f"OrderStore поиск:         {rate(count, lookup)}")
+    print(f"OrderStore выдача:        {rate(len(half), complete)}")
+    print(f"восстановление {restored} открытых заказов после перезапуска: {restore * 1000:.0f} мс")
+    print(f"после неудачной записи в базу и перезапуска восстановлено заказов: {retried} из 2")
+    print(f"словарь списков, подтверждение: {rate(count, legacy_confirm)}")
+    print(f"словарь списков, поиск:         {legacy_lookup:>12,.0f} оп/с")
+    print(f"словарь списков, выдача:        {legacy_complete:>12,.0f} оп/с")
+
+
+if __name__ == '__main__':
+    main()
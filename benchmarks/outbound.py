@@ -0,0 +1,251 @@
+"""
+Очередь исходящих сообщений против отправки прямо из обработчика.
+
+Поддельный Bot отвечает с задержкой сети и, как Telegram, возвращает 429 (RetryAfter),
+если превышен общий лимит или лимит группы. Всплеск из N подтверждённых заказов
+отправляет по сообщению баристе в группу и покупателю в личный чат.
+Лимиты Telegram ужаты в ``SCALE`` раз, чтобы прогон занимал секунды, а не минуты.
+
+Затем проверяется то, что обещает очередь: все сообщения доставлены, сообщения в один чат
+приходят по порядку, после 429 и сетевых ошибок вызов повторяется с нарастающей паузой,
+а после ``max_retries`` неудач вызов завершается ошибкой и не задерживает следующие.
+
+Наконец бариста принимает заказы: сообщение о заказе уходит через очередь, а кнопка
+правится из обработчика через CallbackReplies. Проверяется, что правки тоже укладываются
+в лимит группы и общий лимит и что ни одна правка не теряется из-за 429.
+
+Запуск: python benchmarks/outbound.py [заказов] [задержка_API_сек]
+"""
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram.error import NetworkError, RetryAfter  # noqa: E402
+
+from outbound import OutboundQueue  # noqa: E402
+from replies import CallbackReplies  # noqa: E402
+
+SCALE = 30
+GLOBAL_PER_SECOND = 30
+GROUP_PER_MINUTE = 20
+BARISTA_CHAT_ID = -100
+
+
+class FakeBot:
+    """Bot, который соблюдает лимиты Telegram так же строго, как настоящий сервер."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.sent = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._global = deque()
+        self._chats = {}
+        # Текст каждого отредактированного сообщения: {(chat_id, message_id): текст}
+        self.edits = {}
+
+    def _call(self, chat_id=None):
+        # Ответ на нажатие тратит только общий лимит, сообщения и правки - ещё и лимит чата
+        time.sleep(self.latency)
+        now = time.monotonic()
+        with self._lock:
+            windows = [(self._global, 1 / SCALE, GLOBAL_PER_SECOND)]
+            if chat_id is not None:
+                window, limit = ((60 / SCALE, GROUP_PER_MINUTE) if chat_id < 0 else (1 / SCALE, 1))
+                windows.append((self._chats.setdefault(chat_id, deque()), window, limit))
+            for calls, period, limit in windows:
+                while calls and calls[0] <= now - period:
+                    calls.popleft()
+                if len(calls) >= limit:
+                    self.rejected += 1
+                    raise RetryAfter(1 / SCALE)
+            for calls, _, _ in windows:
+                calls.append(now)
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._call(chat_id)
+        with self._lock:
+            self.sent += 1
+
+    def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self._call(chat_id)
+        with self._lock:
+            self.edits[chat_id, message_id] = text
+
+    def answer_callback_query(self, query_id, text=None, **kwargs):
+        self._call()
+
+
+class FakeQuery:
+    """Нажатие кнопки в сообщении ``message_id`` чата ``chat_id``, вызовы уходят в FakeBot."""
+
+    def __init__(self, bot, chat_id, message_id):
+        self.bot = bot
+        self.id = str(message_id)
+        self.inline_message_id = None
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=message_id, text='Новый заказ',
+                                       reply_markup=None)
+
+    def answer(self, text=None, **kwargs):
+        self.bot.answer_callback_query(self.id, text)
+
+    def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.bot.edit_message_text(self.message.chat.id, self.message.message_id, text, reply_markup=reply_markup)
+
+
+class FlakyBot:
+    """
+    Bot, у которого часть вызовов падает: ``failures`` задаёт, какие ошибки вернуть
+    на первые попытки отправить каждый текст.
+    """
+
+    def __init__(self, failures):
+        self.failures = {text: deque(errors) for text, errors in failures.items()}
+        self.delivered = {}
+        self.attempts = {}
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            self.attempts.setdefault(text, []).append(time.monotonic())
+            errors = self.failures.get(text)
+            if errors:
+                raise errors.popleft()
+            self.delivered.setdefault(chat_id, []).append(text)
+
+
+def check_guarantees(backoff=0.02, max_retries=3):
+    # Каждое пятое сообщение сначала получает 429, каждое седьмое - две сетевые ошибки подряд
+    texts = [f'сообщение {number}' for number in range(100)]
+    failures = {text: [RetryAfter(0.01)] for text in texts[::5]}
+    failures.update({text: [NetworkError('обрыв'), NetworkError('обрыв')] for text in texts[::7]})
+    failures['безнадёжное'] = [NetworkError('обрыв')] * (max_retries + 1)
+    bot = FlakyBot(failures)
+    outbox = OutboundQueue(global_limit=(10000, 1), private_limit=(10000, 1), max_retries=max_retries,
+                           backoff=backoff)
+    outbox.start(bot)
+    futures = [outbox.send_message(1, text) for text in texts[:50]]
+    hopeless = outbox.send_message(1, 'безнадёжное')
+    futures += [outbox.send_message(1, text) for text in texts[50:]]
+    # Сообщения в другой чат не ждут повторов в первом
+    other = outbox.send_message(2, 'в другой чат')
+    outbox.stop(timeout=30)
+
+    assert all(future.done() and future.exception() is None for future in futures + [other]), 'не все доставлены'
+    assert bot.delivered[1] == texts, 'нарушен порядок сообщений в чате'
+    assert isinstance(hopeless.exception(), NetworkError), 'вызов не завершился ошибкой после всех повторов'
+    assert len(bot.attempts['безнадёжное']) == max_retries + 1, 'неверное число повторов'
+
+    # Паузы между повторами после сетевых ошибок растут вдвое: backoff, 2 * backoff, ...
+    gaps = [later - earlier for earlier, later in zip(bot.attempts['безнадёжное'], bot.attempts['безнадёжное'][1:])]
+    for number, gap in enumerate(gaps):
+        assert gap >= backoff * 2 ** number * 0.9, f'повтор {number + 1} пришёл через {gap:.3f} с'
+    retried_429 = [bot.attempts[text] for text in texts[::5] if text not in texts[::7]]
+    assert all(attempts[1] - attempts[0] >= 0.009 for attempts in retried_429), 'после 429 не выждали паузу'
+    return len(texts) + 1, sum(len(attempts) - 1 for attempts in bot.attempts.values()), gaps
+
+
+def receive_orders(orders, latency, limited):
+    """
+    Бариста принимает заказы: новое сообщение через очередь, правка кнопки из обработчика.
+
+    :param limited: Учитывать ли правки в лимитах очереди.
+    :return: (p50 обработчика, правок применено, ошибок в обработчиках, ответов 429).
+    """
+    bot = FakeBot(latency)
+    outbox = OutboundQueue(global_limit=(GLOBAL_PER_SECOND, 1 / SCALE), private_limit=(1, 1 / SCALE),
+                           group_limit=(GROUP_PER_MINUTE, 60 / SCALE), backoff=0.01)
+    outbox.start(bot)
+    replies = CallbackReplies(outbox=outbox if limited else None)
+    errors = []
+
+    def receive(order_id):
+        outbox.send_message(BARISTA_CHAT_ID, 'Новый заказ')
+        try:
+            replies.edit(FakeQuery(bot, BARISTA_CHAT_ID, order_id), 'Заказ получен')
+        except RetryAfter as e:
+            errors.append(e)
+
+    p50, _ = run(orders, receive)
+    outbox.stop(timeout=120)
+    return p50, len(bot.edits), len(errors), bot.rejected
+
+
+def confirm_inline(bot, customer):
+    for chat_id in (BARISTA_CHAT_ID, customer):
+        try:
+            bot.send_message(chat_id, 'Новый заказ')
+        except RetryAfter:
+            pass
+
+
+def confirm_queued(outbox, customer):
+    outbox.send_message(BARISTA_CHAT_ID, 'Новый заказ')
+    outbox.send_message(customer, 'Заказ подтверждён')
+
+
+def run(orders, confirm):
+    # Как и диспетчер бота, обрабатываем подтверждения в 8 потоках
+    durations = []
+
+    def handler(customer):
+        started = time.perf_counter()
+        confirm(customer)
+        durations.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(handler, range(1, orders + 1)))
+    durations.sort()
+    return statistics.median(durations), durations[int(len(durations) * 0.99)]
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+    bot = FakeBot(latency)
+    inline_p50, inline_p99 = run(orders, lambda customer: confirm_inline(bot, customer))
+    inline_sent, inline_rejected = bot.sent, bot.rejected
+
+    bot = FakeBot(latency)
+    outbox = OutboundQueue(global_limit=(GLOBAL_PER_SECOND, 1 / SCALE), private_limit=(1, 1 / SCALE),
+                           group_limit=(GROUP_PER_MINUTE, 60 / SCALE), backoff=0.01)
+    outbox.start(bot)
+    started = time.perf_counter()
+    queued_p50, queued_p99 = run(orders, lambda customer: confirm_queued(outbox, customer))
+    outbox.stop(timeout=120)
+    delivered = time.perf_counter() - started
+    assert bot.sent == 2 * orders, f'очередь доставила {bot.sent} из {2 * orders} сообщений'
+
+    print(f"заказов: {orders}, задержка API: {latency * 1000:.0f} мс, лимиты Telegram ускорены в {SCALE} раз")
+    print(f"{'':<10}{'обработчик p50, мс':>20}{'p99, мс':>10}{'доставлено':>12}{'429':>6}")
+    print(f"{'напрямую':<10}{inline_p50 * 1000:>20.2f}{inline_p99 * 1000:>10.2f}{inline_sent:>12}{inline_rejected:>6}")
+    print(f"{'очередь':<10}{queued_p50 * 1000:>20.2f}{queued_p99 * 1000:>10.2f}{bot.sent:>12}{bot.rejected:>6}")
+    print(f"очередь доставила все сообщения за {delivered:.1f} с "
+          f"(нижняя граница по лимиту группы: {(orders / GROUP_PER_MINUTE - 1) * 60 / SCALE:.1f} с)")
+
+    delivered, retries, gaps = check_guarantees()
+    print(f"сбои: {delivered} сообщений в чат по порядку, повторов после 429 и сетевых ошибок: {retries}; "
+          f"вызов без шансов сдался после {len(gaps)} повторов с паузами "
+          + ', '.join(f'{gap * 1000:.0f}' for gap in gaps) + " мс")
+
+    received = orders // 4
+    print(f"\nбариста принимает {received} заказов: сообщение через очередь, правка кнопки из обработчика")
+    print(f"{'правки':<16}{'обработчик p50, мс':>20}{'применено':>11}{'ошибок':>8}{'429':>6}")
+    for label, limited in (('мимо лимитов', False), ('в лимитах', True)):
+        p50, edited, failed, rejected = receive_orders(received, latency, limited)
+        print(f"{label:<16}{p50 * 1000:>20.2f}{edited:>11}{failed:>8}{rejected:>6}")
+    assert edited == received and failed == 0, f'применено {edited} правок из {received}, ошибок: {failed}'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Цена сохранения разговоров на одно нажатие кнопки в зависимости от числа
+пользователей: стандартный PicklePersistence против SQLitePersistence.
+
+PicklePersistence переписывает файл целиком на каждое обновление, SQLitePersistence
+в обработчике только сериализует данные одного пользователя, а в базу пишет фоновый поток.
+Затем проверяется, что после перезапуска SQLitePersistence возвращает те же user_data и
+разговоры, включая кортеж (состояние, Promise) от обработчиков с run_async, а законченный
+разговор удаляется из базы.
+
+Запуск: python benchmarks/persistence.py [нажатий]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram.ext import ConversationHandler, PicklePersistence  # noqa: E402
+from telegram.utils.promise import Promise  # noqa: E402
+
+from persistence import SQLitePersistence  # noqa: E402
+
+
+def user_data(step):
+    return {'user_messages': [], 'drink': 'Латте', 'milk': 'Овсяное', 'syrup': None, 'syrup_1': 'Ваниль',
+            'syrup_2': 'Карамель' if step % 2 else None, 'volume': '350', 'temperature': None}
+
+
+def per_update(persistence, users, updates):
+    for user_id in range(users):
+        persistence.update_user_data(user_id, user_data(0))
+        persistence.update_conversation('order', (user_id, user_id), 1)
+    persistence.flush()
+
+    started = time.perf_counter()
+    for step in range(1, updates + 1):
+        user_id = step * 7919 % users
+        persistence.update_conversation('order', (user_id, user_id), step % 9)
+        persistence.update_user_data(user_id, user_data(step))
+    elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    persistence.flush()
+    return elapsed / updates, time.perf_counter() - started
+
+
+def promise(result):
+    """Promise обработчика с run_async, ``result=None`` - обработчик ещё работает."""
+    done = Promise(lambda: result, (), {})
+    if result is not None:
+        done.run()
+    return done
+
+
+def restart_round_trip(tmp_dir):
+    """
+    Записать user_data и разговоры, перезапустить SQLitePersistence и прочитать их обратно.
+
+    :return: Число восстановленных разговоров.
+    """
+    path = os.path.join(tmp_dir, 'restart.db')
+    data = {user_id: user_data(user_id) for user_id in (1, 2, 3, 4)}
+    # Состояния, которые должны вернуться после перезапуска: выполненный Promise - его результат,
+    # невыполненный - прежнее состояние
+    states = {(1, 1): (3, 3), (2, 2): ((4, promise(5)), 5), (3, 3): ((6, promise(None)), 6), (4, 4): (2, None)}
+
+    persistence = SQLitePersistence(path, flush_interval=3600)
+    for user_id, value in data.items():
+        persistence.update_user_data(user_id, value)
+    for key, (state, _) in states.items():
+        persistence.update_conversation('order', key, state)
+    persistence.flush()
+    # Разговор закончился после записи: его строка должна исчезнуть
+    persistence.update_conversation('order', (4, 4), ConversationHandler.END)
+    persistence.close()
+
+    restarted = SQLitePersistence(path, flush_interval=3600)
+    try:
+        assert dict(restarted.get_user_data()) == data, 'user_data не пережили перезапуск'
+        conversations = restarted.get_conversations('order')
+        expected = {key: state for key, (_, state) in states.items() if state is not None}
+        assert conversations == expected, f'разговоры после перезапуска: {conversations}, ожидалось {expected}'
+    finally:
+        restarted.close()
+    return len(conversations)
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    logging.disable(logging.INFO)
+
+    print(f"{'пользователей':>14}{'pickle, мкс':>14}{'SQLite, мкс':>14}{'запись SQLite, мс':>20}")
+    for users in (100, 1000, 10000):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pickle = PicklePersistence(os.path.join(tmp_dir, 'state.pickle'), store_chat_data=False,
+                                       store_bot_data=False)
+            pickle.get_user_data()
+            pickle.get_conversations('order')
+            pickle_cost, _ = per_update(pickle, users, updates if users < 10000 else updates // 10)
+
+            sqlite = SQLitePersistence(os.path.join(tmp_dir, 'orders.db'), flush_interval=3600)
+            sqlite.get_user_data()
+            sqlite.get_conversations('order')
+            sqlite_cost, flush = per_update(sqlite, users, updates)
+            sqlite.close()
+        print(f"{users:>14}{pickle_cost * 1e6:>14.0f}{sqlite_cost * 1e6:>14.1f}{flush * 1000:>20.1f}")
+    print(f"запись SQLite - одна транзакция со всеми изменениями за {updates} нажатий")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        restored = restart_round_trip(tmp_dir)
+    print(f"перезапуск: user_data и {restored} разговора восстановлены, законченный разговор удалён")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Время показа очереди заказов баристе и размер клавиатуры в зависимости от числа
+открытых заказов: прежняя клавиатура со всеми заказами против одной страницы.
+
+Запуск: python benchmarks/queue_view.py [повторов]
+"""
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+from benchmarks.stubs import import_bot  # noqa: E402
+from callback_data import OrderAction, encode_order_callback  # noqa: E402
+from orders import Order  # noqa: E402
+
+# Ограничение Telegram на размер reply_markup, байт
+MARKUP_LIMIT = 10 * 1024
+
+
+# Прежний /coffee_ready: кнопка на каждый открытый заказ
+def legacy_keyboard(bot):
+    keyboard = []
+    for order in bot.order_store.open_orders(bot.STATIONS[0].name):
+        date_time = datetime.datetime.utcfromtimestamp(int(order.created_at)) + bot.TIME_OFFSET
+        callback_data = encode_order_callback(OrderAction.READY, order.order_id)
+        keyboard.append([InlineKeyboardButton(f"{order.username}: {date_time}", callback_data=callback_data)])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def per_call(func, repeats):
+    started = time.process_time()
+    for _ in range(repeats):
+        func()
+    return (time.process_time() - started) / repeats * 1e6
+
+
+def markup_size(markup):
+    return len(json.dumps(markup.to_dict(), ensure_ascii=False).encode('utf-8'))
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    bot = import_bot()
+    logging.disable(logging.INFO)
+    bot.open_storage()
+    store = bot.order_store
+    station = bot.STATIONS[0]
+
+    print(f"{'заказов':>8}{'прежде, мкс':>14}{'байт':>8}{'страница, мкс':>16}{'байт':>8}")
+    created_at = time.time()
+    for count in (10, 100, 500, 2000, 10000):
+        while len(store) < count:
+            order_id = store.next_order_id()
+            store.add(Order(order_id, f'guest{order_id}', order_id, 'Латте', created_at=created_at + order_id,
+                            station=station.name))
+
+        legacy = per_call(lambda: legacy_keyboard(bot), max(1, repeats * 10 // count))
+        middle = len(store) // bot.QUEUE_PAGE_SIZE // 2
+        page = per_call(lambda: bot.queue_page(station, middle), repeats)
+        legacy_size = markup_size(legacy_keyboard(bot))
+        page_size = markup_size(bot.queue_page(station, middle)[1])
+        flag = '*' if legacy_size > MARKUP_LIMIT else ' '
+        print(f"{count:>8}{legacy:>14.0f}{legacy_size:>7}{flag}{page:>16.0f}{page_size:>8}")
+
+    print(f"* больше лимита Telegram на клавиатуру ({MARKUP_LIMIT} байт)")
+    store.close()
+    bot.persistence.close()
+
+
+if __name__ == '__main__':
+    main()
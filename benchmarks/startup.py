@@ -0,0 +1,56 @@
+"""
+Время старта бота: холодная загрузка меню из таблицы против старта со снимка на диске.
+
+Запуск: python benchmarks/startup.py [задержка_сек]
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.stubs import StubSheetsClient, stub_client_factory  # noqa: E402
+from menu import MenuLoader, MenuStore  # noqa: E402
+
+
+def boot(snapshot_path, latency, modified_time=None):
+    client = StubSheetsClient(latency=latency)
+    client.modified_time = modified_time or client.modified_time
+    store = MenuStore(MenuLoader('keys.json', 'menu', client_factory=stub_client_factory(client)), snapshot_path)
+    started = time.perf_counter()
+    menu = store.boot()
+    elapsed = time.perf_counter() - started
+    return store, menu, elapsed
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = os.path.join(tmp_dir, 'menu_snapshot.json')
+
+        _, cold_menu, cold = boot(snapshot_path, latency)
+        # Таблица успела измениться, пока бот был выключен
+        store, warm_menu, warm = boot(snapshot_path, latency, '2024-02-01T00:00:00.000Z')
+        assert warm_menu.drinks == cold_menu.drinks
+
+        # Дожидаемся фонового обновления, чтобы убедиться, что меню заменилось
+        for thread in threading.enumerate():
+            if thread.name == 'menu-refresh':
+                thread.join()
+
+    print(f"задержка запроса: {latency * 1000:.0f} мс")
+    print(f"старт из таблицы: {cold * 1000:8.2f} мс")
+    print(f"старт со снимка:  {warm * 1000:8.2f} мс")
+    # Содержимое таблицы то же, поэтому меню остаётся прежней версии, а время изменения обновляется
+    assert store.current.modified_time == '2024-02-01T00:00:00.000Z'
+    print(f"фоновое обновление сверило меню с таблицей: версия {store.current.version}, "
+          f"время изменения {store.current.modified_time}")
+
+
+if __name__ == '__main__':
+    main()
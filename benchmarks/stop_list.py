@@ -0,0 +1,129 @@
+"""
+Стоп-лист из бота.
+
+Сколько стоит применить изменение стоп-листа к меню: пересборка только затронутых клавиатур
+против полной сборки меню. Затем бариста быстро переключает несколько позиций подряд,
+и проверяется, что в таблицу уходит одна запись, своя же запись не вызывает перезагрузку
+меню, а стоп-лист переживает перезагрузку меню без смены версии. Отдельно проверяется,
+что напиток, у которого закончились все объёмы, пропадает из меню, а не ведёт к пустой клавиатуре.
+
+Запуск: python benchmarks/stop_list.py [напитков] [переключений]
+"""
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.stubs import MENU_VALUES, StubSheetsClient, stub_client_factory, synthetic_menu_values  # noqa: E402
+from menu import (DRINKS_SHEET, MILK_SHEET, STOP_LIST_SHEET, SYRUPS_SHEET, Menu, MenuLoader,  # noqa: E402
+                  MenuStore, parse_drinks, parse_names, parse_stop_list)
+
+
+INDEX_ATTRIBUTES = ('drink_types', 'drinks_by_type', 'volumes', 'milks_markup', 'syrups_markup',
+                    'drink_types_markup', '_drinks_markups', '_volumes_markups')
+
+
+def measure(func, repeats=50):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def apply_cost(drinks):
+    client = StubSheetsClient(values=synthetic_menu_values(drinks=drinks), latency=0)
+    loader = MenuLoader('keys.json', 'menu', client_factory=stub_client_factory(client))
+    drink_values, milks, syrups, _ = loader.load()
+    menu = Menu(drink_values, milks, syrups)
+    drink = next(iter(drink_values))
+    volume = menu.sheet_volumes[drink][0]
+
+    print(f"Меню: {drinks} напитков, {len(menu.sheet_drinks_by_type)} типов")
+    print(f"{'изменение':>22}{'полная сборка, мкс':>20}{'with_stop_list, мкс':>21}")
+    for label, item in (('напиток', (DRINKS_SHEET, drink, '')), ('объём напитка', (DRINKS_SHEET, drink, volume)),
+                        ('молоко', (MILK_SHEET, milks[0], '')), ('сироп', (SYRUPS_SHEET, syrups[0], ''))):
+        stop_list = menu.stop_list | {item}
+        full = measure(lambda: Menu(drink_values, milks, syrups, stop_list=stop_list))
+        incremental = measure(lambda: menu.with_stop_list(stop_list))
+        rebuilt = Menu(drink_values, milks, syrups, stop_list=stop_list)
+        patched = menu.with_stop_list(stop_list)
+        # Инкрементальная копия должна совпадать с полной сборкой
+        for attribute in INDEX_ATTRIBUTES:
+            assert getattr(patched, attribute) == getattr(rebuilt, attribute), attribute
+        print(f"{label:>22}{full * 1e6:>20.0f}{incremental * 1e6:>21.1f}")
+
+
+def sold_out_volumes():
+    drinks = parse_drinks(MENU_VALUES[DRINKS_SHEET])
+    milks, syrups = parse_names(MENU_VALUES[MILK_SHEET]), parse_names(MENU_VALUES[SYRUPS_SHEET])
+    # У эспрессо закончился единственный объём, у латте - оба
+    stop_list = {(DRINKS_SHEET, 'Эспрессо', '250')} | {(DRINKS_SHEET, 'Латте', volume) for volume in ('350', '450')}
+    rebuilt = Menu(drinks, milks, syrups, stop_list=stop_list)
+    patched = Menu(drinks, milks, syrups).with_stop_list(stop_list)
+    for menu in (rebuilt, patched):
+        for drink in ('Эспрессо', 'Латте'):
+            assert not menu.is_offered(DRINKS_SHEET, drink), f'{drink} без объёмов остался в меню'
+            assert drink not in menu.drinks_by_type['Классика']
+    for attribute in INDEX_ATTRIBUTES:
+        assert getattr(patched, attribute) == getattr(rebuilt, attribute), attribute
+
+    # Объём вернулся - вернулся и напиток
+    restored = patched.with_stop_list(stop_list - {(DRINKS_SHEET, 'Эспрессо', '250')})
+    assert restored.is_offered(DRINKS_SHEET, 'Эспрессо') and 'Эспрессо' in restored.drinks_by_type['Классика']
+
+
+def toggles(count, latency):
+    client = StubSheetsClient(latency=latency)
+    loader = MenuLoader('keys.json', 'menu', client_factory=stub_client_factory(client))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = MenuStore(loader, os.path.join(tmp_dir, 'menu.json'), stop_list_delay=0.5)
+        menu = store.refresh()
+        client.round_trips = 0
+
+        drinks = list(menu.drinks)
+        started = time.perf_counter()
+        for number in range(count):
+            store.set_stopped((DRINKS_SHEET, drinks[number % len(drinks)], ''), stopped=number % 2 == 0)
+        toggle_cost = (time.perf_counter() - started) / count
+        expected = store.current.stop_list
+
+        # Ждём, пока фоновый поток запишет накопленные изменения
+        time.sleep(store.stop_list_delay + 3 * latency + 0.5)
+        written_trips = client.round_trips
+        written = parse_stop_list(client.values[STOP_LIST_SHEET])
+        assert written == expected, 'в таблицу записан не тот стоп-лист'
+
+        # Время изменения таблицы после своей записи меню уже знает
+        version = store.current.version
+        assert store.refresh_if_changed() is None, 'запись стоп-листа вызвала перезагрузку меню'
+
+        # Перезагрузка меню стоп-лист не теряет, а кнопки стоп-листа остаются действительными
+        reloaded = store.refresh()
+        assert reloaded.stop_list == expected
+        assert reloaded.version == version, 'перезагрузка того же меню сменила версию'
+        store.close()
+    return toggle_cost, written_trips, len(expected)
+
+
+def main():
+    drinks = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+    logging.disable(logging.WARNING)
+
+    apply_cost(drinks)
+    sold_out_volumes()
+
+    latency = 0.15
+    toggle_cost, trips, stopped = toggles(count, latency)
+    print(f"{count} переключений подряд: {toggle_cost * 1e6:.0f} мкс на нажатие в обработчике, "
+          f"запросов к Google: {trips} (задержка {latency * 1000:.0f} мс), в стоп-листе {stopped} позиций")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Локальные заглушки внешних API для бенчмарков."""
+import datetime
+import threading
+import time
+
+import gspread
+
+# Небольшое меню в том виде, в каком его отдаёт Sheets API
+MENU_VALUES = {
+    'Напитки': [
+        ['Название', 'Тип напитка', 'Молоко', '250', '350', '450'],
+        ['Эспрессо', 'Классика', '-', '+', '-', '-'],
+        ['Капучино', 'Классика', '+', '+', '+', '+'],
+        ['Латте', 'Классика', '+', '-', '+', '+'],
+        ['Раф', 'Авторские', '+', '-', '+', '+'],
+        ['Матча', 'Чай', '+', '+', '+'],
+    ],
+    'Молоко': [['Название'], ['Коровье'], ['Овсяное'], ['Кокосовое']],
+    'Сиропы': [['Название'], ['Ваниль'], ['Карамель'], ['Лесной орех']],
+}
+
+
+class StubSheetsClient:
+    """
+    Заглушка клиента gspread: каждый сетевой вызов стоит ``latency`` секунд.
+
+    Счётчик ``round_trips`` показывает, сколько HTTP-запросов сделал бы настоящий клиент.
+    """
+
+    def __init__(self, values=None, latency=0.05):
+        self.values = values if values is not None else MENU_VALUES
+        self.latency = latency
+        self.modified_time = '2024-01-01T00:00:00.000Z'
+        self.round_trips = 0
+        # Строки, дописанные в листы, и сколько следующих дописываний завершится ошибкой
+        self.appended = {}
+        self.append_failures = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        time.sleep(self.latency)
+
+    def touch(self):
+        """Как Drive API: любая запись в таблицу сдвигает время её изменения."""
+        with self._lock:
+            self.writes += 1
+            modified = datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=self.writes)
+            self.modified_time = modified.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def open(self, title):
+        self.round_trip()
+        return StubSpreadsheet(self, title)
+
+    def get_file_drive_metadata(self, id):
+        self.round_trip()
+        return {'id': id, 'modifiedTime': self.modified_time}
+
+
+class StubSpreadsheet:
+    def __init__(self, client, title):
+        self.client = client
+        self.title = title
+        self.id = 'stub-' + title
+
+    def worksheet(self, name):
+        self.client.round_trip()
+        return StubWorksheet(self.client, name)
+
+    def values_batch_get(self, ranges, params=None):
+        self.client.round_trip()
+        missing = [name for name in ranges if name.strip("'") not in self.client.values]
+        if missing:
+            # Как Sheets API: запрос с несуществующим листом целиком завершается ошибкой 400
+            raise gspread.exceptions.APIError(StubResponse(400, f'Unable to parse range: {missing[0]}'))
+        return {'valueRanges': [{'range': name, 'values': [list(row) for row in self.client.values[name.strip("'")]]}
+                                for name in ranges]}
+
+    def values_update(self, range, params, body):
+        self.client.round_trip()
+        sheet = range.split('!')[0].strip("'")
+        if sheet not in self.client.values:
+            raise gspread.exceptions.APIError(StubResponse(400, f'Unable to parse range: {range}'))
+        # Пустые строки в конце - затёртый хвост прежних значений
+        rows = [list(row) for row in body['values']]
+        while rows and not any(rows[-1]):
+            rows.pop()
+        # Новый словарь, а не правка на месте: MENU_VALUES общий для всех заглушек
+        self.client.values = {**self.client.values, sheet: rows}
+        self.client.touch()
+        return {'updatedRows': len(body['values'])}
+
+    def add_worksheet(self, title, rows, cols):
+        self.client.round_trip()
+        self.client.values = {**self.client.values, title: []}
+        return StubWorksheet(self.client, title)
+
+    def values_append(self, range, params, body):
+        self.client.round_trip()
+        if self.client.append_failures:
+            self.client.append_failures -= 1
+            raise ConnectionError('Sheets API недоступен')
+        sheet = range.split('!')[0].strip("'")
+        if sheet not in self.client.values:
+            raise gspread.exceptions.APIError(StubResponse(400, f'Unable to parse range: {range}'))
+        self.client.appended.setdefault(sheet, []).extend(body['values'])
+        self.client.touch()
+        return {'updates': {'updatedRows': len(body['values'])}}
+
+
+class StubResponse:
+    """Ответ Sheets API с ошибкой, из которого gspread собирает APIError."""
+
+    def __init__(self, status_code, message):
+        self.status_code = status_code
+        self.text = message
+
+    def json(self):
+        return {'error': {'code': self.status_code, 'message': self.text, 'status': 'INVALID_ARGUMENT'}}
+
+
+class StubWorksheet:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def get_all_values(self):
+        self.client.round_trip()
+        rows = self.client.values[self.name]
+        width = max(len(row) for row in rows)
+        return [list(row) + [''] * (width - len(row)) for row in rows]
+
+
+def stub_client_factory(client):
+    """Фабрика клиента, имитирующая чтение ключа и OAuth-рукопожатие одним запросом."""
+
+    def factory(credentials_path):
+        client.round_trip()
+        return client
+
+    return factory
+
+
+def synthetic_menu_values(drinks=600, types=30, milks=10, syrups=20):
+    """Большое синтетическое меню в формате Sheets API."""
+    volumes = ['250', '350', '450', '550']
+    drink_rows = [['Название', 'Тип напитка', 'Молоко'] + volumes]
+    for i in range(drinks):
+        drink_rows.append([f'Напиток {i}', f'Тип {i % types}', '+' if i % 3 else '-'] +
+                          ['+' if (i + j) % 4 else '-' for j in range(len(volumes))])
+    return {
+        'Напитки': drink_rows,
+        'Молоко': [['Название']] + [[f'Молоко {i}'] for i in range(milks)],
+        'Сиропы': [['Название']] + [[f'Сироп {i}'] for i in range(syrups)],
+    }
+
+
+BOT_CONFIG = {
+    'menu_sheets': {'keys_filename': 'keys.json', 'doc_name': 'menu'},
+    'telegram_bot': {'token': '123456:TEST', 'barista_chat_id': '-100'},
+}
+
+
+def import_bot(config=None, workdir=None):
+    """
+    Импортировать main.py с временным config.yaml.
+
+    :param config: Содержимое конфига, по умолчанию BOT_CONFIG.
+    :param workdir: Каталог для конфига и файлов бота, по умолчанию временный.
+    :return: Модуль main.
+    """
+    import importlib
+    import os
+    import tempfile
+
+    import yaml
+
+    workdir = workdir or tempfile.mkdtemp(prefix='eastwoods-bench-')
+    with open(os.path.join(workdir, 'config.yaml'), 'w') as config_file:
+        yaml.safe_dump(config or BOT_CONFIG, config_file, allow_unicode=True)
+    os.chdir(workdir)
+    return importlib.import_module('main')
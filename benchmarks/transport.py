@@ -0,0 +1,103 @@
+"""
+Пропускная способность и задержка от нажатия кнопки до правки сообщения
+в режимах polling и webhook на локальном сервере Bot API.
+
+Каждый режим запускается в отдельном процессе: N покупателей одновременно
+проходят заказ от /start до экрана подтверждения. Считаются и вызовы Bot API
+на покупателя: в режиме webhook ответы на нажатия уходят в ответах на запросы webhook.
+
+Запуск: python benchmarks/transport.py [покупателей] [задержка_API_сек] [потоков]
+"""
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Пауза покупателя между нажатиями: следующий шаг разговора принимается,
+# только когда обработчик предыдущего полностью завершился
+THINK_TIME = 0.05
+
+# Кнопки, которые нажимает каждый покупатель после /start
+FLOW = ['drink_Классика', 'drink_Эспрессо', 'syrup_Не хочу', 'volume_250', 'temperature_Горячий']
+
+
+# Вызовы, которые бот делает не ради покупателей
+SERVICE_METHODS = {'getUpdates', 'getMe', 'getMyCommands', 'setWebhook', 'deleteWebhook'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run_mode(mode, customers, api_latency, workers):
+    from benchmarks.fake_telegram import FakeTelegram
+    from benchmarks.stubs import BOT_CONFIG, MENU_VALUES, import_bot
+    from menu import Menu, parse_drinks, parse_names
+
+    telegram = FakeTelegram(api_latency=api_latency)
+    webhook_port = free_port()
+    config = dict(BOT_CONFIG, telegram_bot=dict(
+        BOT_CONFIG['telegram_bot'], mode=mode, workers=workers, base_url=telegram.base_url,
+        # Измеряем транспорт, а не лимиты Telegram
+        outbound={'global_per_second': 10000, 'private_per_second': 100, 'workers': workers},
+        webhook={'listen': '127.0.0.1', 'port': webhook_port, 'url_path': 'hook',
+                 'url': f'http://127.0.0.1:{webhook_port}/hook'}))
+    bot = import_bot(config, tempfile.mkdtemp(prefix='eastwoods-transport-'))
+    logging.disable(logging.INFO)
+    bot.menu_store.publish(Menu(parse_drinks(MENU_VALUES['Напитки']), parse_names(MENU_VALUES['Молоко']),
+                                parse_names(MENU_VALUES['Сиропы'])))
+
+    updater = bot.build_updater()
+    bot.start_updater(updater)
+    telegram.wait_for_call('setWebhook' if mode == 'webhook' else 'getUpdates')
+
+    users = range(1, customers + 1)
+    started = time.perf_counter()
+    messages = telegram.wait([telegram.send_command(user_id, '/start') for user_id in users])
+    elapsed = time.perf_counter() - started
+    for data in FLOW:
+        time.sleep(THINK_TIME)
+        started = time.perf_counter()
+        keys = [telegram.press(user_id, message, data) for user_id, message in zip(users, messages)]
+        messages = telegram.wait(keys)
+        elapsed += time.perf_counter() - started
+
+    telegram.close()
+    updater.stop()
+    bot.outbox.stop()
+    bot.order_store.close()
+    bot.persistence.close()
+
+    updates = customers * (len(FLOW) + 1)
+    latencies = sorted(telegram.latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    calls = sum(count for method, count in telegram.calls.items() if method not in SERVICE_METHODS)
+    in_webhook = sum(telegram.webhook_calls.values())
+    print(f"{mode:<8}{updates / elapsed:>14.0f}{statistics.median(latencies) * 1000:>12.1f}{p99 * 1000:>12.1f}"
+          f"{calls / customers:>16.1f}{in_webhook / customers:>18.1f}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--mode':
+        run_mode(sys.argv[2], int(sys.argv[3]), float(sys.argv[4]), int(sys.argv[5]))
+        return
+
+    customers = sys.argv[1] if len(sys.argv) > 1 else '200'
+    api_latency = sys.argv[2] if len(sys.argv) > 2 else '0.02'
+    workers = sys.argv[3] if len(sys.argv) > 3 else '8'
+    print(f"покупателей: {customers}, задержка API: {float(api_latency) * 1000:.0f} мс, потоков: {workers}")
+    print(f"{'режим':<8}{'обновл./с':>14}{'p50, мс':>12}{'p99, мс':>12}{'вызовов API':>16}{'в ответах webhook':>18}")
+    for mode in ('polling', 'webhook'):
+        subprocess.run([sys.executable, __file__, '--mode', mode, customers, api_latency, workers], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import base64
+import binascii
+import struct
+from enum import IntEnum
+from typing import Tuple
+
+# Версия формата callback_data кнопок заказа. Кнопки с другой версией не разбираются.
+CALLBACK_VERSION = 1
+
+# callback_data кнопок заказа начинаются с этого символа, callback_data меню - со слов вида 'drink_'
+ORDER_CALLBACK_PREFIX = '~'
+# callback_data кнопок стоп-листа: версия меню, экран и номера позиций через точку
+STOP_LIST_CALLBACK_PREFIX = '!'
+
+# версия, действие, номер заказа
+_ORDER_CALLBACK = struct.Struct('>BBQ')
+
+
+class OrderAction(IntEnum):
+    RECEIVED = 1
+    READY = 2
+    CONFIRM = 3
+    # Для страницы очереди вместо номера заказа передаётся номер страницы
+    PAGE = 4
+
+
+_ACTIONS = {action.value: action for action in OrderAction}
+
+
+class StopListAction(IntEnum):
+    # Разделы: молоко, сиропы и типы напитков
+    SECTIONS = 1
+    # Позиции раздела: номер раздела
+    ITEMS = 2
+    # Напиток и его объёмы: номер раздела и номер напитка в нём
+    DRINK = 3
+    # Переключить позицию: номер раздела, номер позиции и номер объёма, считая с 1 (0 - напиток целиком)
+    TOGGLE = 4
+
+
+_STOP_LIST_ACTIONS = {action.value: action for action in StopListAction}
+
+
+def encode_order_callback(action: OrderAction, order_id: int) -> str:
+    """
+    Упаковать действие над заказом в callback_data.
+
+    :param action: Действие над заказом.
+    :param order_id: Номер заказа.
+    :return: Строка из 15 символов, помещается в лимит Telegram в 64 байта.
+    """
+    payload = _ORDER_CALLBACK.pack(CALLBACK_VERSION, action, order_id)
+    return ORDER_CALLBACK_PREFIX + base64.urlsafe_b64encode(payload).rstrip(b'=').decode('ascii')
+
+
+def decode_order_callback(data: str) -> Tuple[OrderAction, int]:
+    """
+    Разобрать callback_data кнопки заказа.
+
+    :param data: callback_data из нажатой кнопки.
+    :return: Кортеж (действие, номер заказа).
+    :raises ValueError: Если данные повреждены или в неизвестной версии формата.
+    """
+    if not data.startswith(ORDER_CALLBACK_PREFIX):
+        raise ValueError(f"Не кнопка заказа: {data!r}")
+    encoded = data[len(ORDER_CALLBACK_PREFIX):].replace('-', '+').replace('_', '/')
+    try:
+        version, action, order_id = _ORDER_CALLBACK.unpack(binascii.a2b_base64(encoded + '=' * (-len(encoded) % 4)))
+    except (binascii.Error, struct.error) as e:
+        raise ValueError(f"Повреждённые данные кнопки заказа: {data!r}") from e
+    if version != CALLBACK_VERSION:
+        raise ValueError(f"Неизвестная версия данных кнопки заказа: {version}")
+    try:
+        return _ACTIONS[action], order_id
+    except KeyError:
+        raise ValueError(f"Неизвестное действие с заказом: {action}") from None
+
+
+def encode_stop_list_callback(version: int, action: StopListAction, *numbers: int) -> str:
+    """
+    Упаковать нажатие в стоп-листе в callback_data.
+
+    Позиции передаются номерами, а не названиями: названия могут не поместиться в 64 байта.
+    Номера имеют смысл только для той версии меню, для которой построена клавиатура.
+
+    :param version: Версия меню.
+    :param action: Экран или действие.
+    :param numbers: Номера раздела и позиций.
+    """
+    return STOP_LIST_CALLBACK_PREFIX + '.'.join(str(int(value)) for value in (version, action, *numbers))
+
+
+def decode_stop_list_callback(data: str) -> Tuple[int, StopListAction, Tuple[int, ...]]:
+    """
+    Разобрать callback_data кнопки стоп-листа.
+
+    :param data: callback_data из нажатой кнопки.
+    :return: Кортеж (версия меню, действие, номера).
+    :raises ValueError: Если данные повреждены.
+    """
+    if not data.startswith(STOP_LIST_CALLBACK_PREFIX):
+        raise ValueError(f"Не кнопка стоп-листа: {data!r}")
+    try:
+        version, action, *numbers = (int(value) for value in data[len(STOP_LIST_CALLBACK_PREFIX):].split('.'))
+        return version, _STOP_LIST_ACTIONS[action], tuple(numbers)
+    except (ValueError, KeyError):
+        raise ValueError(f"Повреждённые данные кнопки стоп-листа: {data!r}") from None
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class IdempotencyCache:
+    """
+    Ключи уже обработанных действий с ограниченным временем жизни и размером.
+
+    Ключи лежат в OrderedDict в порядке истечения срока: повторное обращение продлевает ключ
+    и переносит его в конец, поэтому просроченные всегда в начале и удаляются за время,
+    зависящее только от их числа. При переполнении забываются самые давние ключи,
+    так что память ограничена ``max_size`` при любой нагрузке.
+
+    :param ttl: Сколько секунд помнить ключ после последнего обращения.
+    :param max_size: Сколько ключей помнить не больше.
+    :param clock: Источник времени в секундах.
+    """
+
+    def __init__(self, ttl: float = 600, max_size: int = 20000, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self._expires: 'OrderedDict[Hashable, float]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def seen(self, key: Hashable) -> bool:
+        """
+        Запомнить ключ и сообщить, встречался ли он раньше.
+
+        :param key: Ключ действия.
+        :return: True, если ключ уже был и ещё не истёк.
+        """
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            seen = key in self._expires
+            self._expires[key] = now + self.ttl
+            if seen:
+                self._expires.move_to_end(key)
+            elif len(self._expires) > self.max_size:
+                self._expires.popitem(last=False)
+            return seen
+
+    def discard(self, key: Hashable) -> None:
+        """Забыть ключ, например если действие так и не было выполнено."""
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def _expire(self, now: float) -> None:
+        while self._expires:
+            key, expires_at = next(iter(self._expires.items()))
+            if expires_at > now:
+                return
+            del self._expires[key]
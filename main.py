@@ -1,14 +1,25 @@
 import logging
-import time
-from collections import defaultdict
 import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
 
-import gspread
-import pandas as pd
 import yaml
-from oauth2client.service_account import ServiceAccountCredentials
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, ConversationHandler, CallbackContext, Filters
+from telegram import Bot, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import (Updater, CommandHandler, CallbackQueryHandler, ConversationHandler, CallbackContext, Filters,
+                          DispatcherHandlerStop)
+
+from callback_data import (ORDER_CALLBACK_PREFIX, STOP_LIST_CALLBACK_PREFIX, OrderAction, StopListAction,
+                           decode_order_callback, decode_stop_list_callback, encode_order_callback,
+                           encode_stop_list_callback)
+from idempotency import IdempotencyCache
+from menu import DRINKS_SHEET, MILK_SHEET, SYRUPS_SHEET, TYPE_COLUMN, Menu, MenuLoader, MenuStore, StopItem
+from metrics import Counter, Gauge, MetricsServer, instrument_dispatcher
+from order_log import ORDER_LOG_HEADER, OrderLogExporter
+from orders import Order, OrderStore
+from outbound import OutboundQueue
+from persistence import SQLitePersistence
+from replies import CallbackReplies
+from stations import Station, least_loaded, parse_stations, station_by_index
+from webhook import answer_in_webhook_responses
 
 # Включаем логирование
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -21,96 +32,105 @@ with open('config.yaml', 'r') as yaml_file:
 credentials_path = config_data['menu_sheets']['keys_filename']
 spreadsheet_name = config_data['menu_sheets']['doc_name']
 
-# Получение токена бота и идентификатора чата с баристой
+# Один авторизованный клиент Google Таблиц на всё время работы бота
+menu_loader = MenuLoader(credentials_path, spreadsheet_name)
+# Снимок меню на диске, с которого бот стартует без ожидания Google Таблиц
+# Изменения стоп-листа копятся stop_list_delay секунд и записываются в таблицу одним запросом
+menu_store = MenuStore(menu_loader, config_data['menu_sheets'].get('snapshot_path', 'menu_snapshot.json'),
+                       stop_list_delay=config_data['menu_sheets'].get('stop_list_delay', 2.0))
+# Как часто (в секундах) проверять, не изменилась ли таблица меню
+MENU_REFRESH_INTERVAL = config_data['menu_sheets'].get('refresh_interval', 300)
+
+# Получение токена бота
 TOKEN = config_data['telegram_bot']['token']
+# Стойки барист: у каждой свой чат и своя очередь заказов
+STATIONS = parse_stations(config_data['telegram_bot'])
+STATIONS_BY_CHAT = {station.chat_id: station for station in STATIONS}
+# Способ получения обновлений: 'polling' или 'webhook'
+UPDATES_MODE = config_data['telegram_bot'].get('mode', 'polling')
+# Число потоков, в которых выполняются обработчики
+WORKERS = config_data['telegram_bot'].get('workers', 8)
+
+# Сколько заказов показывать баристе на одной странице очереди
+QUEUE_PAGE_SIZE = config_data['telegram_bot'].get('queue_page_size', 10)
+
+# Смещение местного времени кофейни относительно UTC для отображения заказов
+TIME_OFFSET = datetime.timedelta(hours=3)
 
 # Шаги разговора
 SELECT_DRINK_TYPE, SELECT_DRINK, SELECT_MILK, APPROVE_SYRUP, SELECT_SYRUP_1, SELECT_SYRUP_2, SELECT_VOLUME, SELECT_TEMPERATURE, CONFIRM_ORDER = range(
     9)
-
-# user_orders = {}
-user_orders = defaultdict(list)
-
-
-# Загрузка данных из Excel файла
-def load_data_from_sheet(credentials_path, spreadsheet_name, sheet_name):
-    """
-    Загрузить данные из указанного листа Google Таблицы в DataFrame.
-
-    :param credentials_path: Путь к JSON файлу учетных данных.
-    :param spreadsheet_name: Название Google Таблицы.
-    :param sheet_name: Название листа для загрузки данных.
-    :return: DataFrame с данными из указанного листа.
-    """
-    # Настраиваем аутентификацию
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(
-        credentials_path,
-        ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-    )
-    gc = gspread.authorize(credentials)
-
-    # Открываем таблицу и лист
-    spreadsheet = gc.open(spreadsheet_name)
-    worksheet = spreadsheet.worksheet(sheet_name)
-
-    # Получаем все данные из листа
-    data = worksheet.get_all_values()
-
-    # Преобразуем данные в DataFrame
-    df = pd.DataFrame(data)
-
-    # Используем первую строку в качестве заголовков столбцов
-    df.columns = df.iloc[0]
-    df = df[1:]
-
-    # Сбрасываем индекс, если это необходимо
-    df.reset_index(drop=True, inplace=True)
-
-    return df
-
-
-def load_menu_data():
-    drinks = load_data_from_sheet(credentials_path, spreadsheet_name, 'Напитки').set_index('Название').to_dict(
-        orient='index')
-    milk = load_data_from_sheet(credentials_path, spreadsheet_name, 'Молоко')
-    syrups = load_data_from_sheet(credentials_path, spreadsheet_name, 'Сиропы')
-    return drinks, milk['Название'].tolist(), syrups['Название'].tolist()
-
-
-def available_volumes(drink_name):
-    volumes = []
-    for volume, status in drinks[drink_name].items():
-        if volume != 'Молоко' and volume != 'Тип напитка' and status == '+':
-            volumes.append(volume)
-    return volumes
-
-
-def get_unique_drink_types(drinks):
-    # Создаем список, в который будем добавлять уникальные значения
-    unique_types = []
-
-    # Проходим по каждому напитку в словаре drinks
-    for drink, properties in drinks.items():
-        drink_type = properties.get('Тип напитка', None)
-
-        # Проверяем, что значение 'Тип напитка' не пустое и не содержится уже в списке unique_types
-        if drink_type and drink_type not in unique_types:
-            unique_types.append(drink_type)
-
-    return unique_types
-
-
-def get_drinks_by_type(drinks, drink_type):
-    matching_drinks = []
-    for drink, properties in drinks.items():
-        if properties.get('Тип напитка', None) == drink_type:
-            matching_drinks.append(drink)
-    return matching_drinks
-
-
-drinks, milks, syrups = load_menu_data()
-
-drink_types = get_unique_drink_types(drinks)
+# Названия шагов для метрик
+STATE_NAMES = {
+    SELECT_DRINK_TYPE: 'select_drink_type', SELECT_DRINK: 'select_drink', SELECT_MILK: 'select_milk',
+    APPROVE_SYRUP: 'approve_syrup', SELECT_SYRUP_1: 'select_syrup_1', SELECT_SYRUP_2: 'select_syrup_2',
+    SELECT_VOLUME: 'select_volume', SELECT_TEMPERATURE: 'select_temperature', CONFIRM_ORDER: 'confirm_order',
+    ConversationHandler.WAITING: 'waiting',
+}
+
+# Уведомления уходят через очередь с учётом лимитов Telegram, обработчик их не ждёт
+outbound_config = config_data['telegram_bot'].get('outbound', {})
+outbox = OutboundQueue(global_limit=(outbound_config.get('global_per_second', 25), 1),
+                       private_limit=(outbound_config.get('private_per_second', 1), 1),
+                       group_limit=(outbound_config.get('group_per_minute', 20), 60),
+                       max_retries=outbound_config.get('max_retries', 5),
+                       workers=outbound_config.get('workers', 4))
+
+# Локальная база заказов и разговоров и очередь журнала заказов открываются в open_storage():
+# они работают с файлами и запускают фоновые потоки, поэтому при импорте модуля их ещё нет
+storage_config = config_data.get('storage', {})
+# Открытые заказы в памяти с записью в локальную базу
+order_store: Optional[OrderStore] = None
+# Незавершённые заказы покупателей переживают перезапуск бота
+persistence: Optional[SQLitePersistence] = None
+
+# Метрики отдаются в формате Prometheus на локальном адресе; port: null отключает их
+metrics_config = config_data.get('metrics', {})
+ORDERS = Counter('eastwoods_orders_total', 'Заказы по исходу', ['outcome'])
+ORDERS_CONFIRMED, ORDERS_CANCELLED, ORDERS_COMPLETED = (ORDERS.labels(outcome)
+                                                        for outcome in ('confirmed', 'cancelled', 'completed'))
+Gauge('eastwoods_open_orders', 'Открытые заказы в очереди баристы',
+      lambda: len(order_store) if order_store is not None else 0)
+Gauge('eastwoods_outbound_pending', 'Сообщения, ожидающие отправки', lambda: len(outbox))
+# Подтверждённые и выданные заказы попадают в журнал в той же таблице, что и меню
+order_log_config = config_data.get('order_log', {})
+ORDER_LOG_SHEET = order_log_config.get('sheet', 'Журнал заказов')
+order_log: Optional[OrderLogExporter] = None
+Gauge('eastwoods_order_log_pending', 'События заказов, ожидающие выгрузки в журнал',
+      lambda: len(order_log) if order_log is not None else 0)
+# Повторные нажатия кнопок, меняющих заказы, отбрасываются до обработчиков
+idempotency_config = config_data['telegram_bot'].get('idempotency', {})
+handled_callbacks = IdempotencyCache(ttl=idempotency_config.get('ttl', 600),
+                                     max_size=idempotency_config.get('max_size', 20000))
+DUPLICATE_CALLBACKS = Counter('eastwoods_duplicate_callbacks_total', 'Отброшенные повторные нажатия кнопок', ['key'])
+DUPLICATE_QUERIES, DUPLICATE_TAPS = (DUPLICATE_CALLBACKS.labels(key) for key in ('query', 'tap'))
+Gauge('eastwoods_idempotency_keys', 'Ключи нажатий, которые помнит защита от повторов', lambda: len(handled_callbacks))
+# Ответы на нажатия кнопок не отправляют правок, которые ничего не меняют
+replies = CallbackReplies(max_size=config_data['telegram_bot'].get('rendered_messages', 10000), outbox=outbox)
+Gauge('eastwoods_rendered_messages', 'Сообщения, чьё содержимое помнит бот', lambda: len(replies))
+Gauge('eastwoods_menu_version', 'Версия опубликованного меню',
+      lambda: menu_store.current.version if menu_store.current is not None else 0)
+Gauge('eastwoods_stop_list_items', 'Позиции меню в стоп-листе',
+      lambda: len(menu_store.current.stop_list) if menu_store.current is not None else 0)
+
+# Клавиатуры, не зависящие от меню, собираются один раз
+SYRUP_AMOUNT_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(amount, callback_data=f'syrup_{amount}')] for amount in
+     ["Не хочу", "Один, пожалуйста", "Давайте два"]])
+# Когда все сиропы в стоп-листе, остаётся только отказ от сиропа
+NO_SYRUP_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("Не хочу", callback_data='syrup_Не хочу')]])
+TEMPERATURE_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(temp, callback_data=f'temperature_{temp}') for temp in ['Холодный', 'Горячий']]])
+# «Подтвердить заказ» отправляет заказ на стойку с самой короткой очередью,
+# а если стоек несколько, покупатель может выбрать ту, у которой заберёт заказ
+CONFIRM_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("Подтвердить заказ", callback_data="confirm")]] +
+    ([[InlineKeyboardButton(f"Подтвердить и забрать: {station.name}", callback_data=f"confirm_{index}")]
+      for index, station in enumerate(STATIONS)] if len(STATIONS) > 1 else []) +
+    [[InlineKeyboardButton("Отменить заказ", callback_data="cancel")]])
+# Каждый шаг заказа принимает только кнопки своей клавиатуры
+CONFIRM_PATTERN = r'^(confirm(_\d+)?|cancel)$'
+CUSTOMER_BUTTONS_PATTERN = rf'^(drink|milk|syrup|volume|temperature)_|{CONFIRM_PATTERN}'
 
 
 # Функции для команд
@@ -124,15 +144,27 @@ def start(update: Update, context: CallbackContext) -> int:
     context.user_data['volume'] = None
     context.user_data['temperature'] = None
 
-    keyboard = [[InlineKeyboardButton(drink_type, callback_data=f'drink_{drink_type}')] for drink_type in drink_types]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text('Добро пожаловать в нашу кофейню! Пожалуйста, выберите тип напитка:',
-                              reply_markup=reply_markup)
+    outbox.send_message(update.effective_chat.id, 'Добро пожаловать в нашу кофейню! Пожалуйста, выберите тип напитка:',
+                        reply_markup=menu_store.current.drink_types_markup)
     logger.info(f"Пользователь {update.effective_user.username} выбрал команду /start")
 
     return SELECT_DRINK_TYPE
 
 
+def syrup_amount_markup(menu: Menu) -> InlineKeyboardMarkup:
+    return SYRUP_AMOUNT_MARKUP if menu.syrups_markup.inline_keyboard else NO_SYRUP_MARKUP
+
+
+def ask_volume(query: CallbackQuery, menu: Menu, drink: str, notice: Optional[str] = None) -> int:
+    # Пока покупатель выбирал, могли закончиться все объёмы напитка, а с ними и сам напиток
+    if not menu.is_offered(DRINKS_SHEET, drink):
+        replies.edit(query, "Пожалуйста, выберите тип напитка:", menu.drink_types_markup,
+                     notice="Этого напитка сейчас нет")
+        return SELECT_DRINK_TYPE
+    replies.edit(query, "Выберите объем:", menu.volumes_markup(drink), notice=notice)
+    return SELECT_VOLUME
+
+
 def reset_order(update: Update, context: CallbackContext) -> int:
     context.user_data['drink'] = None  # Обнуляем выбранный напиток
     context.user_data['milk'] = None  # Обнуляем выбранное молоко
@@ -146,315 +178,673 @@ def reset_order(update: Update, context: CallbackContext) -> int:
 # Определение обработчиков для каждого шага
 def drink_type(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
 
     desired_type = query.data.split('_')[1]
-    matched_drinks = get_drinks_by_type(drinks, desired_type)
-
-    keyboard = [[InlineKeyboardButton(drink, callback_data=f'drink_{drink}')] for drink in matched_drinks]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text="Выберете напиток:", reply_markup=reply_markup)
+    menu = menu_store.current
+    if desired_type not in menu.drinks_by_type:
+        # Все напитки этого типа успели попасть в стоп-лист
+        replies.edit(query, "Пожалуйста, выберите тип напитка:", menu.drink_types_markup,
+                     notice="Этих напитков сейчас нет")
+        return SELECT_DRINK_TYPE
+    replies.edit(query, "Выберете напиток:", menu.drinks_markup(desired_type))
     return SELECT_DRINK
 
 
 def drink(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
     context.user_data['drink'] = query.data.split('_')[1]  # Сохраняем выбранный напиток
 
     # Логируем нажатие кнопки
     logger.info(f"Пользователь {user_update.effective_user.username} выбрал напиток: {context.user_data['drink']}")
-    if drinks[context.user_data['drink']]['Молоко'] == '-':
+    menu = menu_store.current
+    if not menu.is_offered(DRINKS_SHEET, context.user_data['drink']):
+        # Клавиатуру показали до того, как напиток попал в стоп-лист
+        drink_type = menu.drinks.get(context.user_data['drink'], {}).get(TYPE_COLUMN)
+        if drink_type in menu.drinks_by_type:
+            replies.edit(query, "Выберете напиток:", menu.drinks_markup(drink_type), notice="Этого напитка сейчас нет")
+            return SELECT_DRINK
+        replies.edit(query, "Пожалуйста, выберите тип напитка:", menu.drink_types_markup,
+                     notice="Этого напитка сейчас нет")
+        return SELECT_DRINK_TYPE
+    if menu.drinks[context.user_data['drink']]['Молоко'] == '-':
         context.user_data['milk'] = 'Нет'
-
-        syrup_amount = ["Не хочу", "Один, пожалуйста", "Давайте два"]
-        keyboard = [[InlineKeyboardButton(amount, callback_data=f'syrup_{amount}')] for amount in syrup_amount]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        query.edit_message_text(text="Хотите сироп?", reply_markup=reply_markup)
+        replies.edit(query, "Хотите сироп?", syrup_amount_markup(menu))
 
         return APPROVE_SYRUP
 
+    elif not menu.milks_markup.inline_keyboard:
+        # Всё молоко в стоп-листе, а без него этот напиток не приготовить
+        drink_type = menu.drinks[context.user_data['drink']].get(TYPE_COLUMN)
+        replies.edit(query, "Выберете напиток:", menu.drinks_markup(drink_type), notice="Молоко закончилось")
+        return SELECT_DRINK
+
     else:
-        keyboard = [[InlineKeyboardButton(milk, callback_data=f'milk_{milk}')] for milk in milks]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        query.edit_message_text(text="Выберите тип молока:", reply_markup=reply_markup)
+        replies.edit(query, "Выберите тип молока:", menu.milks_markup)
 
         return SELECT_MILK
 
 
 def milk(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
     context.user_data['milk'] = query.data.split('_')[1]  # Сохраняем выбранное молоко
 
     # Логируем нажатие кнопки
     logger.info(f"Пользователь {user_update.effective_user.username} выбрал тип молока: {context.user_data['milk']}")
-    syrup_amount = ["Не хочу", "Один, пожалуйста", "Давайте два"]
-    keyboard = [[InlineKeyboardButton(amount, callback_data=f'syrup_{amount}')] for amount in syrup_amount]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text="Хотите сироп?", reply_markup=reply_markup)
+    menu = menu_store.current
+    if not menu.is_offered(MILK_SHEET, context.user_data['milk']):
+        if not menu.milks_markup.inline_keyboard:
+            replies.edit(query, "Пожалуйста, выберите тип напитка:", menu.drink_types_markup,
+                         notice="Молоко закончилось")
+            return SELECT_DRINK_TYPE
+        replies.edit(query, "Выберите тип молока:", menu.milks_markup, notice="Этого молока сейчас нет")
+        return SELECT_MILK
+    replies.edit(query, "Хотите сироп?", syrup_amount_markup(menu))
     return APPROVE_SYRUP
 
 
 def approve_syrup(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
     syrup_amount = query.data.split('_')[1]
     if syrup_amount == "Не хочу":
         context.user_data['syrup_1'] = 'Нет'
         context.user_data['syrup_2'] = 'Нет'
         logger.info(f"Пользователь {user_update.effective_user.username} от сиропа")
-        volumes = available_volumes(context.user_data['drink'])
-        keyboard = [[InlineKeyboardButton(volume, callback_data=f'volume_{volume}')] for volume in volumes]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        query.edit_message_text(text="Выберите объем:", reply_markup=reply_markup)
-        return SELECT_VOLUME
+        return ask_volume(query, menu_store.current, context.user_data['drink'])
+    if not menu_store.current.syrups_markup.inline_keyboard:
+        # Кнопку выбора сиропа нажали до того, как закончился последний сироп
+        replies.edit(query, "Хотите сироп?", NO_SYRUP_MARKUP, notice="Сиропы закончились")
+        return APPROVE_SYRUP
     if syrup_amount == "Один, пожалуйста":
         context.user_data['syrup_1'] = 'Нет'
-        keyboard = [[InlineKeyboardButton(syrup, callback_data=f'syrup_{syrup}')] for syrup in syrups]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        query.edit_message_text(text="Выберите сироп:", reply_markup=reply_markup)
+        replies.edit(query, "Выберите сироп:", menu_store.current.syrups_markup)
         return SELECT_SYRUP_2
     if syrup_amount == "Давайте два":
-        keyboard = [[InlineKeyboardButton(syrup, callback_data=f'syrup_{syrup}')] for syrup in syrups]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        query.edit_message_text(text="Выберите сироп:", reply_markup=reply_markup)
+        replies.edit(query, "Выберите сироп:", menu_store.current.syrups_markup)
         return SELECT_SYRUP_1
+    replies.answer(query)
 
 
 def syrup_1(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
 
     context.user_data['syrup_1'] = query.data.split('_')[1]  # Сохраняем выбранное молоко
 
     # Логируем нажатие кнопки
     logger.info(f"Пользователь {user_update.effective_user.username} выбрал сироп: {context.user_data['syrup_1']}")
+    menu = menu_store.current
+    if not menu.is_offered(SYRUPS_SHEET, context.user_data['syrup_1']):
+        return syrup_unavailable(query, menu, SELECT_SYRUP_1)
 
-    keyboard = [[InlineKeyboardButton(syrup, callback_data=f'syrup_{syrup}')] for syrup in syrups]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text="Выберите сироп :) ", reply_markup=reply_markup)
+    replies.edit(query, "Выберите сироп :) ", menu.syrups_markup)
 
     return SELECT_SYRUP_2
 
 
 def syrup_2(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
     context.user_data['syrup_2'] = query.data.split('_')[1]  # Сохраняем выбранный сироп
 
     # Логируем нажатие кнопки
     logger.info(f"Пользователь {user_update.effective_user.username} выбрал сироп: {context.user_data['syrup_2']}")
-    volumes = available_volumes(context.user_data['drink'])
-    keyboard = [[InlineKeyboardButton(volume, callback_data=f'volume_{volume}')] for volume in volumes]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text="Выберите объем:", reply_markup=reply_markup)
+    menu = menu_store.current
+    if not menu.is_offered(SYRUPS_SHEET, context.user_data['syrup_2']):
+        return syrup_unavailable(query, menu, SELECT_SYRUP_2)
+    return ask_volume(query, menu, context.user_data['drink'])
 
-    return SELECT_VOLUME
+
+def syrup_unavailable(query: CallbackQuery, menu: Menu, state: int) -> int:
+    if not menu.syrups_markup.inline_keyboard:
+        replies.edit(query, "Хотите сироп?", NO_SYRUP_MARKUP, notice="Сиропы закончились")
+        return APPROVE_SYRUP
+    replies.edit(query, "Выберите сироп:", menu.syrups_markup, notice="Этого сиропа сейчас нет")
+    return state
 
 
 def volume(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
     context.user_data['volume'] = query.data.split('_')[1]  # Сохраняем выбранный объем
 
     # Логируем нажатие кнопки
     logger.info(f"Пользователь {user_update.effective_user.username} выбрал объем: {context.user_data['volume']}")
-    temperatures = ['Холодный', 'Горячий']
-    keyboard = [[InlineKeyboardButton(temp, callback_data=f'temperature_{temp}') for temp in temperatures]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text="Выберите температуру напитка:", reply_markup=reply_markup)
+    menu = menu_store.current
+    if not menu.is_offered(DRINKS_SHEET, context.user_data['drink'], context.user_data['volume']):
+        return ask_volume(query, menu, context.user_data['drink'], notice="Этого объёма сейчас нет")
+    replies.edit(query, "Выберите температуру напитка:", TEMPERATURE_MARKUP)
 
     return SELECT_TEMPERATURE
 
 
 def temperature(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
     context.user_data['temperature'] = query.data.split('_')[1]  # Сохраняем выбранную температуру
 
     # Логируем нажатие кнопки
     logger.info(
         f"Пользователь {user_update.effective_user.username} выбрал температуру: {context.user_data['temperature']}")
 
-    # Создаем кнопки для подтверждения заказа и отмены
-    keyboard = [
-        [InlineKeyboardButton("Подтвердить заказ", callback_data="confirm")],
-        [InlineKeyboardButton("Отменить заказ", callback_data="cancel")],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
     user_order_description = f"Ваш заказ:\n{context.user_data['drink']},\nМолоко: {context.user_data['milk']},\nСиропы: {context.user_data['syrup_1']}, {context.user_data['syrup_2']},\nОбъем: {context.user_data['volume']}ml,\nТемпература: {context.user_data['temperature']}."
-    query.edit_message_text(text=user_order_description + "\nПодтвердите ваш заказ или отмените:",
-                            reply_markup=reply_markup)
+    replies.edit(query, user_order_description + "\nПодтвердите ваш заказ или отмените:", CONFIRM_MARKUP)
 
     return CONFIRM_ORDER
 
 
 def process_user_choice(user_update: Update, context: CallbackContext) -> int:
     query = user_update.callback_query
-    query.answer()
     user_choice = query.data
     user = user_update.effective_user
 
     # Используйте user_id вместо username, если username отсутствует
     user_identifier = user.username if user.username else str(user.id)
 
-    if user_choice == 'confirm':
-        order_id = int(time.time() + 3 * 60 * 60)  # Используйте текущее время как идентификатор заказа
+    unavailable = unavailable_items(menu_store.current, context.user_data) if user_choice != 'cancel' else []
+    # Кнопки подтверждения убираются из сообщения, чтобы их нельзя было нажать ещё раз
+    if unavailable:
+        replies.edit(query, f"К сожалению, пока вы выбирали, закончилось: {', '.join(unavailable)}.\n"
+                            "Соберите заказ заново: /start")
+        logger.info(f"Пользователь {user_identifier} не смог заказать: {', '.join(unavailable)} в стоп-листе")
+
+    elif user_choice == 'confirm' or user_choice.startswith('confirm_'):
+        order_id = order_store.next_order_id()
         user_order_description = f"Ваш заказ:\n{context.user_data['drink']},\nМолоко: {context.user_data['milk']},\nСиропы: {context.user_data['syrup_1']}, {context.user_data['syrup_2']},\nОбъем: {context.user_data['volume']}ml,\nТемпература: {context.user_data['temperature']}."
 
-        barista_chat_username = config_data['telegram_bot']['barista_chat_id']
+        station = station_by_index(STATIONS, user_choice[len('confirm_'):]) if user_choice != 'confirm' else None
+        if station is None:
+            station = least_loaded(STATIONS, order_store.queue_length)
         user_link = "@" + user_identifier if user.username else str(user_identifier)
         message_to_barista = f"Новый заказ от {user_link}:\n{user_order_description}"
 
         keyboard = [
-            [InlineKeyboardButton("Заказ получил", callback_data=f"received_%@!#@${user_identifier}_%@!#@${order_id}")]
+            [InlineKeyboardButton("Заказ получил", callback_data=encode_order_callback(OrderAction.RECEIVED, order_id))]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
-        context.bot.send_message(chat_id=barista_chat_username, text=message_to_barista, reply_markup=reply_markup)
-        user_orders[user_identifier].append(
-            {'order_id': order_id, 'chat_id': query.message.chat.id, 'order': user_order_description})
-        context.bot.send_message(chat_id=user_update.effective_user.id,
-                                 text=user_order_description + "\nподтвержден и отправлен на приготовление.")
+        outbox.send_message(station.chat_id, message_to_barista, reply_markup=reply_markup)
+        order = Order(order_id, user_identifier, query.message.chat.id, user_order_description, station=station.name)
+        order_store.add(order)
+        order_log.record('Подтверждён', order)
+        pickup = f"\nЗаберите его у стойки «{station.name}»." if len(STATIONS) > 1 else ""
+        replies.edit(query, user_order_description + "\nподтвержден и отправлен на приготовление." + pickup)
+        ORDERS_CONFIRMED.inc()
         logger.info(
-            f"Пользователь {user_identifier} подтвердил заказ: {user_order_description}")
+            f"Пользователь {user_identifier} подтвердил заказ на стойку {station.name}: {user_order_description}")
 
-    elif user_choice == 'cancel':
-        context.bot.send_message(chat_id=user_update.effective_user.id, text="Заказ отменен.")
+    else:
+        replies.edit(query, "Заказ отменен.")
+        ORDERS_CANCELLED.inc()
         logger.info(
             f"Пользователь {user_identifier} отменил заказ")
 
     return reset_order(user_update, context)
 
 
-def coffee_ready(update: Update, context: CallbackContext) -> None:
-    # Определите, откуда пришел запрос
-    message = update.message if update.message else update.callback_query.message
+def unavailable_items(menu: Menu, user_data: Dict) -> List[str]:
+    """
+    Позиции заказа, которые попали в стоп-лист, пока покупатель выбирал.
 
-    if not user_orders:
-        message.reply_text('В данный момент активных заказов нет.')
-        return
+    :param menu: Текущее меню.
+    :param user_data: Выбор покупателя.
+    :return: Названия позиций, которых больше нет.
+    """
+    drink = user_data.get('drink')
+    if not menu.is_offered(DRINKS_SHEET, drink):
+        unavailable = [drink]
+    elif not menu.is_offered(DRINKS_SHEET, drink, user_data.get('volume')):
+        unavailable = [f"{drink} {user_data.get('volume')} мл"]
+    else:
+        unavailable = []
+    for section, key in ((MILK_SHEET, 'milk'), (SYRUPS_SHEET, 'syrup_1'), (SYRUPS_SHEET, 'syrup_2')):
+        name = user_data.get(key)
+        # 'Нет' - напиток без молока или без сиропа
+        if name and name != 'Нет' and not menu.is_offered(section, name) and name not in unavailable:
+            unavailable.append(name)
+    return unavailable
+
+
+def queue_page(station: Station, page: int):
+    """
+    Текст и клавиатура одной страницы очереди заказов стойки.
+
+    Выбирается только срез очереди размером со страницу, поэтому время не зависит
+    от числа открытых заказов.
+
+    :param station: Стойка, чью очередь показать.
+    :param page: Номер страницы, считая с нуля. Если заказов стало меньше, показывается последняя.
+    :return: Текст сообщения и клавиатура или None, если заказов нет.
+    """
+    total = order_store.queue_length(station.name)
+    if not total:
+        return 'В данный момент активных заказов нет.', None
+
+    pages = (total + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
 
     # Создаем список кнопок
     keyboard = []
-    for username, orders in user_orders.items():
-        for order in orders:
-            order_id = order['order_id']
-            date_time = datetime.datetime.utcfromtimestamp(order_id)
-            button_text = f"{username}: {date_time}"
-            callback_data = f"ready_%@!#@${username}_%@!#@${order_id}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
+    for order in order_store.open_orders(station.name, page * QUEUE_PAGE_SIZE, QUEUE_PAGE_SIZE):
+        date_time = datetime.datetime.utcfromtimestamp(int(order.created_at)) + TIME_OFFSET
+        button_text = f"{order.username}: {date_time}"
+        callback_data = encode_order_callback(OrderAction.READY, order.order_id)
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=callback_data)])
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("« Назад", callback_data=encode_order_callback(OrderAction.PAGE, page - 1)))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Вперёд »", callback_data=encode_order_callback(OrderAction.PAGE, page + 1)))
+    if navigation:
+        keyboard.append(navigation)
+
+    return f'Выберите заказ (страница {page + 1} из {pages}, всего {total}):', InlineKeyboardMarkup(keyboard)
+
+
+def coffee_ready(update: Update, context: CallbackContext) -> None:
+    # Фильтр обработчика пропускает только чаты стоек
+    text, reply_markup = queue_page(STATIONS_BY_CHAT[update.message.chat_id], 0)
+    outbox.send_message(update.message.chat_id, text, reply_markup=reply_markup)
+
+
+def station_order(station: Station, order_id: int) -> Optional[Order]:
+    """
+    Открытый заказ из очереди стойки. Заказы других стоек из её чата не видны.
+    """
+    order = order_store.get(order_id)
+    return order if order is not None and order.station == station.name else None
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    message.reply_text('Выберите заказ:', reply_markup=reply_markup)
 
+def show_queue_page(update: Update, context: CallbackContext, station: Station, page: int) -> None:
+    # Листание очереди правит то же сообщение, а не присылает новое.
+    # Если очередь с прошлого показа не изменилась, правка не отправляется
+    text, reply_markup = queue_page(station, page)
+    replies.edit(update.callback_query, text, reply_markup)
 
-def order_received(update: Update, context: CallbackContext) -> None:
+
+def order_callback(update: Update, context: CallbackContext) -> None:
+    # Единая точка разбора callback_data кнопок заказа
+    query = update.callback_query
+    try:
+        action, order_id = decode_order_callback(query.data)
+    except ValueError:
+        logger.warning(f"Не удалось разобрать данные кнопки заказа: {query.data!r}")
+        replies.answer(query, "Ошибка в данных заказа.")
+        return
+
+    # Кнопки заказов работают только в чатах стоек, и каждая стойка видит лишь свою очередь
+    station = STATIONS_BY_CHAT.get(query.message.chat.id) if query.message is not None else None
+    if station is None:
+        logger.warning(f"Кнопка заказа нажата вне чата стойки: {query.data!r}")
+        replies.answer(query)
+        return
+
+    ORDER_ACTIONS[action](update, context, station, order_id)
+
+
+def order_received(update: Update, context: CallbackContext, station: Station, order_id: int) -> None:
     query = update.callback_query
-    query.answer()
 
-    _, username, order_id = query.data.split('_%@!#@$')
-    order_id = int(order_id)
+    # Текст заказа остаётся, убирается только кнопка «Заказ получил»
+    order = order_store.mark_received(order_id) if station_order(station, order_id) is not None else None
+    if order is not None:
+        outbox.send_message(order.chat_id, "Начали готовить ваш заказ")
+        replies.edit(query, query.message.text)
+        return
+
+    replies.edit(query, query.message.text, notice=f"Заказ №{order_id} уже был обработан или не найден.")
+
+
+def order_gone(query: CallbackQuery, station: Station, order_id: int) -> None:
+    # Вместо бесполезного сообщения об ошибке показываем очередь, а ошибку - всплывающим текстом
+    text, reply_markup = queue_page(station, 0)
+    replies.edit(query, text, reply_markup, notice=f"Заказ №{order_id} уже был обработан или не найден.")
+
 
-    for order in user_orders[username]:
-        if order['order_id'] == order_id:
-            chat_id = order['chat_id']
-            context.bot.send_message(chat_id=chat_id, text="Начали готовить ваш заказ")
-            # Здесь можно удалить заказ из списка, если это необходимо
-            # user_orders[username].remove(order)
-            query.edit_message_text(text=query.message.text)
-            return
+def order_ready(update: Update, context: CallbackContext, station: Station, order_id: int) -> None:
+    query = update.callback_query
+
+    # Показать подробности заказа
+    order = station_order(station, order_id)
+    if order is not None:
+        order_details = f"Заказ для {order.username}: {order.description}"
+        # Возвращаемся на ту страницу очереди, где стоит заказ
+        page = (order_store.position(order_id) or 0) // QUEUE_PAGE_SIZE
+        keyboard = [
+            [InlineKeyboardButton("Заказ готов", callback_data=encode_order_callback(OrderAction.CONFIRM, order_id))],
+            [InlineKeyboardButton("Вернуться к заказам", callback_data=encode_order_callback(OrderAction.PAGE, page))]
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        replies.edit(query, order_details, reply_markup)
+        return
 
-    query.edit_message_text(text=f"Заказ для {username} уже был обработан или не найден.")
+    order_gone(query, station, order_id)
 
 
-def order_ready(update: Update, context: CallbackContext) -> None:
+def confirm_order(update: Update, context: CallbackContext, station: Station, order_id: int) -> None:
     query = update.callback_query
-    query.answer()
 
-    # Разбиение callback_data на части
-    data_parts = query.data.split('_%@!#@$')
-    if len(data_parts) != 3:
-        query.edit_message_text(text="Ошибка в данных заказа.")
+    # Обработать подтверждение заказа
+    if station_order(station, order_id) is None:
+        order_gone(query, station, order_id)
+        return
+    position = order_store.position(order_id)
+    order = order_store.complete(order_id)
+    if order is not None:
+        ORDERS_COMPLETED.inc()
+        order_log.record('Выдан', order)
+        outbox.send_message(order.chat_id, f"Ваш заказ готов: {order.description}")
+        # Сразу показываем ту же страницу очереди уже без выданного заказа
+        text, reply_markup = queue_page(station, (position or 0) // QUEUE_PAGE_SIZE)
+        replies.edit(query, f"Заказ для {order.username} отправлен.\n\n{text}", reply_markup)
         return
 
-    action = data_parts[0]
-    username = data_parts[1]
-    order_id = int(data_parts[2])
-    print(action, username, order_id)
-
-    if action == 'ready':
-        # Показать подробности заказа
-        for order in user_orders[username]:
-            if order['order_id'] == order_id:
-                order_details = f"Заказ для {username}: {order['order']}"
-                keyboard = [
-                    [InlineKeyboardButton("Заказ готов",
-                                          callback_data=f"confirm_order_%@!#@${username}_%@!#@${order_id}")],
-                    [InlineKeyboardButton("Вернуться к заказам", callback_data="back_to_orders")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                query.edit_message_text(text=order_details, reply_markup=reply_markup)
-                return
-
-    elif action == 'confirm_order':
-        # Обработать подтверждение заказа
-        for order in user_orders[username]:
-            if order['order_id'] == order_id:
-                chat_id = order['chat_id']
-                context.bot.send_message(chat_id=chat_id, text=f"Ваш заказ готов: {order['order']}")
-                user_orders[username].remove(order)
-                query.edit_message_text(text=f"Заказ для {username} отправлен.")
-                return
-
-    query.edit_message_text(text=f"Заказ для {username} уже был обработан или не найден.")
-
-
-def back_to_orders_handler(update: Update, context: CallbackContext) -> None:
-    coffee_ready(update, context)
+    order_gone(query, station, order_id)
+
+
+ORDER_ACTIONS = {
+    OrderAction.RECEIVED: order_received,
+    OrderAction.READY: order_ready,
+    OrderAction.CONFIRM: confirm_order,
+    OrderAction.PAGE: show_queue_page,
+}
+
+
+def stop_list_sections(menu: Menu) -> List[Tuple[str, Optional[str]]]:
+    """Разделы стоп-листа: молоко, сиропы и напитки каждого типа, как (лист меню, тип напитка)."""
+    return [(MILK_SHEET, None), (SYRUPS_SHEET, None)] + [(DRINKS_SHEET, drink_type)
+                                                         for drink_type in menu.sheet_drinks_by_type]
+
+
+def stop_list_names(menu: Menu, section_number: int) -> Tuple[str, Sequence[str]]:
+    section, drink_type = stop_list_sections(menu)[section_number]
+    if section == MILK_SHEET:
+        return section, menu.milks
+    if section == SYRUPS_SHEET:
+        return section, menu.syrups
+    return section, menu.sheet_drinks_by_type[drink_type]
+
+
+def stop_list_item(menu: Menu, numbers: Sequence[int]) -> Tuple[StopItem, StopListAction, Tuple[int, ...]]:
+    """
+    Позиция, которую переключает кнопка, и экран, на который после этого вернуться.
+
+    :raises IndexError: Если номера не подходят к меню.
+    """
+    section_number, number, volume_number = numbers
+    if min(numbers) < 0:
+        raise IndexError(f"Отрицательный номер позиции стоп-листа: {numbers}")
+    section, names = stop_list_names(menu, section_number)
+    name = names[number]
+    if section != DRINKS_SHEET:
+        return (section, name, ''), StopListAction.ITEMS, (section_number,)
+    volume = menu.sheet_volumes[name][volume_number - 1] if volume_number else ''
+    return (section, name, volume), StopListAction.DRINK, (section_number, number)
+
+
+def stop_list_page(menu: Menu, action: StopListAction, numbers: Sequence[int]):
+    """
+    Текст и клавиатура экрана стоп-листа.
+
+    :param menu: Текущее меню.
+    :param action: Какой экран показать: разделы, позиции раздела или напиток с объёмами.
+    :param numbers: Номер раздела и номер напитка в нём.
+    :return: Текст сообщения и клавиатура.
+    :raises IndexError: Если номера не подходят к меню.
+    """
+    def button(text, button_action, *values):
+        return InlineKeyboardButton(text, callback_data=encode_stop_list_callback(menu.version, button_action, *values))
+
+    def mark(item, text):
+        return f"{'⛔' if item in menu.stop_list else '✅'} {text}"
+
+    if action == StopListAction.SECTIONS:
+        keyboard = [[button(drink_type or section, StopListAction.ITEMS, number)]
+                    for number, (section, drink_type) in enumerate(stop_list_sections(menu))]
+        return (f'Стоп-лист (⛔ - нет в наличии, позиций: {len(menu.stop_list)}). Выберите раздел:',
+                InlineKeyboardMarkup(keyboard))
+
+    section_number = numbers[0]
+    section, names = stop_list_names(menu, section_number)
+    if action == StopListAction.ITEMS:
+        if section == DRINKS_SHEET:
+            # Напиток открывается отдельным экраном, где можно убрать и отдельные объёмы
+            keyboard = [[button(mark((section, name, ''), name) + (' (не все объёмы)' if menu.volumes[name] !=
+                                                                   menu.sheet_volumes[name] else ''),
+                                StopListAction.DRINK, section_number, number)]
+                        for number, name in enumerate(names)]
+            text = 'Выберите напиток:'
+        else:
+            keyboard = [[button(mark((section, name, ''), name), StopListAction.TOGGLE, section_number, number, 0)]
+                        for number, name in enumerate(names)]
+            text = f'{section}: нажмите, чтобы убрать в стоп-лист или вернуть в меню'
+        keyboard.append([button('« Разделы', StopListAction.SECTIONS)])
+        return text, InlineKeyboardMarkup(keyboard)
+
+    number = numbers[1]
+    name = names[number]
+    keyboard = [[button(mark((section, name, ''), 'Весь напиток'), StopListAction.TOGGLE, section_number, number, 0)]]
+    keyboard += [[button(mark((section, name, volume), f'{volume} мл'), StopListAction.TOGGLE, section_number, number,
+                          volume_number)]
+                 for volume_number, volume in enumerate(menu.sheet_volumes[name], start=1)]
+    keyboard.append([button('« Назад', StopListAction.ITEMS, section_number)])
+    return f'{name}: нажмите, чтобы убрать в стоп-лист или вернуть в меню', InlineKeyboardMarkup(keyboard)
+
+
+def stop_list_command(update: Update, context: CallbackContext) -> None:
+    text, reply_markup = stop_list_page(menu_store.current, StopListAction.SECTIONS, ())
+    outbox.send_message(update.effective_chat.id, text, reply_markup=reply_markup)
+
+
+def stop_list_callback(update: Update, context: CallbackContext) -> None:
+    query = update.callback_query
+    if query.message is None or query.message.chat.id not in STATIONS_BY_CHAT:
+        replies.answer(query)
+        return
+
+    menu = menu_store.current
+    notice = None
+    try:
+        version, action, numbers = decode_stop_list_callback(query.data)
+        if version != menu.version:
+            raise ValueError(f"Клавиатура стоп-листа построена для версии меню {version}")
+        if action == StopListAction.TOGGLE:
+            item, action, numbers = stop_list_item(menu, numbers)
+            stopped = item not in menu.stop_list
+            # Клавиатуры покупателей меняются сразу, таблица обновится в фоне
+            menu = menu_store.set_stopped(item, stopped)
+            _, name, volume = item
+            label = f'{name} {volume} мл' if volume else name
+            notice = f"{label}: нет в наличии" if stopped else f"{label} снова в меню"
+        text, reply_markup = stop_list_page(menu, action, numbers)
+    except (ValueError, IndexError, KeyError) as e:
+        # Меню перезагрузили из таблицы, номера позиций в клавиатуре устарели
+        logger.info(f"Устаревшая кнопка стоп-листа: {e}")
+        notice = "Меню обновилось, выберите раздел заново"
+        text, reply_markup = stop_list_page(menu, StopListAction.SECTIONS, ())
+    # После переключения меняются только отметки на кнопках, и уходит правка одной клавиатуры
+    replies.edit(query, text, reply_markup, notice=notice)
+
+
+def refresh_menu_job(context: CallbackContext) -> None:
+    try:
+        menu_store.refresh_if_changed()
+    except Exception:
+        logger.exception("Не удалось проверить обновления меню")
 
 
 def update_menu_command(update: Update, context: CallbackContext):
     try:
-        global drinks, milks, syrups
-        drinks, milks, syrups = load_menu_data()
-        update.message.reply_text("Меню было успешно обновлено.")
+        menu_store.refresh()
+        outbox.send_message(update.effective_chat.id, "Меню было успешно обновлено.")
     except Exception as e:
-        update.message.reply_text(f"Произошла ошибка при обновлении меню: {e}")
+        outbox.send_message(update.effective_chat.id, f"Произошла ошибка при обновлении меню: {e}")
 
 
-def main() -> None:
-    updater = Updater(TOKEN, use_context=True)
+def answer_stale_button(user_update: Update, context: CallbackContext) -> None:
+    # Кнопка из клавиатуры, которую покупатель уже прошёл
+    replies.answer(user_update.callback_query, "Эта кнопка больше не действует. Новый заказ: /start")
+
+
+def answer_while_busy(user_update: Update, context: CallbackContext) -> None:
+    # Нажатие не выполнено, поэтому повторить его можно
+    handled_callbacks.discard(tap_key(user_update.callback_query))
+    replies.answer(user_update.callback_query)
+
+
+def tap_key(query: CallbackQuery) -> tuple:
+    """
+    Ключ нажатия: кнопка в определённой версии сообщения.
+
+    Двойной тап даёт два запроса с разными id, но с одним и тем же сообщением. После правки
+    сообщения у него меняется edit_date, поэтому нажатие той же кнопки в новой версии - новое.
+    """
+    message = query.message
+    if message is None:
+        return 'tap', query.inline_message_id, query.data
+    version = message.edit_date or message.date
+    return 'tap', message.chat_id, message.message_id, version.timestamp() if version else None, query.data
+
+
+def drop_duplicate_callback(update: Update, context: CallbackContext) -> None:
+    """
+    Отбросить повторное нажатие кнопки подтверждения или кнопки заказа.
+
+    Работает в потоке диспетчера до всех остальных обработчиков, поэтому из двух одинаковых
+    нажатий дальше проходит только первое. Повтор получает ответ на callback и больше ничего.
+    """
+    query = update.callback_query
+    if handled_callbacks.seen(('query', query.id)):
+        # Telegram доставил то же обновление ещё раз
+        DUPLICATE_QUERIES.inc()
+    elif handled_callbacks.seen(tap_key(query)):
+        DUPLICATE_TAPS.inc()
+    else:
+        return
+    context.dispatcher.run_async(replies.answer, query)
+    raise DispatcherHandlerStop()
+
+
+def open_storage() -> None:
+    """
+    Открыть базу заказов, сохранение разговоров и очередь журнала заказов.
+
+    Вызывается при запуске бота; build_updater открывает хранилище сам, если это ещё не сделано.
+    Фоновая выгрузка журнала заказов запускается отдельно, через ``order_log.start()``.
+    """
+    global order_store, persistence, order_log
+    if order_store is not None:
+        return
+    path = storage_config.get('path', 'orders.db')
+    order_store = OrderStore(path, stations=[station.name for station in STATIONS])
+    persistence = SQLitePersistence(path, flush_interval=storage_config.get('persistence_interval', 1.0))
+    order_log = OrderLogExporter(order_log_config.get('spool_path', 'order_log.jsonl'),
+                                 lambda rows: menu_store.append_rows(ORDER_LOG_SHEET, rows, header=ORDER_LOG_HEADER),
+                                 flush_interval=order_log_config.get('flush_interval', 30), time_offset=TIME_OFFSET)
+
+
+def build_updater(bot: Optional[Bot] = None) -> Updater:
+    open_storage()
+    if bot is None:
+        # base_url можно переопределить, чтобы направить бота на локальный сервер Bot API
+        updater = Updater(TOKEN, base_url=config_data['telegram_bot'].get('base_url'), workers=WORKERS,
+                          use_context=True, persistence=persistence)
+    else:
+        # Готового бота, например с заглушкой вместо HTTP, передаёт нагрузочный тест
+        updater = Updater(bot=bot, workers=WORKERS, use_context=True, persistence=persistence)
     dp = updater.dispatcher
 
+    # Все обработчики ходят в Telegram API, поэтому выполняются в пуле потоков,
+    # а не в потоке диспетчера: медленный ответ API не задерживает остальные нажатия
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
+        entry_points=[CommandHandler('start', start, run_async=True)],
         states={
-            SELECT_DRINK_TYPE: [CallbackQueryHandler(drink_type)],
-            SELECT_DRINK: [CallbackQueryHandler(drink)],
-            SELECT_MILK: [CallbackQueryHandler(milk)],
-            APPROVE_SYRUP: [CallbackQueryHandler(approve_syrup)],
-            SELECT_SYRUP_1: [CallbackQueryHandler(syrup_1)],
-            SELECT_SYRUP_2: [CallbackQueryHandler(syrup_2)],
-            SELECT_VOLUME: [CallbackQueryHandler(volume)],
-            SELECT_TEMPERATURE: [CallbackQueryHandler(temperature)],
-            CONFIRM_ORDER: [CallbackQueryHandler(process_user_choice)]
+            SELECT_DRINK_TYPE: [CallbackQueryHandler(drink_type, pattern='^drink_', run_async=True)],
+            SELECT_DRINK: [CallbackQueryHandler(drink, pattern='^drink_', run_async=True)],
+            SELECT_MILK: [CallbackQueryHandler(milk, pattern='^milk_', run_async=True)],
+            APPROVE_SYRUP: [CallbackQueryHandler(approve_syrup, pattern='^syrup_', run_async=True)],
+            SELECT_SYRUP_1: [CallbackQueryHandler(syrup_1, pattern='^syrup_', run_async=True)],
+            SELECT_SYRUP_2: [CallbackQueryHandler(syrup_2, pattern='^syrup_', run_async=True)],
+            SELECT_VOLUME: [CallbackQueryHandler(volume, pattern='^volume_', run_async=True)],
+            SELECT_TEMPERATURE: [CallbackQueryHandler(temperature, pattern='^temperature_', run_async=True)],
+            CONFIRM_ORDER: [CallbackQueryHandler(process_user_choice, pattern=CONFIRM_PATTERN, run_async=True)],
+            # Нажатие, пришедшее пока предыдущий шаг ещё обрабатывается
+            ConversationHandler.WAITING: [CallbackQueryHandler(answer_while_busy)],
         },
-        fallbacks=[CommandHandler('start', start)]
+        fallbacks=[CommandHandler('start', start, run_async=True)],
+        name='order',
+        persistent=True,
     )
 
+    # Повторы нажатий отсекаются в группе -1, раньше разговора и кнопок заказов
+    dp.add_handler(CallbackQueryHandler(drop_duplicate_callback,
+                                        pattern=f'^(confirm|cancel|{ORDER_CALLBACK_PREFIX}|{STOP_LIST_CALLBACK_PREFIX})'),
+                   group=-1)
     dp.add_handler(conv_handler)
-    dp.add_handler(CommandHandler('coffee_ready', coffee_ready,
-                                  Filters.chat(chat_id=int(config_data['telegram_bot']['barista_chat_id']))))
-    dp.add_handler(CommandHandler("update_menu", update_menu_command,
-                                  Filters.chat(chat_id=int(config_data['telegram_bot']['barista_chat_id']))))
-    dp.add_handler(CallbackQueryHandler(order_received, pattern='^received_'))
-    dp.add_handler(CallbackQueryHandler(order_ready, pattern='^ready_'))
-    dp.add_handler(CallbackQueryHandler(order_ready, pattern='^confirm_order_'))
-    dp.add_handler(CallbackQueryHandler(back_to_orders_handler, pattern='^back_to_orders$'))
-    updater.start_polling()
+    # Кнопки покупателя, которые не подошли текущему шагу заказа, получают ответ, а не зависают
+    dp.add_handler(CallbackQueryHandler(answer_stale_button, pattern=CUSTOMER_BUTTONS_PATTERN, run_async=True))
+    # Команды барист принимаются из чата любой стойки
+    station_chats = Filters.chat(chat_id=list(STATIONS_BY_CHAT))
+    dp.add_handler(CommandHandler('coffee_ready', coffee_ready, station_chats, run_async=True))
+    dp.add_handler(CommandHandler("update_menu", update_menu_command, station_chats, run_async=True))
+    dp.add_handler(CommandHandler('stop_list', stop_list_command, station_chats, run_async=True))
+    dp.add_handler(CallbackQueryHandler(order_callback, pattern=f'^{ORDER_CALLBACK_PREFIX}', run_async=True))
+    dp.add_handler(CallbackQueryHandler(stop_list_callback, pattern=f'^{STOP_LIST_CALLBACK_PREFIX}', run_async=True))
+    # Время каждого обработчика попадает в гистограмму по его шагу разговора
+    instrument_dispatcher(dp, STATE_NAMES)
+    outbox.start(updater.bot)
+    # Периодически проверяем, не изменилась ли таблица меню
+    updater.job_queue.run_repeating(refresh_menu_job, interval=MENU_REFRESH_INTERVAL, first=MENU_REFRESH_INTERVAL)
+    return updater
+
+
+def start_updater(updater: Updater) -> None:
+    if UPDATES_MODE == 'webhook':
+        webhook = config_data['telegram_bot'].get('webhook', {})
+        # Ответ на нажатие кнопки уходит в ответе на запрос webhook, без отдельного вызова API
+        answer_in_webhook_responses(replies, webhook.get('answer_timeout', 1.0))
+        updater.start_webhook(listen=webhook.get('listen', '0.0.0.0'),
+                              port=webhook.get('port', 8443),
+                              url_path=webhook.get('url_path', TOKEN),
+                              cert=webhook.get('cert'),
+                              key=webhook.get('key'),
+                              webhook_url=webhook.get('url'))
+        if not (webhook.get('cert') and webhook.get('key')):
+            # Когда TLS завершается на прокси, библиотека не регистрирует webhook сама
+            updater.bot.set_webhook(url=webhook['url'])
+        logger.info(f"Бот получает обновления через webhook {webhook.get('url')}")
+    elif UPDATES_MODE == 'polling':
+        updater.start_polling()
+    else:
+        raise ValueError(f"Неизвестный режим получения обновлений: {UPDATES_MODE}")
+
+
+def start_metrics_server() -> Optional[MetricsServer]:
+    port = metrics_config.get('port', 9108)
+    if port is None:
+        return None
+    try:
+        server = MetricsServer(metrics_config.get('listen', '127.0.0.1'), port)
+    except OSError as e:
+        # Без метрик бот работает, поэтому не падаем из-за занятого порта
+        logger.error(f"Не удалось запустить сервер метрик на порту {port}: {e}")
+        return None
+    server.start()
+    return server
+
+
+def main() -> None:
+    menu_store.boot()
+
+    metrics_server = start_metrics_server()
+    open_storage()
+    order_log.start()
+    updater = build_updater()
+    start_updater(updater)
     updater.idle()
+    outbox.stop()
+    order_store.close()
+    persistence.close()
+    order_log.close()
+    menu_store.close()
+    if metrics_server is not None:
+        metrics_server.stop()
 
 
 if __name__ == '__main__':
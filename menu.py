@@ -0,0 +1,772 @@
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import gspread
+from oauth2client.service_account import ServiceAccountCredentials
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+# Листы таблицы, из которых собирается меню
+DRINKS_SHEET, MILK_SHEET, SYRUPS_SHEET = 'Напитки', 'Молоко', 'Сиропы'
+MENU_SHEETS = (DRINKS_SHEET, MILK_SHEET, SYRUPS_SHEET)
+
+# Столбцы листов меню и отметка доступного объёма
+NAME_COLUMN, TYPE_COLUMN, MILK_COLUMN = 'Название', 'Тип напитка', 'Молоко'
+AVAILABLE = '+'
+
+# Свойства напитка: {столбец: значение ячейки}
+DrinkProperties = Dict[str, str]
+
+# Лист стоп-листа: позиции, которых сейчас нет. Объём указывается, только если закончился один объём напитка
+STOP_LIST_SHEET = 'Стоп-лист'
+SECTION_COLUMN, VOLUME_COLUMN = 'Раздел', 'Объём'
+STOP_LIST_HEADER = [SECTION_COLUMN, NAME_COLUMN, VOLUME_COLUMN]
+# Позиция стоп-листа: (лист меню, название, объём или '')
+StopItem = Tuple[str, str, str]
+
+# Версия формата файла-снимка меню. Снимки другой версии игнорируются.
+SNAPSHOT_FORMAT = 1
+
+# Через сколько секунд повторить запись стоп-листа после ошибки
+STOP_LIST_RETRY_INTERVAL = 30
+
+SHEETS_PHASE_SECONDS = Histogram('eastwoods_sheets_phase_seconds', 'Длительность фаз загрузки меню из Google Таблиц',
+                                 ['phase'], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+SHEETS_ERRORS = Counter('eastwoods_sheets_errors_total', 'Ошибки запросов к Google Таблицам', ['phase'])
+
+
+def authorize(credentials_path: str) -> gspread.Client:
+    """
+    Авторизоваться в Google API по ключу сервисного аккаунта.
+
+    :param credentials_path: Путь к JSON файлу учетных данных.
+    :return: Авторизованный клиент gspread.
+    """
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials_path, SCOPES)
+    return gspread.authorize(credentials)
+
+
+def records_from_values(values: List[List[str]]) -> List[Dict[str, str]]:
+    """
+    Преобразовать значения листа в записи, используя первую строку как заголовки.
+
+    :param values: Строки листа в том виде, в каком их вернул Sheets API.
+    :return: Список словарей {заголовок: значение} по строкам листа без пустых строк.
+    """
+    if not values:
+        return []
+    # batchGet обрезает пустые ячейки в конце строк, get_all_values - нет.
+    # Дополняем строки до ширины таблицы, чтобы поведение не отличалось.
+    width = max(len(row) for row in values)
+    header = list(values[0]) + [''] * (width - len(values[0]))
+    return [dict(zip(header, list(row) + [''] * (width - len(row)))) for row in values[1:] if any(row)]
+
+
+def parse_drinks(values: List[List[str]]) -> Dict[str, DrinkProperties]:
+    """
+    Разобрать лист напитков.
+
+    :param values: Строки листа напитков.
+    :return: Словарь {название напитка: остальные столбцы строки}.
+    """
+    drinks = {}
+    for record in records_from_values(values):
+        name = record.pop(NAME_COLUMN)
+        if name in drinks:
+            raise ValueError(f"Напиток {name!r} встречается в меню дважды")
+        drinks[name] = record
+    return drinks
+
+
+def parse_names(values: List[List[str]]) -> List[str]:
+    """
+    Разобрать лист, из которого нужен только столбец названий (молоко, сиропы).
+
+    :param values: Строки листа.
+    :return: Названия в порядке строк листа.
+    """
+    return [record[NAME_COLUMN] for record in records_from_values(values)]
+
+
+def parse_stop_list(values: List[List[str]]) -> FrozenSet[StopItem]:
+    """
+    Разобрать лист стоп-листа.
+
+    :param values: Строки листа.
+    :return: Позиции стоп-листа. Строки с неизвестным разделом пропускаются.
+    """
+    stop_list = set()
+    for record in records_from_values(values):
+        section, name = record.get(SECTION_COLUMN, ''), record.get(NAME_COLUMN, '')
+        if section not in MENU_SHEETS or not name:
+            logger.warning(f"Пропущена строка стоп-листа: {record}")
+            continue
+        stop_list.add((section, name, record.get(VOLUME_COLUMN, '') if section == DRINKS_SHEET else ''))
+    return frozenset(stop_list)
+
+
+def stop_list_values(stop_list: Iterable[StopItem]) -> List[List[str]]:
+    """
+    Строки листа стоп-листа с заголовком.
+
+    :param stop_list: Позиции стоп-листа.
+    """
+    return [STOP_LIST_HEADER] + [list(item) for item in sorted(stop_list)]
+
+
+class MenuLoader:
+    """
+    Загрузчик меню из Google Таблицы.
+
+    Держит один авторизованный клиент и открытую таблицу на всё время работы бота,
+    а все листы меню забирает одним запросом values:batchGet. Через него же
+    в таблицу дописывается журнал заказов и записывается стоп-лист.
+    Длительность каждой фазы последней загрузки лежит в ``timings``.
+    """
+
+    def __init__(self, credentials_path: str, spreadsheet_name: str,
+                 client_factory: Callable[[str], gspread.Client] = authorize):
+        self.credentials_path = credentials_path
+        self.spreadsheet_name = spreadsheet_name
+        self._client_factory = client_factory
+        self._client: Optional[gspread.Client] = None
+        self._spreadsheet: Optional[gspread.Spreadsheet] = None
+        self._lock = threading.Lock()
+        self.timings: Dict[str, float] = {}
+        # Есть ли в таблице лист стоп-листа; None - ещё не знаем
+        self._has_stop_list_sheet: Optional[bool] = None
+        # Сколько строк занимает стоп-лист в таблице, лишние затираются при записи
+        self._stop_list_rows = 0
+
+    def _record(self, phase: str, seconds: float) -> None:
+        self.timings[phase] = seconds
+        SHEETS_PHASE_SECONDS.labels(phase).observe(seconds)
+
+    def _timed(self, phase: str, func: Callable, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception:
+            SHEETS_ERRORS.labels(phase).inc()
+            raise
+        finally:
+            self._record(phase, time.perf_counter() - started)
+
+    @property
+    def spreadsheet(self) -> gspread.Spreadsheet:
+        # Клиент и таблица открываются один раз и переиспользуются при следующих загрузках
+        if self._client is None:
+            self._client = self._timed('authorize', self._client_factory, self.credentials_path)
+        if self._spreadsheet is None:
+            self._spreadsheet = self._timed('open', self._client.open, self.spreadsheet_name)
+        return self._spreadsheet
+
+    def fetch_values(self, sheet_names=MENU_SHEETS) -> Dict[str, List[List[str]]]:
+        """
+        Получить значения нескольких листов одним запросом.
+
+        :param sheet_names: Названия листов.
+        :return: Словарь {название листа: строки листа}.
+        """
+        spreadsheet = self.spreadsheet
+        ranges = [f"'{name}'" for name in sheet_names]
+        try:
+            response = self._timed('fetch', spreadsheet.values_batch_get, ranges)
+        except Exception:
+            # Таблицу могли переименовать или удалить - откроем заново при следующей попытке
+            self._spreadsheet = None
+            raise
+        value_ranges = response.get('valueRanges', [])
+        return {name: value_range.get('values', []) for name, value_range in zip(sheet_names, value_ranges)}
+
+    def append_rows(self, sheet_name: str, rows: List[List[str]], header: Optional[List[str]] = None) -> None:
+        """
+        Дописать строки в конец листа той же таблицы одним запросом values:append.
+
+        Если листа нет и задан заголовок, лист создаётся, и строки дописываются под заголовок.
+
+        :param sheet_name: Название листа.
+        :param rows: Строки значений.
+        :param header: Заголовок нового листа или None, если лист должен уже быть.
+        """
+        spreadsheet = self.spreadsheet
+        params = {'valueInputOption': 'RAW', 'insertDataOption': 'INSERT_ROWS'}
+        try:
+            try:
+                self._timed('append', spreadsheet.values_append, f"'{sheet_name}'", params, {'values': rows})
+            except gspread.exceptions.APIError as e:
+                if e.response.status_code != 400 or header is None:
+                    raise
+                self._timed('add_sheet', spreadsheet.add_worksheet, sheet_name, 1000, len(header))
+                logger.info(f"В таблицу меню добавлен лист {sheet_name!r}")
+                self._timed('append', spreadsheet.values_append, f"'{sheet_name}'", params,
+                            {'values': [header] + rows})
+        except Exception:
+            self._spreadsheet = None
+            raise
+
+    def modified_time(self) -> str:
+        """
+        Узнать время последнего изменения таблицы одним запросом к Drive API.
+
+        :return: Время изменения в формате RFC 3339.
+        """
+        spreadsheet = self.spreadsheet
+        try:
+            metadata = self._timed('modified_time', self._client.get_file_drive_metadata, spreadsheet.id)
+        except Exception:
+            self._spreadsheet = None
+            raise
+        return metadata['modifiedTime']
+
+    def load(self):
+        """
+        Загрузить меню целиком.
+
+        :return: Кортеж (напитки, молоко, сиропы, стоп-лист).
+        """
+        with self._lock:
+            self.timings = {}
+            started = time.perf_counter()
+            values = self._fetch_with_stop_list()
+
+            parse_started = time.perf_counter()
+            drinks = parse_drinks(values[DRINKS_SHEET])
+            milks = parse_names(values[MILK_SHEET])
+            syrups = parse_names(values[SYRUPS_SHEET])
+            stop_list = parse_stop_list(values.get(STOP_LIST_SHEET, []))
+            self._record('parse', time.perf_counter() - parse_started)
+            self._record('total', time.perf_counter() - started)
+
+        logger.info("Меню загружено: " + ", ".join(f"{phase} {seconds * 1000:.1f} мс"
+                                                   for phase, seconds in self.timings.items()))
+        return drinks, milks, syrups, stop_list
+
+    def _fetch_with_stop_list(self) -> Dict[str, List[List[str]]]:
+        if self._has_stop_list_sheet is False:
+            return self.fetch_values()
+        try:
+            values = self.fetch_values(MENU_SHEETS + (STOP_LIST_SHEET,))
+        except gspread.exceptions.APIError as e:
+            if e.response.status_code != 400:
+                raise
+            # Листа стоп-листа ещё нет, он появится при первой записи стоп-листа
+            logger.info(f"В таблице нет листа {STOP_LIST_SHEET!r}, стоп-лист пуст")
+            self._has_stop_list_sheet = False
+            return self.fetch_values()
+        self._has_stop_list_sheet = True
+        self._stop_list_rows = len(values[STOP_LIST_SHEET])
+        return values
+
+    def write_stop_list(self, stop_list: Iterable[StopItem]) -> None:
+        """
+        Записать стоп-лист в его лист таблицы одним запросом values:update.
+
+        Строки прежнего стоп-листа, которые не поместились в новый, затираются в том же запросе.
+        Если листа нет, он создаётся.
+
+        :param stop_list: Позиции стоп-листа.
+        """
+        rows = stop_list_values(stop_list)
+        padded = rows + [[''] * len(STOP_LIST_HEADER)] * max(0, self._stop_list_rows - len(rows))
+        body = {'values': padded}
+        params = {'valueInputOption': 'RAW'}
+        stop_list_range = f"'{STOP_LIST_SHEET}'!A1"
+        with self._lock:
+            spreadsheet = self.spreadsheet
+            try:
+                if self._has_stop_list_sheet is False:
+                    self._add_stop_list_sheet(spreadsheet)
+                try:
+                    self._timed('write', spreadsheet.values_update, stop_list_range, params, body)
+                except gspread.exceptions.APIError as e:
+                    # Меню могло загрузиться из снимка, и о листе ещё ничего не известно
+                    if e.response.status_code != 400 or self._has_stop_list_sheet:
+                        raise
+                    self._add_stop_list_sheet(spreadsheet)
+                    self._timed('write', spreadsheet.values_update, stop_list_range, params, body)
+            except Exception:
+                self._spreadsheet = None
+                raise
+            self._has_stop_list_sheet = True
+            self._stop_list_rows = len(rows)
+
+    def _add_stop_list_sheet(self, spreadsheet: gspread.Spreadsheet) -> None:
+        self._timed('add_sheet', spreadsheet.add_worksheet, STOP_LIST_SHEET, 1000, len(STOP_LIST_HEADER))
+        self._has_stop_list_sheet = True
+        logger.info(f"В таблицу меню добавлен лист {STOP_LIST_SHEET!r}")
+
+
+def available_volumes(properties: DrinkProperties) -> List[str]:
+    volumes = []
+    for volume, status in properties.items():
+        if volume != MILK_COLUMN and volume != TYPE_COLUMN and status == AVAILABLE:
+            volumes.append(volume)
+    return volumes
+
+
+def group_drinks_by_type(drinks: Dict[str, DrinkProperties]) -> Dict[str, List[str]]:
+    """
+    Разложить напитки по типам за один проход.
+
+    :param drinks: Словарь напитков из таблицы.
+    :return: Словарь {тип напитка: названия напитков} в порядке первого появления типа.
+    """
+    drinks_by_type = {}
+    for drink, properties in drinks.items():
+        drink_type = properties.get(TYPE_COLUMN, None)
+        # Напитки без типа в меню не попадают
+        if drink_type:
+            drinks_by_type.setdefault(drink_type, []).append(drink)
+    return drinks_by_type
+
+
+def build_markup(items, prefix):
+    return InlineKeyboardMarkup([[InlineKeyboardButton(item, callback_data=f'{prefix}_{item}')] for item in items])
+
+
+EMPTY_MARKUP = InlineKeyboardMarkup([])
+
+
+@dataclass(frozen=True)
+class Menu:
+    """
+    Неизменяемая версия меню вместе с индексом и готовыми клавиатурами.
+
+    Индекс и клавиатуры строятся один раз при создании меню, поэтому обработчики
+    ничего не пересчитывают и обходятся поиском по словарю. Обработчики берут ссылку
+    на текущее меню один раз и работают только с ней, поэтому замена меню целиком
+    никогда не даёт им полуобновлённых данных.
+
+    Позиции из ``stop_list`` остаются в ``drinks``, ``milks`` и ``syrups`` (это содержимое таблицы),
+    но не попадают в индекс и клавиатуры. ``sheet_drinks_by_type`` и ``sheet_volumes`` - индекс
+    без учёта стоп-листа.
+    """
+    drinks: Dict[str, Dict[str, str]]
+    milks: Tuple[str, ...]
+    syrups: Tuple[str, ...]
+    version: int = 1
+    loaded_at: float = field(default_factory=time.time)
+    # Время изменения таблицы, из которой загружено меню (по данным Drive API)
+    modified_time: Optional[str] = None
+    stop_list: FrozenSet[StopItem] = frozenset()
+    drink_types: Tuple[str, ...] = field(init=False)
+    drinks_by_type: Dict[str, Tuple[str, ...]] = field(init=False, repr=False)
+    volumes: Dict[str, Tuple[str, ...]] = field(init=False, repr=False)
+    sheet_drinks_by_type: Dict[str, Tuple[str, ...]] = field(init=False, repr=False)
+    sheet_volumes: Dict[str, Tuple[str, ...]] = field(init=False, repr=False)
+    drink_types_markup: InlineKeyboardMarkup = field(init=False, repr=False)
+    milks_markup: InlineKeyboardMarkup = field(init=False, repr=False)
+    syrups_markup: InlineKeyboardMarkup = field(init=False, repr=False)
+    _drinks_markups: Dict[str, InlineKeyboardMarkup] = field(init=False, repr=False)
+    _volumes_markups: Dict[str, InlineKeyboardMarkup] = field(init=False, repr=False)
+
+    def __post_init__(self):
+        sheet_drinks_by_type = {drink_type: tuple(drinks)
+                                for drink_type, drinks in group_drinks_by_type(self.drinks).items()}
+        sheet_volumes = {drink: tuple(available_volumes(properties)) for drink, properties in self.drinks.items()}
+        object.__setattr__(self, 'stop_list', frozenset(self.stop_list))
+        object.__setattr__(self, 'sheet_drinks_by_type', sheet_drinks_by_type)
+        object.__setattr__(self, 'sheet_volumes', sheet_volumes)
+
+        # Доступность напитка зависит от его объёмов, поэтому объёмы считаются первыми
+        volumes = {drink: self._offered_volumes(drink) for drink in self.drinks}
+        object.__setattr__(self, 'volumes', volumes)
+        drinks_by_type = self._offered_drinks_by_type(sheet_drinks_by_type)
+        index = {
+            'milks': tuple(self.milks),
+            'syrups': tuple(self.syrups),
+            'drink_types': tuple(drinks_by_type),
+            'drinks_by_type': drinks_by_type,
+            'drink_types_markup': build_markup(drinks_by_type, 'drink'),
+            'milks_markup': build_markup(self._offered(MILK_SHEET, self.milks), 'milk'),
+            'syrups_markup': build_markup(self._offered(SYRUPS_SHEET, self.syrups), 'syrup'),
+            '_drinks_markups': {drink_type: build_markup(drinks, 'drink')
+                                for drink_type, drinks in drinks_by_type.items()},
+            '_volumes_markups': {drink: build_markup(drink_volumes, 'volume')
+                                 for drink, drink_volumes in volumes.items()},
+        }
+        for name, value in index.items():
+            object.__setattr__(self, name, value)
+
+    def _offered(self, section: str, names: Iterable[str]) -> Tuple[str, ...]:
+        return tuple(name for name in names if (section, name, '') not in self.stop_list)
+
+    def _offered_volumes(self, drink: str) -> Tuple[str, ...]:
+        return tuple(volume for volume in self.sheet_volumes[drink]
+                     if (DRINKS_SHEET, drink, volume) not in self.stop_list)
+
+    def _offered_drinks(self, drinks: Iterable[str]) -> Tuple[str, ...]:
+        # Напиток, все объёмы которого в стоп-листе, не предлагается: выбрать объём было бы не из чего
+        return tuple(drink for drink in self._offered(DRINKS_SHEET, drinks) if self.volumes[drink])
+
+    def _offered_drinks_by_type(self, drinks_by_type: Dict[str, Tuple[str, ...]]) -> Dict[str, Tuple[str, ...]]:
+        # Тип, все напитки которого в стоп-листе, из меню пропадает
+        offered = {drink_type: self._offered_drinks(drinks) for drink_type, drinks in drinks_by_type.items()}
+        return {drink_type: drinks for drink_type, drinks in offered.items() if drinks}
+
+    def drinks_markup(self, drink_type: str) -> InlineKeyboardMarkup:
+        return self._drinks_markups.get(drink_type, EMPTY_MARKUP)
+
+    def volumes_markup(self, drink: str) -> InlineKeyboardMarkup:
+        return self._volumes_markups[drink]
+
+    def is_offered(self, section: str, name: str, volume: str = '') -> bool:
+        """
+        Есть ли позиция в таблице и не в стоп-листе ли она.
+
+        :param section: Лист меню позиции.
+        :param name: Название напитка, молока или сиропа.
+        :param volume: Объём напитка, если нужно проверить и его.
+        """
+        if section == DRINKS_SHEET:
+            if volume:
+                return volume in self.volumes.get(name, ()) and (section, name, '') not in self.stop_list
+            return bool(self.volumes.get(name)) and (section, name, '') not in self.stop_list
+        return name in (self.milks if section == MILK_SHEET else self.syrups) and (section, name, '') not in self.stop_list
+
+    def with_stop_list(self, stop_list: Iterable[StopItem]) -> 'Menu':
+        """
+        Копия меню с другим стоп-листом.
+
+        Пересобираются только клавиатуры, которых касаются изменившиеся позиции,
+        остальные индексы и клавиатуры переходят в новое меню без копирования.
+
+        :param stop_list: Новый стоп-лист целиком.
+        :return: Новое меню той же версии.
+        """
+        stop_list = frozenset(stop_list)
+        changed = self.stop_list ^ stop_list
+        menu = copy.copy(self)
+        object.__setattr__(menu, 'stop_list', stop_list)
+
+        sections = {section for section, _, _ in changed}
+        if MILK_SHEET in sections:
+            object.__setattr__(menu, 'milks_markup', build_markup(menu._offered(MILK_SHEET, self.milks), 'milk'))
+        if SYRUPS_SHEET in sections:
+            object.__setattr__(menu, 'syrups_markup', build_markup(menu._offered(SYRUPS_SHEET, self.syrups), 'syrup'))
+
+        drink_items = [(name, volume) for section, name, volume in changed
+                       if section == DRINKS_SHEET and name in self.drinks]
+        changed_volumes = {name for name, volume in drink_items if volume}
+        if changed_volumes:
+            volumes = dict(self.volumes)
+            volumes_markups = dict(self._volumes_markups)
+            for drink in changed_volumes:
+                volumes[drink] = menu._offered_volumes(drink)
+                volumes_markups[drink] = build_markup(volumes[drink], 'volume')
+            object.__setattr__(menu, 'volumes', volumes)
+            object.__setattr__(menu, '_volumes_markups', volumes_markups)
+
+        # Объём тоже может убрать напиток из типа, если он был последним
+        changed_types = {self.drinks[name].get(TYPE_COLUMN) for name, volume in drink_items}
+        changed_types &= self.sheet_drinks_by_type.keys()
+        if changed_types:
+            offered = {drink_type: menu._offered_drinks(self.sheet_drinks_by_type[drink_type])
+                       for drink_type in changed_types}
+            drinks_markups = dict(self._drinks_markups)
+            for drink_type, drinks in offered.items():
+                drinks_markups.pop(drink_type, None)
+                if drinks:
+                    drinks_markups[drink_type] = build_markup(drinks, 'drink')
+            # Порядок типов остаётся таким же, как в таблице
+            drinks_by_type = {}
+            for drink_type in self.sheet_drinks_by_type:
+                drinks = offered[drink_type] if drink_type in offered else self.drinks_by_type.get(drink_type)
+                if drinks:
+                    drinks_by_type[drink_type] = drinks
+            object.__setattr__(menu, 'drinks_by_type', drinks_by_type)
+            object.__setattr__(menu, '_drinks_markups', drinks_markups)
+            if tuple(drinks_by_type) != self.drink_types:
+                object.__setattr__(menu, 'drink_types', tuple(drinks_by_type))
+                object.__setattr__(menu, 'drink_types_markup', build_markup(drinks_by_type, 'drink'))
+        return menu
+
+
+def with_modified_time(menu: Menu, modified_time: Optional[str]) -> Menu:
+    """
+    Копия меню той же версии с другим временем изменения таблицы. Индексы и клавиатуры не пересобираются.
+    """
+    if menu.modified_time == modified_time:
+        return menu
+    menu = copy.copy(menu)
+    object.__setattr__(menu, 'modified_time', modified_time)
+    return menu
+
+
+def save_snapshot(path: str, menu: Menu) -> None:
+    """
+    Атомарно записать снимок меню на диск.
+
+    :param path: Путь к файлу снимка.
+    :param menu: Меню для сохранения.
+    """
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'version': menu.version,
+        'loaded_at': menu.loaded_at,
+        'modified_time': menu.modified_time,
+        'drinks': menu.drinks,
+        'milks': list(menu.milks),
+        'syrups': list(menu.syrups),
+        'stop_list': sorted(menu.stop_list),
+    }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as snapshot_file:
+        json.dump(snapshot, snapshot_file, ensure_ascii=False)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    # Читатель видит либо старый снимок, либо новый целиком
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> Optional[Menu]:
+    """
+    Прочитать снимок меню с диска.
+
+    :param path: Путь к файлу снимка.
+    :return: Меню из снимка или None, если снимка нет или он в неизвестном формате.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        logger.exception(f"Не удалось прочитать снимок меню {path}")
+        return None
+
+    if snapshot.get('format') != SNAPSHOT_FORMAT:
+        logger.warning(f"Снимок меню {path} в неподдерживаемом формате {snapshot.get('format')}")
+        return None
+
+    return Menu(snapshot['drinks'], snapshot['milks'], snapshot['syrups'],
+                version=snapshot['version'], loaded_at=snapshot['loaded_at'],
+                modified_time=snapshot.get('modified_time'),
+                stop_list=frozenset(tuple(item) for item in snapshot.get('stop_list', [])))
+
+
+class MenuStore:
+    """
+    Текущее меню бота.
+
+    Стартует из снимка на диске, обновляется из Google Таблицы и после каждой
+    успешной загрузки перезаписывает снимок. Новое меню публикуется одной заменой ссылки.
+
+    Стоп-лист меняется прямо в боте и действует сразу, а в таблицу записывается фоновым
+    потоком одним запросом через ``stop_list_delay`` секунд после изменения, так что
+    несколько изменений подряд уходят вместе.
+
+    :param stop_list_delay: Сколько секунд копить изменения стоп-листа перед записью в таблицу.
+    """
+
+    def __init__(self, loader: MenuLoader, snapshot_path: str, stop_list_delay: float = 2.0):
+        self.loader = loader
+        self.snapshot_path = snapshot_path
+        self.stop_list_delay = stop_list_delay
+        self.current: Optional[Menu] = None
+        self._refresh_lock = threading.Lock()
+        # Замена текущего меню: короткая, в отличие от загрузки из таблицы
+        self._publish_lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        # Стоп-лист изменён в боте и ещё не записан в таблицу
+        self._stop_list_dirty = False
+        self._stop_list_changed = threading.Event()
+        self._stopped = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+    def publish(self, menu: Menu) -> None:
+        self.current = menu
+
+    def _save_snapshot(self, menu: Menu) -> None:
+        try:
+            with self._snapshot_lock:
+                save_snapshot(self.snapshot_path, menu)
+        except OSError:
+            logger.exception(f"Не удалось сохранить снимок меню {self.snapshot_path}")
+
+    def refresh(self, modified_time: Optional[str] = None) -> Menu:
+        """
+        Загрузить меню из таблицы, опубликовать его и сохранить снимок.
+
+        Таблица меняется не только из-за меню: бот сам дописывает в неё журнал заказов.
+        Если напитки, молоко, сиропы и стоп-лист не изменились, текущее меню остаётся
+        прежним вместе с версией, запоминается только новое время изменения таблицы.
+
+        :param modified_time: Время изменения таблицы, если оно уже известно.
+        :return: Новое меню или текущее, если содержимое не изменилось.
+        """
+        with self._refresh_lock:
+            if modified_time is None:
+                modified_time = self.loader.modified_time()
+            drinks, milks, syrups, stop_list = self.loader.load()
+            with self._publish_lock:
+                current = self.current
+                # Изменения стоп-листа, ещё не записанные в таблицу, важнее прочитанных из неё
+                if self._stop_list_dirty and current is not None:
+                    stop_list = current.stop_list
+                if current is not None and current.drinks == drinks and tuple(current.milks) == tuple(milks) \
+                        and tuple(current.syrups) == tuple(syrups) and current.stop_list == frozenset(stop_list):
+                    menu = with_modified_time(current, modified_time)
+                else:
+                    version = current.version + 1 if current else 1
+                    menu = Menu(drinks, milks, syrups, version=version, modified_time=modified_time,
+                                stop_list=stop_list)
+                self.publish(menu)
+
+        self._save_snapshot(menu)
+        return menu
+
+    def set_stopped(self, item: StopItem, stopped: bool) -> Menu:
+        """
+        Убрать позицию в стоп-лист или вернуть её в меню.
+
+        Меню с новым стоп-листом публикуется сразу, запись в таблицу идёт в фоне.
+
+        :param item: Позиция: (лист меню, название, объём или '').
+        :param stopped: True - позиции нет, False - снова есть.
+        :return: Опубликованное меню.
+        """
+        with self._publish_lock:
+            menu = self.current
+            stop_list = menu.stop_list | {item} if stopped else menu.stop_list - {item}
+            if stop_list == menu.stop_list:
+                return menu
+            menu = menu.with_stop_list(stop_list)
+            self.publish(menu)
+            self._stop_list_dirty = True
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='stop-list', daemon=True)
+                self._writer.start()
+        self._stop_list_changed.set()
+        logger.info(f"Стоп-лист: {item} {'убрано из меню' if stopped else 'снова в меню'}")
+        return menu
+
+    def _write_loop(self) -> None:
+        while self._stop_list_changed.wait() and not self._stopped.wait(self.stop_list_delay):
+            self._stop_list_changed.clear()
+            try:
+                self.write_stop_list()
+            except Exception:
+                logger.exception("Не удалось записать стоп-лист в таблицу, повторим позже")
+                self._stop_list_changed.set()
+                self._stopped.wait(STOP_LIST_RETRY_INTERVAL)
+
+    def write_stop_list(self) -> None:
+        """
+        Записать стоп-лист в таблицу и в снимок, если в боте он менялся.
+
+        Запись сдвигает время изменения таблицы. Если до записи таблица не менялась
+        с загрузки меню, меню запоминает новое время, и своя же запись не вызывает перезагрузку.
+        """
+        # Запись не пересекается с загрузкой меню, иначе загрузка могла бы прочитать старый стоп-лист
+        with self._refresh_lock:
+            with self._publish_lock:
+                if not self._stop_list_dirty:
+                    return
+                stop_list = self.current.stop_list
+            unchanged = self.loader.modified_time() == self.current.modified_time
+            self.loader.write_stop_list(stop_list)
+            modified_time = self.loader.modified_time() if unchanged else None
+            with self._publish_lock:
+                # Если стоп-лист успели изменить ещё раз, он запишется следующим запросом
+                if self.current.stop_list == stop_list:
+                    self._stop_list_dirty = False
+                if modified_time is not None:
+                    self.publish(with_modified_time(self.current, modified_time))
+                menu = self.current
+        self._save_snapshot(menu)
+
+    def append_rows(self, sheet_name: str, rows: List[List[str]], header: Optional[List[str]] = None) -> None:
+        """
+        Дописать строки в лист таблицы меню, например в журнал заказов.
+
+        Как и запись стоп-листа, дописывание сдвигает время изменения таблицы. Если до него
+        таблица не менялась с загрузки меню, меню запоминает новое время и не перезагружается.
+
+        :param sheet_name: Название листа.
+        :param rows: Строки для добавления.
+        :param header: Заголовок, если лист нужно создать.
+        """
+        with self._refresh_lock:
+            unchanged = self.current is not None and self.loader.modified_time() == self.current.modified_time
+            self.loader.append_rows(sheet_name, rows, header=header)
+            if not unchanged:
+                return
+            modified_time = self.loader.modified_time()
+            with self._publish_lock:
+                self.publish(with_modified_time(self.current, modified_time))
+                menu = self.current
+        self._save_snapshot(menu)
+
+    def close(self) -> None:
+        """Остановить фоновую запись и попытаться записать незаписанный стоп-лист."""
+        self._stopped.set()
+        self._stop_list_changed.set()
+        if self._writer is not None:
+            self._writer.join()
+        try:
+            self.write_stop_list()
+        except Exception:
+            logger.exception("Стоп-лист не записан в таблицу при остановке, он сохранён только в снимке")
+            if self.current is not None:
+                self._save_snapshot(self.current)
+
+    def refresh_if_changed(self) -> Optional[Menu]:
+        """
+        Перезагрузить меню, только если таблица изменилась с прошлой загрузки.
+
+        Проверка стоит один лёгкий запрос к Drive API, сами листы скачиваются лишь при изменениях.
+
+        :return: Новое меню или None, если таблица не менялась.
+        """
+        modified_time = self.loader.modified_time()
+        if self.current is not None and self.current.modified_time == modified_time:
+            return None
+        previous = self.current
+        menu = self.refresh(modified_time)
+        if previous is not None and menu.version == previous.version:
+            logger.info(f"Таблица меню изменилась ({modified_time}), но меню осталось прежним")
+        else:
+            logger.info(f"Таблица меню изменилась ({modified_time}), опубликована версия {menu.version}")
+        return menu
+
+    def refresh_in_background(self) -> threading.Thread:
+        def run():
+            try:
+                self.refresh_if_changed()
+            except Exception:
+                logger.exception("Не удалось обновить меню из таблицы, работаем по снимку")
+
+        thread = threading.Thread(target=run, name='menu-refresh', daemon=True)
+        thread.start()
+        return thread
+
+    def boot(self) -> Menu:
+        """
+        Подготовить меню к старту бота.
+
+        Если на диске есть снимок, бот стартует с него сразу, а свежее меню
+        догружается в фоне. Без снимка меню загружается из таблицы синхронно.
+
+        :return: Меню, с которым стартует бот.
+        """
+        menu = load_snapshot(self.snapshot_path)
+        if menu is None:
+            return self.refresh()
+
+        logger.info(f"Меню загружено из снимка {self.snapshot_path}, версия {menu.version}")
+        self.publish(menu)
+        self.refresh_in_background()
+        return menu
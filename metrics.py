@@ -0,0 +1,323 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from telegram.ext import ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Набор метрик, который отдаётся в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics: List['Metric'] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: 'Metric') -> None:
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {_escape(metric.documentation)}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+# Метрики бота по умолчанию
+REGISTRY = Registry()
+
+
+class Metric:
+    """
+    Метрика с необязательными метками.
+
+    Значения меток фиксируются вызовом ``labels()`` один раз, а в горячем пути
+    используется уже готовый дочерний объект.
+
+    :param name: Имя метрики.
+    :param documentation: Описание для строки HELP.
+    :param labelnames: Имена меток.
+    :param registry: Где зарегистрировать метрику.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **labels):
+        if labels:
+            values = tuple(labels[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик."""
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self._children[()].inc(amount)
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}'
+                for key, child in self._items()]
+
+
+class Gauge(Metric):
+    """
+    Текущее значение, которое вычисляется функцией в момент запроса метрик.
+
+    :param function: Функция без аргументов, возвращающая значение.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float],
+                 registry: Optional[Registry] = REGISTRY):
+        self.function = function
+        super().__init__(name, documentation, registry=registry)
+
+    def _new_child(self):
+        return None
+
+    def samples(self) -> List[str]:
+        try:
+            value = self.function()
+        except Exception:
+            logger.exception(f"Не удалось вычислить метрику {self.name}")
+            return []
+        return [f'{self.name} {_format_value(value)}']
+
+
+class _HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # Последняя корзина - +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class Histogram(Metric):
+    """
+    Распределение значений по корзинам.
+
+    :param buckets: Верхние границы корзин по возрастанию.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, child in self._items():
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+HANDLER_SECONDS = Histogram('eastwoods_handler_seconds', 'Время работы обработчика обновления',
+                            ['handler', 'state'])
+HANDLER_ERRORS = Counter('eastwoods_handler_errors_total', 'Исключения в обработчиках обновлений',
+                         ['handler', 'state'])
+
+# Имя обработчика, который выполняется в текущем потоке
+_running = threading.local()
+
+
+def current_handler() -> str:
+    """Имя обработчика, выполняющегося в этом потоке, или пустая строка вне обработчиков."""
+    return getattr(_running, 'handler', '')
+
+
+def timed_callback(callback: Callable, state: str) -> Callable:
+    """
+    Обернуть функцию обработчика так, чтобы каждое выполнение попадало в гистограмму.
+
+    :param callback: Функция обработчика.
+    :param state: Шаг разговора, в котором работает обработчик.
+    :return: Обёртка с тем же именем и результатом.
+    """
+    name = callback.__name__
+    seconds = HANDLER_SECONDS.labels(name, state)
+    errors = HANDLER_ERRORS.labels(name, state)
+
+    @functools.wraps(callback)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outer = current_handler()
+        _running.handler = name
+        try:
+            return callback(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            _running.handler = outer
+            seconds.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_dispatcher(dispatcher, state_names: Dict[object, str]) -> None:
+    """
+    Обернуть функции всех обработчиков диспетчера, включая шаги ConversationHandler.
+
+    :param dispatcher: Диспетчер с уже зарегистрированными обработчиками.
+    :param state_names: Названия шагов разговора по их значениям.
+    """
+    for group in dispatcher.handlers.values():
+        for handler in group:
+            if not isinstance(handler, ConversationHandler):
+                handler.callback = timed_callback(handler.callback, '')
+                continue
+            for entry_point in handler.entry_points:
+                entry_point.callback = timed_callback(entry_point.callback, 'entry')
+            for fallback in handler.fallbacks:
+                fallback.callback = timed_callback(fallback.callback, 'fallback')
+            for state, state_handlers in handler.states.items():
+                for state_handler in state_handlers:
+                    state_handler.callback = timed_callback(state_handler.callback,
+                                                            state_names.get(state, str(state)))
+
+
+class MetricsServer:
+    """
+    HTTP-сервер, отдающий метрики по адресу /metrics в отдельном потоке.
+
+    :param listen: Адрес, на котором слушать.
+    :param port: Порт, 0 - выбрать свободный.
+    :param registry: Какие метрики отдавать.
+    """
+
+    def __init__(self, listen: str = '127.0.0.1', port: int = 9108, registry: Registry = REGISTRY):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                payload = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((listen, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        logger.info(f"Метрики доступны на http://{self.server.server_address[0]}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
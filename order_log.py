@@ -0,0 +1,201 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+from metrics import Counter
+from orders import Order
+
+logger = logging.getLogger(__name__)
+
+ORDER_LOG_EXPORTED = Counter('eastwoods_order_log_exported_total', 'События заказов, выгруженные в журнал')
+ORDER_LOG_ERRORS = Counter('eastwoods_order_log_errors_total', 'Неудачные выгрузки журнала заказов')
+
+# Заголовок листа журнала, столбцы в том же порядке, что и в строках событий
+ORDER_LOG_HEADER = ['Время', 'Событие', 'Номер заказа', 'Гость', 'Заказ', 'Создан', 'Выдан', 'Стойка']
+
+
+class OrderLogExporter:
+    """
+    Журнал заказов в Google Таблице с локальной очередью на диске.
+
+    Событие заказа сначала дописывается строкой JSON в файл-очередь, поэтому обработчик
+    не ждёт сети. Фоновый поток раз в ``flush_interval`` секунд отправляет всё накопленное
+    одним запросом и только после успеха сдвигает сохранённую позицию в файле. Если таблица
+    недоступна или бот перезапустился, выгрузка продолжается с этой позиции. Строка может
+    попасть в журнал дважды, если бот упал между запросом и записью позиции, но не теряется.
+
+    Столбцы журнала: время события, событие, номер заказа, гость, заказ, время создания и выдачи, стойка.
+
+    :param spool_path: Путь к файлу-очереди, рядом хранится позиция выгрузки (``.offset``).
+    :param append_rows: Функция, дописывающая строки в журнал одним запросом.
+    :param flush_interval: Как часто (в секундах) выгружать накопленные события.
+    :param batch_size: Сколько событий отправлять одним запросом.
+    :param time_offset: Смещение местного времени для дат в журнале.
+    """
+
+    def __init__(self, spool_path: str, append_rows: Callable[[List[List[str]]], None], flush_interval: float = 30,
+                 batch_size: int = 1000, time_offset: datetime.timedelta = datetime.timedelta()):
+        self.spool_path = spool_path
+        self.offset_path = f'{spool_path}.offset'
+        self.append_rows = append_rows
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.time_offset = time_offset
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._offset = self._read_offset()
+        self._repair_spool()
+        self._spool = open(self.spool_path, 'ab')
+        self._pending = self._count_pending()
+        if self._pending:
+            logger.info(f"В журнал заказов не выгружено событий: {self._pending}")
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='order-log', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def record(self, event: str, order: Order) -> None:
+        """
+        Дописать событие заказа в очередь.
+
+        :param event: Что произошло с заказом, например 'Подтверждён'.
+        :param order: Заказ.
+        """
+        line = json.dumps({'at': time.time(), 'event': event, **vars(order)}, ensure_ascii=False)
+        with self._lock:
+            self._spool.write(line.encode('utf-8') + b'\n')
+            # Без fsync: событие переживает падение процесса, но не отключение питания
+            self._spool.flush()
+            self._pending += 1
+
+    def __len__(self) -> int:
+        return self._pending
+
+    # --- Позиция выгрузки ---
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self.offset_path, 'r') as offset_file:
+                return int(offset_file.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except ValueError:
+            logger.error(f"Позиция журнала в {self.offset_path} повреждена, выгрузка начнётся с начала очереди")
+            return 0
+
+    def _write_offset(self, offset: int) -> None:
+        tmp_path = f'{self.offset_path}.tmp'
+        with open(tmp_path, 'w') as offset_file:
+            offset_file.write(str(offset))
+            offset_file.flush()
+            os.fsync(offset_file.fileno())
+        os.replace(tmp_path, self.offset_path)
+        self._offset = offset
+
+    def _repair_spool(self) -> None:
+        # Строка, недописанная при падении, испортила бы следующую
+        if not os.path.exists(self.spool_path):
+            self._offset = 0
+            return
+        with open(self.spool_path, 'rb+') as spool:
+            data = spool.read()
+            end = data.rfind(b'\n') + 1
+            if end != len(data):
+                logger.warning(f"Отброшен недописанный хвост очереди журнала: {len(data) - end} байт")
+                spool.truncate(end)
+            if self._offset > end:
+                self._offset = end
+
+    def _count_pending(self) -> int:
+        with open(self.spool_path, 'rb') as spool:
+            spool.seek(self._offset)
+            return sum(1 for _ in spool)
+
+    # --- Выгрузка ---
+
+    def _row(self, event: dict) -> List[str]:
+        def local_time(timestamp: Optional[float]) -> str:
+            if timestamp is None:
+                return ''
+            return (datetime.datetime.utcfromtimestamp(timestamp) + self.time_offset).strftime('%Y-%m-%d %H:%M:%S')
+
+        return [local_time(event['at']), event['event'], str(event['order_id']), event['username'],
+                event['description'], local_time(event['created_at']), local_time(event.get('completed_at')),
+                event.get('station', '')]
+
+    def _read_batch(self):
+        with open(self.spool_path, 'rb') as spool:
+            spool.seek(self._offset)
+            lines = []
+            for line in spool:
+                # Строку, которую прямо сейчас дописывают, заберём в следующий раз
+                if len(lines) >= self.batch_size or not line.endswith(b'\n'):
+                    break
+                lines.append(line)
+        return lines
+
+    def flush(self) -> int:
+        """
+        Выгрузить накопленные события, по одному запросу на каждые ``batch_size``.
+
+        :return: Сколько событий выгружено.
+        """
+        exported = 0
+        with self._flush_lock:
+            while True:
+                lines = self._read_batch()
+                if not lines:
+                    break
+                rows = []
+                for line in lines:
+                    try:
+                        rows.append(self._row(json.loads(line)))
+                    except (ValueError, KeyError):
+                        logger.error(f"Пропущена повреждённая строка очереди журнала: {line[:200]!r}")
+                if rows:
+                    self.append_rows(rows)
+                self._write_offset(self._offset + sum(len(line) for line in lines))
+                with self._lock:
+                    self._pending -= len(lines)
+                exported += len(rows)
+                ORDER_LOG_EXPORTED.inc(len(rows))
+                if len(lines) < self.batch_size:
+                    break
+            self._compact()
+        return exported
+
+    def _compact(self) -> None:
+        # Когда всё выгружено, очередь начинается заново, чтобы файл не рос бесконечно
+        with self._lock:
+            if self._pending or self._offset == 0 or self._spool.tell() != self._offset:
+                return
+            self._spool.truncate(0)
+            self._spool.seek(0)
+            self._write_offset(0)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # События остаются в очереди до следующей попытки
+                ORDER_LOG_ERRORS.inc()
+                logger.error(f"Не удалось выгрузить журнал заказов ({self._pending} событий ждут): {e}")
+
+    def close(self) -> None:
+        """Остановить поток и попытаться выгрузить остаток. Невыгруженное останется в очереди."""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Журнал заказов не выгружен при остановке, {self._pending} событий останутся в очереди: {e}")
+        self._spool.close()
@@ -0,0 +1,293 @@
+import bisect
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import DefaultDict, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import (BigInteger, Column, Float, Index, Integer, MetaData, String, Table, Text, bindparam, func,
+                        insert, inspect, select, text, update)
+
+from storage import create_storage_engine
+
+logger = logging.getLogger(__name__)
+
+# Статусы заказа
+STATUS_NEW, STATUS_RECEIVED, STATUS_DONE = 'new', 'received', 'done'
+OPEN_STATUSES = (STATUS_NEW, STATUS_RECEIVED)
+
+# Предельная пауза между повторами записи, пока база недоступна, и число попыток при остановке
+MAX_RETRY_INTERVAL = 30
+CLOSE_ATTEMPTS = 3
+
+metadata = MetaData()
+
+orders_table = Table(
+    'orders', metadata,
+    Column('order_id', Integer, primary_key=True, autoincrement=False),
+    Column('username', String, nullable=False),
+    Column('chat_id', BigInteger, nullable=False),
+    Column('description', Text, nullable=False),
+    Column('status', String, nullable=False),
+    Column('created_at', Float, nullable=False),
+    Column('completed_at', Float),
+    # Название стойки баристы, в очередь которой попал заказ
+    Column('station', String, nullable=False, server_default=''),
+    # Очередь баристы выбирает открытые заказы в порядке поступления
+    Index('ix_orders_status_created_at', 'status', 'created_at'),
+)
+
+
+@dataclass
+class Order:
+    order_id: int
+    username: str
+    chat_id: int
+    description: str
+    status: str = STATUS_NEW
+    created_at: float = field(default_factory=time.time)
+    completed_at: Optional[float] = None
+    station: str = ''
+
+
+class OrderStore:
+    """
+    Хранилище заказов.
+
+    Открытые заказы лежат в памяти в словаре по order_id, поэтому поиск и смена статуса
+    не обращаются к диску. У каждой стойки баристы своя очередь - отсортированный по времени
+    заказа список ключей, так что страница очереди выбирается срезом за время, зависящее только
+    от её размера. Все изменения пишутся в SQLite отдельным потоком, который собирает их в пачки
+    и коммитит одной транзакцией, так что обработчик не ждёт диска. Если транзакция не удалась,
+    её изменения повторяются первыми в следующей, с нарастающей паузой. После перезапуска открытые
+    заказы поднимаются из базы.
+
+    :param stations: Названия стоек. Открытые заказы стоек, которых больше нет, переходят к первой из них.
+    :param retry_interval: Пауза перед первым повтором неудавшейся записи, в секундах; дальше она удваивается.
+    """
+
+    def __init__(self, path: str, commit_interval: float = 0.05, batch_size: int = 1000,
+                 stations: Optional[Sequence[str]] = None, retry_interval: float = 1.0):
+        self.engine = create_storage_engine(path)
+        self._migrate()
+        metadata.create_all(self.engine)
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()
+        self._orders: Dict[int, Order] = {}
+        # Ключи (created_at, order_id) открытых заказов каждой стойки в порядке поступления
+        self._queues: DefaultDict[str, List[Tuple[float, int]]] = defaultdict(list)
+        self._writes = queue.Queue()
+        self._closing = threading.Event()
+        self._last_order_id = 0
+        self._load_open_orders()
+        if stations:
+            self._adopt_orphans(stations)
+
+        self._writer = threading.Thread(target=self._write_loop, name='order-writer', daemon=True)
+        self._writer.start()
+
+    def _load_open_orders(self) -> None:
+        query = (select(orders_table)
+                 .where(orders_table.c.status.in_(OPEN_STATUSES))
+                 .order_by(orders_table.c.created_at, orders_table.c.order_id))
+        with self.engine.connect() as connection:
+            for row in connection.execute(query):
+                order = Order(**row._asdict())
+                self._orders[order.order_id] = order
+                self._queues[order.station].append((order.created_at, order.order_id))
+            # Номера продолжают последовательность, в том числе после закрытых заказов
+            self._last_order_id = connection.execute(select(func.max(orders_table.c.order_id))).scalar() or 0
+        if self._orders:
+            logger.info(f"Восстановлено открытых заказов: {len(self._orders)}")
+
+    def _migrate(self) -> None:
+        # Базы, созданные до появления стоек, получают столбец station
+        inspector = inspect(self.engine)
+        if inspector.has_table('orders') and 'station' not in {column['name']
+                                                               for column in inspector.get_columns('orders')}:
+            with self.engine.begin() as connection:
+                connection.execute(text("ALTER TABLE orders ADD COLUMN station VARCHAR NOT NULL DEFAULT ''"))
+            logger.info("В таблицу заказов добавлен столбец station")
+
+    def _adopt_orphans(self, stations: Sequence[str]) -> None:
+        for station in [station for station in self._queues if station not in stations]:
+            keys = self._queues.pop(station)
+            target = self._queues[stations[0]]
+            for key in keys:
+                self._orders[key[1]].station = stations[0]
+                bisect.insort(target, key)
+                self._writes.put(('move', {'b_order_id': key[1], 'station': stations[0]}))
+            logger.warning(f"Открытые заказы стойки {station!r}, которой нет в конфиге, "
+                           f"переданы стойке {stations[0]!r}: {len(keys)}")
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def queue_length(self, station: str) -> int:
+        """Число открытых заказов в очереди стойки."""
+        station_queue = self._queues.get(station)
+        return len(station_queue) if station_queue is not None else 0
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._orders
+
+    def next_order_id(self) -> int:
+        """
+        Выдать номер для нового заказа.
+
+        Номера строго возрастают и не повторяются, даже если заказы подтверждены в одну секунду.
+        """
+        with self._lock:
+            self._last_order_id += 1
+            return self._last_order_id
+
+    def add(self, order: Order) -> Order:
+        with self._lock:
+            self._orders[order.order_id] = order
+            bisect.insort(self._queues[order.station], (order.created_at, order.order_id))
+        self._writes.put(('insert', dict(vars(order))))
+        return order
+
+    def get(self, order_id: int) -> Optional[Order]:
+        return self._orders.get(order_id)
+
+    def open_orders(self, station: str = '', offset: int = 0, limit: Optional[int] = None) -> List[Order]:
+        """
+        Открытые заказы стойки в порядке поступления.
+
+        :param station: Название стойки.
+        :param offset: Сколько заказов от начала очереди пропустить.
+        :param limit: Сколько заказов вернуть, по умолчанию все.
+        """
+        with self._lock:
+            end = None if limit is None else offset + limit
+            return [self._orders[order_id] for _, order_id in self._queues.get(station, [])[offset:end]]
+
+    def position(self, order_id: int) -> Optional[int]:
+        """
+        Место открытого заказа в очереди его стойки, считая с нуля.
+        """
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+            return bisect.bisect_left(self._queues[order.station], (order.created_at, order_id))
+
+    def mark_received(self, order_id: int) -> Optional[Order]:
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+            order.status = STATUS_RECEIVED
+        self._writes.put(('update', {'b_order_id': order_id, 'status': STATUS_RECEIVED, 'completed_at': None}))
+        return order
+
+    def complete(self, order_id: int) -> Optional[Order]:
+        """
+        Закрыть заказ и убрать его из очереди.
+
+        :return: Закрытый заказ или None, если он уже закрыт или не найден.
+        """
+        with self._lock:
+            order = self._orders.pop(order_id, None)
+            if order is None:
+                return None
+            station_queue = self._queues[order.station]
+            del station_queue[bisect.bisect_left(station_queue, (order.created_at, order_id))]
+            order.status = STATUS_DONE
+            order.completed_at = time.time()
+        self._writes.put(('update', {'b_order_id': order_id, 'status': STATUS_DONE,
+                                     'completed_at': order.completed_at}))
+        return order
+
+    def _next_batch(self, wait: Optional[float] = None) -> list:
+        # Первое изменение ждём не дольше wait секунд (None - сколько угодно), остальные - commit_interval
+        try:
+            batch = [self._writes.get(timeout=wait)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.commit_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._writes.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_loop(self) -> None:
+        # Изменения неудавшейся транзакции: уходят первыми в следующей и в исходном порядке
+        retry = []
+        # Сколько взятых из очереди элементов ещё не записано: flush ждёт и их
+        taken = 0
+        delay = self.retry_interval
+        # Неудачные попытки после вызова close: их число ограничено, чтобы остановка не зависла
+        close_failures = 0
+        stop = False
+        while True:
+            # Повтор не ждёт новых изменений: пауза уже выдержана
+            batch = self._next_batch(0 if retry else None) if not stop else []
+            taken += len(batch)
+            stop = stop or any(op is None for op in batch)
+            operations = retry + [op for op in batch if op is not None]
+            try:
+                if operations:
+                    self._commit(operations)
+            except Exception:
+                if stop:
+                    close_failures += 1
+                if close_failures >= CLOSE_ATTEMPTS:
+                    logger.exception(f"Изменения заказов не записаны в базу при остановке: {len(operations)}")
+                else:
+                    logger.exception(f"Не удалось записать в базу {len(operations)} изменений заказов, "
+                                     f"повторим через {delay:.1f} с")
+                    retry = operations
+                    if stop:
+                        time.sleep(self.retry_interval)
+                    else:
+                        # Остановка бота прерывает паузу: оставшиеся попытки сделает close
+                        self._closing.wait(delay)
+                    delay = min(delay * 2, MAX_RETRY_INTERVAL)
+                    continue
+            for _ in range(taken):
+                self._writes.task_done()
+            retry, taken, delay = [], 0, self.retry_interval
+            if stop:
+                return
+
+    def _commit(self, operations) -> None:
+        by_order_id = orders_table.c.order_id == bindparam('b_order_id')
+        statements = {
+            'insert': insert(orders_table),
+            'update': (update(orders_table).where(by_order_id)
+                       .values(status=bindparam('status'), completed_at=bindparam('completed_at'))),
+            'move': update(orders_table).where(by_order_id).values(station=bindparam('station')),
+        }
+        with self.engine.begin() as connection:
+            # Подряд идущие однотипные изменения уходят одним executemany
+            i = 0
+            while i < len(operations):
+                kind = operations[i][0]
+                j = i
+                while j < len(operations) and operations[j][0] == kind:
+                    j += 1
+                params = [values for _, values in operations[i:j]]
+                connection.execute(statements[kind], params)
+                i = j
+
+    def flush(self) -> None:
+        """Дождаться записи всех накопленных изменений. Пока база недоступна, ждёт повторов."""
+        self._writes.join()
+
+    def close(self) -> None:
+        self._closing.set()
+        self._writes.put(None)
+        self._writer.join()
+        self.engine.dispose()
@@ -0,0 +1,247 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import NetworkError, RetryAfter, TelegramError, TimedOut
+
+logger = logging.getLogger(__name__)
+
+# Сколько чатов помнить, прежде чем забыть лимиты тех, куда давно ничего не уходило
+MAX_TRACKED_CHATS = 10000
+
+
+class RateLimit:
+    """
+    Скользящее окно: не больше ``limit`` вызовов за любые ``period`` секунд.
+
+    Так же считает лимиты и Telegram, поэтому короткие всплески уходят сразу,
+    а при длительной нагрузке вызовы выравниваются по окну.
+    """
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.calls = deque()
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до следующего разрешённого вызова."""
+        while self.calls and self.calls[0] <= now - self.period:
+            self.calls.popleft()
+        return 0.0 if len(self.calls) < self.limit else self.calls[0] + self.period - now
+
+    def take(self, now: float) -> None:
+        self.calls.append(now)
+
+
+class _Call:
+    __slots__ = ('method', 'kwargs', 'future', 'attempt')
+
+    def __init__(self, method, kwargs):
+        self.method = method
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempt = 0
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих вызовов Telegram API.
+
+    Обработчик только ставит сообщение в очередь и сразу освобождает поток, а отправкой
+    занимаются несколько фоновых потоков. Очередь соблюдает общий лимит бота и лимиты
+    каждого чата (в группу - не больше 20 сообщений в минуту), сохраняет порядок сообщений
+    внутри чата, а при 429 и сетевых ошибках повторяет вызов с нарастающей паузой.
+    Вызовы, которые обработчики делают сами (ответы на нажатия и правки), учитываются
+    в тех же лимитах через ``acquire``.
+
+    :param global_limit: Сколько вызовов бот делает всего за период в секундах.
+    :param private_limit: Сколько сообщений уходит в один личный чат за период в секундах.
+    :param group_limit: Сколько сообщений уходит в одну группу за период в секундах.
+    :param max_retries: Сколько раз повторять вызов после сетевой ошибки.
+    :param backoff: Пауза перед первым повтором, каждая следующая вдвое длиннее.
+    :param workers: Сколько вызовов выполняется одновременно.
+    """
+
+    def __init__(self, global_limit: Tuple[int, float] = (25, 1), private_limit: Tuple[int, float] = (1, 1),
+                 group_limit: Tuple[int, float] = (20, 60), max_retries: int = 5, backoff: float = 0.5,
+                 workers: int = 4):
+        self.global_limit = RateLimit(*global_limit)
+        self.private_limit = private_limit
+        self.group_limit = group_limit
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.workers = workers
+
+        self.bot: Optional[Bot] = None
+        self._condition = threading.Condition()
+        self._pending: Dict[int, deque] = {}
+        self._limits: Dict[int, RateLimit] = {}
+        # Чаты, готовые к отправке: (время готовности, порядковый номер, chat_id).
+        # Чат, вызов в который уже выполняется, сюда не попадает - так сохраняется порядок.
+        self._ready = []
+        self._sequence = itertools.count()
+        self._threads = []
+        self._running = False
+
+    def start(self, bot: Bot) -> None:
+        self.bot = bot
+        self._running = True
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'outbound-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10) -> None:
+        """Дождаться отправки накопленных сообщений (не дольше ``timeout``) и остановить потоки."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._pending and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __len__(self) -> int:
+        with self._condition:
+            return sum(len(calls) for calls in self._pending.values())
+
+    def send_message(self, chat_id, text: str, **kwargs) -> Future:
+        return self._put('send_message', dict(kwargs, chat_id=chat_id, text=text))
+
+    def edit_message_text(self, chat_id, message_id: int, text: str, delay: float = 0.0, **kwargs) -> Future:
+        return self._put('edit_message_text', dict(kwargs, chat_id=chat_id, message_id=message_id, text=text), delay)
+
+    def edit_message_reply_markup(self, chat_id, message_id: int, delay: float = 0.0, **kwargs) -> Future:
+        return self._put('edit_message_reply_markup', dict(kwargs, chat_id=chat_id, message_id=message_id), delay)
+
+    def has_pending(self, chat_id: int) -> bool:
+        """Есть ли в очереди вызовы в этот чат."""
+        with self._condition:
+            return int(chat_id) in self._pending
+
+    def acquire(self, chat_id: Optional[int] = None, wait: bool = True) -> bool:
+        """
+        Учесть в лимитах вызов, который обработчик делает сам, минуя очередь.
+
+        :param chat_id: Чат, лимит которого тратит вызов, или None, если вызов тратит только общий лимит.
+        :param wait: Ждать, пока лимиты позволят вызов. Без ожидания сразу возвращает False.
+        :return: True, если вызов учтён и его можно делать.
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                limit = self._chat_limit(int(chat_id)) if chat_id is not None else None
+                delay = max(self.global_limit.delay(now), limit.delay(now) if limit is not None else 0.0)
+                if delay <= 0:
+                    self.global_limit.take(now)
+                    if limit is not None:
+                        limit.take(now)
+                    return True
+                if not wait:
+                    return False
+                self._condition.wait(delay)
+
+    def _put(self, method: str, kwargs: dict, delay: float = 0.0) -> Future:
+        call = _Call(method, kwargs)
+        chat_id = int(kwargs['chat_id'])
+        with self._condition:
+            calls = self._pending.get(chat_id)
+            if calls is None:
+                calls = self._pending[chat_id] = deque()
+                heapq.heappush(self._ready, (time.monotonic() + delay, next(self._sequence), chat_id))
+            calls.append(call)
+            self._condition.notify()
+        return call.future
+
+    def _chat_limit(self, chat_id: int) -> RateLimit:
+        limit = self._limits.get(chat_id)
+        if limit is None:
+            if len(self._limits) >= MAX_TRACKED_CHATS:
+                self._forget_idle_chats()
+            # У групп и каналов отрицательные идентификаторы
+            limit = self._limits[chat_id] = RateLimit(*(self.group_limit if chat_id < 0 else self.private_limit))
+        return limit
+
+    def _forget_idle_chats(self) -> None:
+        # Лимит чата, в который давно ничего не отправляли, больше ни на что не влияет
+        now = time.monotonic()
+        for chat_id, limit in list(self._limits.items()):
+            limit.delay(now)
+            if chat_id not in self._pending and not limit.calls:
+                del self._limits[chat_id]
+
+    def _next_call(self):
+        with self._condition:
+            while True:
+                if not self._running:
+                    return None, None
+                now = time.monotonic()
+                timeout = None
+                if self._ready:
+                    ready_at, _, chat_id = self._ready[0]
+                    wait = max(ready_at - now, self._chat_limit(chat_id).delay(now), self.global_limit.delay(now))
+                    if wait <= 0:
+                        heapq.heappop(self._ready)
+                        self._chat_limit(chat_id).take(now)
+                        self.global_limit.take(now)
+                        return chat_id, self._pending[chat_id][0]
+                    if wait > ready_at - now:
+                        # Чат упёрся в лимит - переносим его, чтобы не задерживать остальные
+                        heapq.heapreplace(self._ready, (now + wait, next(self._sequence), chat_id))
+                        continue
+                    timeout = wait
+                self._condition.wait(timeout)
+
+    def _work(self) -> None:
+        while True:
+            chat_id, call = self._next_call()
+            if call is None:
+                return
+
+            delay = 0.0
+            try:
+                result = getattr(self.bot, call.method)(**call.kwargs)
+            except RetryAfter as e:
+                logger.warning(f"Telegram просит подождать {e.retry_after} с перед отправкой в чат {chat_id}")
+                delay = e.retry_after
+            except (TimedOut, NetworkError) as e:
+                call.attempt += 1
+                if call.attempt > self.max_retries:
+                    logger.error(f"Не удалось выполнить {call.method} в чат {chat_id}: {e}")
+                    self._finish(chat_id, call, exception=e)
+                    continue
+                delay = self.backoff * 2 ** (call.attempt - 1)
+            except TelegramError as e:
+                # Ошибки в самом запросе повтор не исправит
+                logger.error(f"Telegram отклонил {call.method} в чат {chat_id}: {e}")
+                self._finish(chat_id, call, exception=e)
+                continue
+            else:
+                self._finish(chat_id, call, result=result)
+                continue
+
+            with self._condition:
+                heapq.heappush(self._ready, (time.monotonic() + delay, next(self._sequence), chat_id))
+                self._condition.notify()
+
+    def _finish(self, chat_id: int, call: _Call, result=None, exception=None) -> None:
+        with self._condition:
+            calls = self._pending[chat_id]
+            calls.popleft()
+            if calls:
+                heapq.heappush(self._ready, (time.monotonic(), next(self._sequence), chat_id))
+            else:
+                del self._pending[chat_id]
+            self._condition.notify_all()
+        if exception is not None:
+            call.future.set_exception(exception)
+        else:
+            call.future.set_result(result)
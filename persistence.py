@@ -0,0 +1,217 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import DefaultDict, Dict, Optional, Tuple
+
+from sqlalchemy import BigInteger, Column, Float, MetaData, String, Table, Text, delete, select, tuple_
+from sqlalchemy.dialects.sqlite import insert
+from telegram.ext import BasePersistence, ConversationHandler
+from telegram.utils.promise import Promise
+
+from metrics import Counter, Histogram
+from storage import create_storage_engine
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+user_data_table = Table(
+    'user_data', metadata,
+    Column('user_id', BigInteger, primary_key=True, autoincrement=False),
+    Column('data', Text, nullable=False),
+    Column('updated_at', Float, nullable=False),
+)
+
+conversations_table = Table(
+    'conversations', metadata,
+    Column('name', String, primary_key=True),
+    # Ключ разговора (chat_id, user_id) в виде JSON-списка
+    Column('key', String, primary_key=True),
+    Column('state', Text, nullable=False),
+    Column('updated_at', Float, nullable=False),
+)
+
+PERSISTENCE_FLUSH_SECONDS = Histogram('eastwoods_persistence_flush_seconds',
+                                      'Время записи накопленных изменений разговоров в базу')
+PERSISTENCE_ROWS = Counter('eastwoods_persistence_rows_total', 'Записанные строки состояния разговоров', ['table'])
+
+
+def _resolve_state(state) -> Tuple[Optional[object], bool]:
+    """
+    Превратить состояние разговора в значение, которое можно сохранить.
+
+    Обработчики с run_async оставляют в разговоре кортеж (прежнее состояние, Promise).
+    Пока Promise не выполнен, сохраняется прежнее состояние, а затем - его результат
+    по тем же правилам, что и в ConversationHandler.
+
+    :param state: Состояние из ConversationHandler.
+    :return: Состояние (None - разговор закончен) и признак того, что оно окончательное.
+    """
+    if not (isinstance(state, tuple) and len(state) == 2 and isinstance(state[1], Promise)):
+        return (None if state == ConversationHandler.END else state), True
+
+    old_state, promise = state
+    old_state, _ = _resolve_state(old_state)
+    if not promise.done.is_set():
+        return old_state, False
+    result = promise.result(0) if promise.exception is None else None
+    new_state = result if result is not None else old_state
+    return (None if new_state == ConversationHandler.END else new_state), True
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Хранение user_data и шагов разговора в локальной базе SQLite.
+
+    В отличие от PicklePersistence, который переписывает весь файл на каждое обновление,
+    здесь обработчик только сериализует данные одного пользователя и отмечает их изменившимися.
+    Фоновый поток раз в ``flush_interval`` секунд записывает одной транзакцией последнюю версию
+    каждой изменившейся записи, так что частые нажатия одного пользователя сливаются в одну запись.
+
+    :param path: Путь к файлу SQLite.
+    :param flush_interval: Как часто (в секундах) записывать накопленные изменения.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        super().__init__(store_user_data=True, store_chat_data=False, store_bot_data=False)
+        self.engine = create_storage_engine(path)
+        metadata.create_all(self.engine)
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Последнее записанное в базу представление user_data каждого пользователя
+        self._written_users: Dict[int, str] = {}
+        self._dirty_users: Dict[int, str] = {}
+        self._dirty_conversations: Dict[Tuple[str, str], object] = {}
+
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='persistence', daemon=True)
+        self._flusher.start()
+
+    # --- Чтение при старте ---
+
+    def get_user_data(self) -> DefaultDict[int, Dict]:
+        user_data = defaultdict(dict)
+        with self.engine.connect() as connection:
+            for row in connection.execute(select(user_data_table.c.user_id, user_data_table.c.data)):
+                user_data[row.user_id] = json.loads(row.data)
+                self._written_users[row.user_id] = row.data
+        if user_data:
+            logger.info(f"Восстановлены данные пользователей: {len(user_data)}")
+        return user_data
+
+    def get_chat_data(self) -> DefaultDict[int, Dict]:
+        return defaultdict(dict)
+
+    def get_bot_data(self) -> Dict:
+        return {}
+
+    def get_conversations(self, name: str) -> Dict:
+        query = select(conversations_table.c.key, conversations_table.c.state).where(conversations_table.c.name == name)
+        with self.engine.connect() as connection:
+            conversations = {tuple(json.loads(row.key)): json.loads(row.state)
+                             for row in connection.execute(query)}
+        if conversations:
+            logger.info(f"Восстановлены незавершённые разговоры {name}: {len(conversations)}")
+        return conversations
+
+    # --- Изменения от диспетчера ---
+
+    def update_user_data(self, user_id: int, data: Dict) -> None:
+        try:
+            serialized = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"user_data пользователя {user_id} не сохранить в JSON: {e}")
+            return
+        with self._lock:
+            # Обновление без изменений ничего не пишет
+            if self._dirty_users.get(user_id, self._written_users.get(user_id)) != serialized:
+                self._dirty_users[user_id] = serialized
+
+    def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        with self._lock:
+            self._dirty_conversations[(name, json.dumps(list(key)))] = new_state
+
+    def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    # --- Запись ---
+
+    def _flush_loop(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self._flush()
+            except Exception:
+                logger.exception("Не удалось записать состояние разговоров")
+
+    def _flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                users, self._dirty_users = self._dirty_users, {}
+                conversations, self._dirty_conversations = self._dirty_conversations, {}
+            if not users and not conversations:
+                return
+
+            started = time.perf_counter()
+            now = time.time()
+            saved, deleted, pending = [], [], {}
+            for (name, key), state in conversations.items():
+                value, final = _resolve_state(state)
+                if not final:
+                    # Обработчик ещё работает - проверим его результат при следующей записи
+                    pending[(name, key)] = state
+                if value is not None:
+                    saved.append({'name': name, 'key': key, 'state': json.dumps(value), 'updated_at': now})
+                elif final:
+                    deleted.append((name, key))
+
+            try:
+                with self.engine.begin() as connection:
+                    if users:
+                        statement = insert(user_data_table)
+                        connection.execute(statement.on_conflict_do_update(
+                            index_elements=[user_data_table.c.user_id],
+                            set_={'data': statement.excluded.data, 'updated_at': statement.excluded.updated_at}),
+                            [{'user_id': user_id, 'data': data, 'updated_at': now} for user_id, data in users.items()])
+                    if saved:
+                        statement = insert(conversations_table)
+                        connection.execute(statement.on_conflict_do_update(
+                            index_elements=[conversations_table.c.name, conversations_table.c.key],
+                            set_={'state': statement.excluded.state, 'updated_at': statement.excluded.updated_at}),
+                            saved)
+                    if deleted:
+                        connection.execute(delete(conversations_table).where(
+                            tuple_(conversations_table.c.name, conversations_table.c.key).in_(deleted)))
+            except Exception:
+                # Вернём изменения в очередь, не затирая более свежие
+                with self._lock:
+                    for user_id, data in users.items():
+                        self._dirty_users.setdefault(user_id, data)
+                    for conversation, state in conversations.items():
+                        self._dirty_conversations.setdefault(conversation, state)
+                raise
+
+            with self._lock:
+                self._written_users.update(users)
+                for conversation, state in pending.items():
+                    self._dirty_conversations.setdefault(conversation, state)
+
+        PERSISTENCE_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        PERSISTENCE_ROWS.labels('user_data').inc(len(users))
+        PERSISTENCE_ROWS.labels('conversations').inc(len(saved) + len(deleted))
+
+    def flush(self) -> None:
+        """Записать все накопленные изменения. Вызывается Updater при остановке."""
+        self._flush()
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._flusher.join()
+        self._flush()
+        self.engine.dispose()
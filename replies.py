@@ -0,0 +1,217 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Hashable, Optional, Tuple
+
+from telegram import CallbackQuery, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+from metrics import Counter, current_handler
+from outbound import OutboundQueue
+
+logger = logging.getLogger(__name__)
+
+BOT_CALLS = Counter('eastwoods_bot_calls_total', 'Вызовы Bot API из обработчиков нажатий', ['handler', 'method'])
+BOT_CALLS_SAVED = Counter('eastwoods_bot_calls_saved_total', 'Вызовы Bot API, без которых обошлись обработчики нажатий',
+                          ['handler', 'method'])
+
+# Сколько замков на все сообщения: правки одного сообщения всегда попадают под один замок
+LOCK_STRIPES = 64
+
+Rendering = Tuple[str, Optional[InlineKeyboardMarkup]]
+
+
+class CallbackReplies:
+    """
+    Ответы на нажатия кнопок: ответ на callback и правка сообщения с кнопкой.
+
+    Помнит, какой текст и какую клавиатуру бот последним показал в каждом сообщении, и не
+    отправляет правку, которая ничего не меняет: Telegram всё равно отклонил бы её с ошибкой
+    «message is not modified». Если изменилась только клавиатура, уходит лёгкий
+    editMessageReplyMarkup без текста. Для сообщений, которых нет в памяти (например, после
+    перезапуска), сравнение идёт с тем, что пришло вместе с нажатием.
+
+    Bot API не умеет отвечать на callback и править сообщение одним вызовом, поэтому
+    короткие сообщения об ошибках уходят всплывающим текстом ответа, а не отдельной правкой.
+    В режиме webhook ответ на callback передаётся в ответе на сам запрос с нажатием
+    (см. webhook.py) и отдельного вызова не требует.
+
+    Вызовы расходуют лимиты очереди исходящих вызовов ``outbox``: общий лимит бота, а правки
+    в группах - ещё и лимит группы. Правка, которой не хватило лимита группы или на которую
+    Telegram ответил 429, уходит в очередь и выполняется там в свой черёд, не задерживая обработчик.
+
+    Все вызовы и сэкономленные вызовы считаются по обработчикам.
+
+    :param max_size: Сколько сообщений помнить. Давно не менявшиеся забываются первыми.
+    :param outbox: Очередь исходящих вызовов, чьи лимиты соблюдать, или None - без лимитов.
+    """
+
+    def __init__(self, max_size: int = 10000, outbox: Optional[OutboundQueue] = None):
+        self.max_size = max_size
+        self.outbox = outbox
+        self._rendered: 'OrderedDict[Hashable, Rendering]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._message_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        # Нажатия, ответ на которые ждёт запрос webhook
+        self._webhook_answers: Dict[str, Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._rendered)
+
+    def answer(self, query: CallbackQuery, notice: Optional[str] = None) -> None:
+        """
+        Ответить на нажатие, чтобы у кнопки пропали часики.
+
+        :param query: Нажатие.
+        :param notice: Всплывающий текст или None.
+        """
+        with self._lock:
+            webhook_answer = self._webhook_answers.pop(query.id, None)
+            if webhook_answer is not None:
+                method = {'method': 'answerCallbackQuery', 'callback_query_id': query.id}
+                if notice:
+                    method['text'] = notice
+                webhook_answer.set_result(method)
+        if webhook_answer is not None:
+            self._saved('answerCallbackQuery')
+            return
+        self._count('answerCallbackQuery')
+        if self.outbox is not None:
+            self.outbox.acquire()
+        try:
+            query.answer(notice)
+        except RetryAfter as e:
+            # Запоздалый ответ уже не нужен: часики у кнопки пропадут сами
+            logger.warning(f"Ответ на нажатие {query.id} не отправлен, Telegram просит подождать {e.retry_after} с")
+
+    def expect_webhook_answer(self, query_id: str) -> Future:
+        """
+        Передать ответ на нажатие в запрос webhook, который его доставил.
+
+        :param query_id: Идентификатор нажатия.
+        :return: Future, в котором появится вызов answerCallbackQuery для ответа на запрос.
+        """
+        answer = Future()
+        with self._lock:
+            self._webhook_answers[query_id] = answer
+        return answer
+
+    def cancel_webhook_answer(self, query_id: str) -> bool:
+        """
+        Перестать ждать ответа в запросе webhook: обработчик ответит обычным вызовом.
+
+        :return: False, если ответ уже готов и его нужно взять из Future.
+        """
+        with self._lock:
+            return self._webhook_answers.pop(query_id, None) is not None
+
+    def edit(self, query: CallbackQuery, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+             notice: Optional[str] = None) -> None:
+        """
+        Ответить на нажатие и показать в его сообщении новый текст и клавиатуру.
+
+        :param query: Нажатие.
+        :param text: Текст сообщения.
+        :param reply_markup: Клавиатура или None, чтобы убрать кнопки.
+        :param notice: Всплывающий текст ответа или None.
+        """
+        self.answer(query, notice)
+
+        key = self._key(query)
+        # Правки одного сообщения не обгоняют друг друга, иначе в памяти осталась бы не последняя
+        with self._message_locks[hash(key) % LOCK_STRIPES]:
+            shown = self._shown(key, query)
+            if shown == (text, reply_markup):
+                self._saved('editMessageText')
+                return
+            markup_only = shown is not None and shown[0] == text
+            self._count('editMessageReplyMarkup' if markup_only else 'editMessageText')
+            if not self._acquire(query):
+                self._queue_edit(key, query, text, reply_markup, markup_only)
+                return
+            try:
+                if markup_only:
+                    query.edit_message_reply_markup(reply_markup=reply_markup)
+                else:
+                    query.edit_message_text(text=text, reply_markup=reply_markup)
+            except RetryAfter as e:
+                if self.outbox is None or query.message is None:
+                    self.forget(key)
+                    raise
+                logger.warning(f"Правка сообщения {key} отложена на {e.retry_after} с по просьбе Telegram")
+                self._queue_edit(key, query, text, reply_markup, markup_only, e.retry_after)
+                return
+            except BadRequest as e:
+                if 'not modified' not in str(e).lower():
+                    self.forget(key)
+                    raise
+                # В сообщении уже то, что нужно, хотя бот об этом не знал
+                logger.debug(f"Сообщение {key} уже показывает нужный текст")
+            except Exception:
+                self.forget(key)
+                raise
+            self._remember(key, (text, reply_markup))
+
+    def _acquire(self, query: CallbackQuery) -> bool:
+        if self.outbox is None:
+            return True
+        chat_id = query.message.chat.id if query.message is not None else None
+        if chat_id is not None and self.outbox.has_pending(chat_id):
+            # Правка не должна обогнать отложенные вызовы в тот же чат
+            return False
+        # Лимит чата тратят только правки в группах: в личном чате лимит в сообщение в секунду
+        # не дал бы покупателю нажимать кнопки быстрее
+        if chat_id is None or chat_id >= 0:
+            return self.outbox.acquire()
+        return self.outbox.acquire(chat_id, wait=False)
+
+    def _queue_edit(self, key: Hashable, query: CallbackQuery, text: str,
+                    reply_markup: Optional[InlineKeyboardMarkup], markup_only: bool, delay: float = 0.0) -> None:
+        message = query.message
+        if markup_only:
+            future = self.outbox.edit_message_reply_markup(message.chat.id, message.message_id, delay=delay,
+                                                           reply_markup=reply_markup)
+        else:
+            future = self.outbox.edit_message_text(message.chat.id, message.message_id, text, delay=delay,
+                                                   reply_markup=reply_markup)
+        # Сообщение покажет новый текст, когда очередь дойдёт до правки; если правка не удастся, забываем его
+        self._remember(key, (text, reply_markup))
+
+        def forget_on_error(done: Future) -> None:
+            if done.exception() is not None:
+                self.forget(key)
+
+        future.add_done_callback(forget_on_error)
+
+    def forget(self, key: Hashable) -> None:
+        with self._lock:
+            self._rendered.pop(key, None)
+
+    @staticmethod
+    def _key(query: CallbackQuery) -> Hashable:
+        if query.message is None:
+            return 'inline', query.inline_message_id
+        return query.message.chat.id, query.message.message_id
+
+    def _shown(self, key: Hashable, query: CallbackQuery) -> Optional[Rendering]:
+        with self._lock:
+            rendered = self._rendered.get(key)
+        if rendered is not None or query.message is None:
+            return rendered
+        return query.message.text, query.message.reply_markup
+
+    def _remember(self, key: Hashable, rendered: Rendering) -> None:
+        with self._lock:
+            self._rendered[key] = rendered
+            self._rendered.move_to_end(key)
+            if len(self._rendered) > self.max_size:
+                self._rendered.popitem(last=False)
+
+    @staticmethod
+    def _count(method: str) -> None:
+        BOT_CALLS.labels(current_handler(), method).inc()
+
+    @staticmethod
+    def _saved(method: str) -> None:
+        BOT_CALLS_SAVED.labels(current_handler(), method).inc()
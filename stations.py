@@ -0,0 +1,66 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+@dataclass(frozen=True)
+class Station:
+    """
+    Стойка баристы: свой чат и своя очередь заказов.
+
+    :param name: Название стойки, которое видит покупатель. Хранится в заказе, поэтому не должно меняться.
+    :param chat_id: Чат баристы этой стойки.
+    """
+    name: str
+    chat_id: int
+
+
+# Название единственной стойки, если в конфиге указан только barista_chat_id
+DEFAULT_STATION_NAME = 'Кофейня'
+
+
+def parse_stations(telegram_config: Dict) -> List[Station]:
+    """
+    Прочитать стойки из раздела telegram_bot конфига.
+
+    Стойки перечисляются в ``stations`` как список с ``name`` и ``chat_id``. Без этого раздела
+    бот работает с одной стойкой в чате ``barista_chat_id``, как раньше.
+
+    :param telegram_config: Раздел telegram_bot.
+    :return: Стойки в порядке конфига.
+    :raises ValueError: Если стоек нет или названия либо чаты повторяются.
+    """
+    entries = telegram_config.get('stations')
+    if entries is None:
+        entries = [{'name': DEFAULT_STATION_NAME, 'chat_id': telegram_config['barista_chat_id']}]
+    stations = [Station(str(entry['name']), int(entry['chat_id'])) for entry in entries]
+    if not stations:
+        raise ValueError("В конфиге не указано ни одной стойки баристы")
+    for attribute in ('name', 'chat_id'):
+        values = [getattr(station, attribute) for station in stations]
+        duplicates = sorted({str(value) for value in values if values.count(value) > 1})
+        if duplicates:
+            raise ValueError(f"Повторяются {attribute} стоек: {', '.join(duplicates)}")
+    return stations
+
+
+def least_loaded(stations: Sequence[Station], queue_length: Callable[[str], int]) -> Station:
+    """
+    Стойка с самой короткой очередью. При равенстве выбирается та, что раньше в конфиге.
+
+    :param stations: Стойки.
+    :param queue_length: Число открытых заказов стойки по её названию.
+    """
+    return min(stations, key=lambda station: queue_length(station.name))
+
+
+def station_by_index(stations: Sequence[Station], index: str) -> Optional[Station]:
+    """
+    Стойка по номеру из callback_data кнопки подтверждения.
+
+    :return: Стойка или None, если номер неверный (например, после изменения конфига).
+    """
+    try:
+        position = int(index)
+    except ValueError:
+        return None
+    return stations[position] if 0 <= position < len(stations) else None
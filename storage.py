@@ -0,0 +1,24 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+
+def create_storage_engine(path: str) -> Engine:
+    """
+    Создать движок SQLAlchemy для локальной базы бота.
+
+    База работает в режиме WAL: читатели не ждут писателя, а fsync выполняется
+    при контрольных точках, а не на каждый коммит.
+
+    :param path: Путь к файлу SQLite.
+    :return: Движок SQLAlchemy.
+    """
+    engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    return engine
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import logging
+from queue import Queue
+
+import tornado.web
+from telegram import Bot, Update
+from telegram.ext import updater as updater_module
+from telegram.utils.webhookhandler import WebhookAppClass, WebhookHandler
+
+from replies import CallbackReplies
+
+logger = logging.getLogger(__name__)
+
+
+class AnsweringWebhookHandler(WebhookHandler):
+    """
+    Приём обновлений по webhook с ответом на нажатие прямо в ответе на запрос.
+
+    Telegram разрешает ответить на запрос webhook одним вызовом Bot API. Для нажатия кнопки
+    запрос держится открытым, пока обработчик не ответит на callback (не дольше
+    ``answer_timeout`` секунд), и answerCallbackQuery уходит в теле ответа, а не отдельным запросом.
+    Если обработчик не успел, запрос завершается пустым ответом, а обработчик отвечает сам.
+    """
+
+    def initialize(self, bot: Bot, update_queue: Queue, replies: CallbackReplies = None,
+                   answer_timeout: float = 1.0) -> None:
+        super().initialize(bot, update_queue)
+        self.replies = replies
+        self.answer_timeout = answer_timeout
+
+    async def post(self) -> None:
+        self._validate_post()
+        update = Update.de_json(json.loads(self.request.body.decode()), self.bot)
+        self.set_status(200)
+        if update is None:
+            return
+        query = update.callback_query
+        if query is None:
+            self.update_queue.put(update)
+            return
+
+        answer = self.replies.expect_webhook_answer(query.id)
+        self.update_queue.put(update)
+        try:
+            method = await asyncio.wait_for(asyncio.wrap_future(answer), self.answer_timeout)
+        except asyncio.TimeoutError:
+            if self.replies.cancel_webhook_answer(query.id):
+                logger.debug(f"Обработчик не ответил на нажатие {query.id} за {self.answer_timeout} с")
+                return
+            # Ответ появился одновременно с таймаутом
+            method = answer.result()
+        self.write(method)
+
+
+class AnsweringWebhookApp(WebhookAppClass):
+    def __init__(self, webhook_path: str, bot: Bot, update_queue: Queue, replies: CallbackReplies,
+                 answer_timeout: float):
+        self.shared_objects = {'bot': bot, 'update_queue': update_queue, 'replies': replies,
+                               'answer_timeout': answer_timeout}
+        tornado.web.Application.__init__(self, [(rf'{webhook_path}/?', AnsweringWebhookHandler, self.shared_objects)])
+
+
+def answer_in_webhook_responses(replies: CallbackReplies, answer_timeout: float = 1.0) -> None:
+    """
+    Отвечать на нажатия в ответах на запросы webhook. Вызывается до ``Updater.start_webhook``.
+
+    python-telegram-bot 13 не даёт передать свой обработчик запросов, поэтому подменяется
+    класс приложения, который Updater создаёт при запуске webhook.
+
+    :param replies: Ответы на нажатия, через которые обработчики отвечают на callback.
+    :param answer_timeout: Сколько секунд держать запрос в ожидании ответа обработчика.
+    """
+    def app(webhook_path: str, bot: Bot, update_queue: Queue) -> AnsweringWebhookApp:
+        return AnsweringWebhookApp(webhook_path, bot, update_queue, replies, answer_timeout)
+
+    updater_module.WebhookAppClass = app